@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the publisher against synthetic Gadgetbridge databases.
+For each database size it times publisher startup, taking a snapshot, every sensor query of each
+watch profile, each analytics engine (sleep, heart rate zones, activity trends) as one stage, and a
+full publish cycle into a fake MQTT client. The sensors share the engine results of a snapshot, so
+they are dropped before every repeat: a sensor backed by an engine is timed with the engine run it
+triggers. Every database size gets a fresh STATE_DIR. Runs offline. Results are written
+as JSON with stable keys, so two runs can be compared with --compare.
+
+Example:
+    python bench/benchmark.py --days 7,90,365 --profiles colmi,pinetime --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.join(os.path.dirname(BENCH_DIR), "python")
+sys.path.insert(0, PYTHON_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+logging.basicConfig(level=logging.WARNING)  # before main.py configures INFO logging
+
+from fake_mqtt import FakeMQTTClient  # noqa: E402
+from generate_db import generate  # noqa: E402
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 6)
+
+
+def make_publisher(db_path, device, state_dir):
+    """Construct a publisher the way the container does, from environment variables."""
+    os.environ.update({
+        "GADGETBRIDGE_DB_PATH": db_path,
+        "WATCH_TYPE": device["watch_type"],
+        "MAC_ADDRESS": device["mac_address"],
+        "STATE_DIR": state_dir,
+    })
+    from main import GadgetbridgeMQTTPublisher
+    cwd = os.getcwd()
+    os.chdir(PYTHON_DIR)  # watch profiles are loaded relative to the working directory
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return GadgetbridgeMQTTPublisher()
+    finally:
+        os.chdir(cwd)
+
+
+def bench_device(db_path, device, repeat, state_dir):
+    from main import open_db_snapshot
+    result = {"watch_type": device["watch_type"], "mac_address": device["mac_address"]}
+    start = time.perf_counter()
+    publisher = make_publisher(db_path, device, state_dir)
+    result["startup_s"] = round(time.perf_counter() - start, 6)
+
+    def snapshot():
+        with open_db_snapshot(db_path):
+            pass
+    result["snapshot_s"] = median_time(snapshot, repeat)
+
+    def fresh(fn):
+        def timed():
+            publisher.forget_snapshot_results()   # otherwise only the first repeat runs the engine
+            fn()
+        return timed
+
+    queries, analytics = {}, {}
+    with open_db_snapshot(db_path) as conn:
+        cursor = conn.cursor()
+        for kind in publisher.analytics_kinds():
+            try:
+                analytics[kind] = median_time(fresh(lambda: publisher.analytics(kind, cursor)), repeat)
+            except Exception as e:
+                analytics[kind] = f"error: {e}"
+        for sensor in publisher.sensors:
+            try:
+                queries[sensor["unique_id"]] = median_time(fresh(lambda: sensor["query"](cursor)), repeat)
+            except Exception as e:
+                queries[sensor["unique_id"]] = f"error: {e}"
+    result["analytics_s"] = analytics
+    result["queries_s"] = queries
+
+    client = FakeMQTTClient()
+    publisher.mqtt_session.client = client
+
+    async def cycles():
+        times = []
+        for _ in range(repeat):
+            client.clear()
+            publisher.forget_published()   # measure a full publish, not just the changed values
+            start = time.perf_counter()
+            await publisher.publish_cycle()
+            times.append(time.perf_counter() - start)
+        return times
+    result["cycle_s"] = round(statistics.median(asyncio.run(cycles())), 6)
+    result["cycle_messages"] = len(client.messages)
+    result["cycle_payload_bytes"] = client.payload_bytes
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return None
+
+
+def run(days_list, profiles, devices, repeat, seed, db_path=None):
+    results = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for days in days_list:
+            path = db_path or os.path.join(tmp, f"Gadgetbridge_{days}d.db")
+            start = time.perf_counter()
+            info = generate(path, days=days, profiles=profiles, devices=devices, seed=seed)
+            run_result = {
+                "days": days,
+                "db_bytes": info["bytes"],
+                "rows": info["rows"],
+                "generate_s": round(time.perf_counter() - start, 3),
+                "devices": [],
+            }
+            state_dir = tempfile.mkdtemp(prefix=f"state_{days}d_", dir=tmp)   # no state carried over between sizes
+            for device in info["devices"]:
+                try:
+                    run_result["devices"].append(bench_device(path, device, repeat, state_dir))
+                except Exception as e:
+                    run_result["devices"].append({**device, "error": repr(e)})
+            results["runs"].append(run_result)
+            print(f"{days} days: {info['bytes'] / 1e6:.1f} MB", file=sys.stderr)
+    return results
+
+
+def flatten(results):
+    """Map each numeric timing to a stable key such as '365d/colmi/02:00:00:00:00:01/queries_s/daily_steps'."""
+    flat = {}
+    for run_result in results["runs"]:
+        for device in run_result["devices"]:
+            prefix = f"{run_result['days']}d/{device['watch_type']}/{device['mac_address']}"
+            for key, value in device.items():
+                if isinstance(value, dict):
+                    for name, sub in value.items():
+                        if isinstance(sub, (int, float)):
+                            flat[f"{prefix}/{key}/{name}"] = sub
+                elif key.endswith("_s") and isinstance(value, (int, float)):
+                    flat[f"{prefix}/{key}"] = value
+    return flat
+
+
+def compare(old, new):
+    before, after = flatten(old), flatten(new)
+    for key in sorted(before.keys() & after.keys()):
+        ratio = after[key] / before[key] if before[key] else float("inf")
+        flag = "  <-- slower" if ratio > 1.25 else ""
+        print(f"{key:80s} {before[key]:10.6f} -> {after[key]:10.6f}  x{ratio:5.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", default="7,90,365", help="Comma separated database sizes in days")
+    parser.add_argument("--profiles", default="colmi,moyoung,garmin,pinetime,amazfitbips")
+    parser.add_argument("--devices", type=int, default=1, help="Devices per profile")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    results = run([int(d) for d in args.days.split(",")], args.profiles.split(","),
+                  args.devices, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Size and speed of backfill batches as JSON and in the binary layout of python/batch_encoding.py.
+Reads the backfilled sample tables of each watch profile from a synthetic database in batches of each
+size, the way the backfill stage does, and times encoding (json.dumps vs encode_batch) and decoding
+(json.loads vs the reference decode_batch) per batch. Sizes are bytes per row of payload.
+
+Example:
+    python bench/encoding.py --days 7 --batch-sizes 500,5000 --output encoding.json
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+from benchmark import make_publisher, median_time  # also puts ../python on sys.path
+from generate_db import generate
+
+from batch_encoding import decode_batch, encode_batch
+from sample_stream import iter_sample_batches, timestamp_scale
+
+
+def json_payload(stream, columns, rows, scale):
+    return json.dumps({"stream": stream, "columns": columns, "timestamp_unit": "ms" if scale == 1000 else "s",
+                       "samples": rows})
+
+
+def measure(conn, stream, table, columns, batch_size, repeat):
+    cursor = conn.cursor()
+    scale = timestamp_scale(cursor, table)
+    batches = list(iter_sample_batches(cursor, table, columns, 0, batch_size))
+    rows = sum(len(b) for b in batches)
+    as_json = [json_payload(stream, columns, b, scale) for b in batches]
+    as_binary = [encode_batch(stream, columns, b, scale) for b in batches]
+    for batch, binary in zip(batches, as_binary):
+        assert decode_batch(binary)["samples"] == [list(r) for r in batch], "binary batch does not round-trip"
+
+    def per_batch(fn):
+        return round(median_time(fn, repeat) / len(batches) * 1e6, 1)
+
+    result = {"rows": rows, "batches": len(batches)}
+    result["json"] = {
+        "bytes_per_row": round(sum(len(p) for p in as_json) / rows, 2),
+        "encode_us": per_batch(lambda: [json_payload(stream, columns, b, scale) for b in batches]),
+        "decode_us": per_batch(lambda: [json.loads(p) for p in as_json]),
+    }
+    result["binary"] = {
+        "bytes_per_row": round(sum(len(p) for p in as_binary) / rows, 2),
+        "encode_us": per_batch(lambda: [encode_batch(stream, columns, b, scale) for b in batches]),
+        "decode_us": per_batch(lambda: [decode_batch(p) for p in as_binary]),
+    }
+    result["size_ratio"] = round(result["binary"]["bytes_per_row"] / result["json"]["bytes_per_row"], 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=7, help="Size of the synthetic database")
+    parser.add_argument("--profiles", default="colmi,garmin")
+    parser.add_argument("--batch-sizes", default="500,5000", help="Comma separated rows per batch")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the median is reported")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "Gadgetbridge.db")
+        devices = generate(db_path, days=args.days, profiles=args.profiles.split(","))["devices"]
+        conn = sqlite3.connect(db_path)
+        for device in devices:
+            for stream, table, columns in make_publisher(db_path, device, os.path.join(tmp, "state")).backfill_streams():
+                for size in (int(s) for s in args.batch_sizes.split(",")):
+                    key = f"{device['watch_type']}/{stream}/{size}"
+                    report[key] = measure(conn, stream, table, columns, size, args.repeat)
+        conn.close()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""
+Stand-in for aiomqtt.Client that records publishes instead of sending them, for offline benchmarks.
+"""
+
+
+class FakeMQTTClient:
+    def __init__(self):
+        self.messages = []   # (topic, payload, qos, retain)
+
+    async def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+        self.messages.append((topic, payload, qos, retain))
+
+    async def subscribe(self, topic, *args, **kwargs):
+        pass
+
+    @property
+    def payload_bytes(self):
+        return sum(len(p if isinstance(p, bytes) else str(p).encode()) for _, p, _, _ in self.messages)
+
+    def clear(self):
+        self.messages.clear()
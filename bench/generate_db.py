@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Synthetic Gadgetbridge database generator.
+Builds a Gadgetbridge.db with the tables used by the watch profiles in ../python, filled with
+per-minute samples that follow a daily pattern (sleep at night, walks during the day, a battery that
+drains and gets recharged). Sizes run from a few days to years, with any number of devices.
+
+Example:
+    python bench/generate_db.py --out /tmp/Gadgetbridge.db --days 365 --profiles colmi,pinetime --devices 2
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+
+# Timestamps follow Gadgetbridge: activity samples and battery levels use seconds, the
+# heart rate / SpO2 / sleep stage / Xiaomi summary samples use milliseconds.
+
+ACTIVITY_COLUMNS = (
+    '"TIMESTAMP" INTEGER NOT NULL, "DEVICE_ID" INTEGER NOT NULL, "USER_ID" INTEGER NOT NULL, '
+    '"RAW_INTENSITY" INTEGER NOT NULL, "STEPS" INTEGER NOT NULL, "RAW_KIND" INTEGER NOT NULL, '
+    '"HEART_RATE" INTEGER NOT NULL'
+)
+TIME_SAMPLE_COLUMNS = '"TIMESTAMP" INTEGER NOT NULL, "DEVICE_ID" INTEGER NOT NULL, "USER_ID" INTEGER NOT NULL'
+SAMPLE_KEY = 'PRIMARY KEY ("TIMESTAMP", "DEVICE_ID") ON CONFLICT REPLACE) WITHOUT ROWID'
+
+SCHEMAS = {
+    "DEVICE": 'CREATE TABLE "DEVICE" ("_id" INTEGER PRIMARY KEY AUTOINCREMENT, "NAME" TEXT NOT NULL, '
+              '"MANUFACTURER" TEXT NOT NULL, "IDENTIFIER" TEXT NOT NULL UNIQUE, "TYPE" INTEGER NOT NULL, '
+              '"MODEL" TEXT, "ALIAS" TEXT, "PARENT_FOLDER" TEXT)',
+    "USER": 'CREATE TABLE "USER" ("_id" INTEGER PRIMARY KEY AUTOINCREMENT, "NAME" TEXT NOT NULL, '
+            '"BIRTHDAY" INTEGER NOT NULL, "GENDER" INTEGER NOT NULL)',
+    "BASE_ACTIVITY_SUMMARY": 'CREATE TABLE "BASE_ACTIVITY_SUMMARY" ("_id" INTEGER PRIMARY KEY AUTOINCREMENT, '
+                             '"NAME" TEXT, "START_TIME" INTEGER NOT NULL, "END_TIME" INTEGER NOT NULL, '
+                             '"ACTIVITY_KIND" INTEGER NOT NULL, "BASE_LONGITUDE" INTEGER, "BASE_LATITUDE" INTEGER, '
+                             '"BASE_ALTITUDE" INTEGER, "GPX_TRACK" TEXT, "RAW_DETAILS_PATH" TEXT, '
+                             '"DEVICE_ID" INTEGER NOT NULL, "USER_ID" INTEGER NOT NULL, "SUMMARY_DATA" TEXT, '
+                             '"RAW_SUMMARY_DATA" BLOB)',
+    "BATTERY_LEVEL": 'CREATE TABLE "BATTERY_LEVEL" ("TIMESTAMP" INTEGER NOT NULL, "DEVICE_ID" INTEGER NOT NULL, '
+                     '"LEVEL" INTEGER NOT NULL, "BATTERY_INDEX" INTEGER NOT NULL, '
+                     'PRIMARY KEY ("TIMESTAMP", "DEVICE_ID", "BATTERY_INDEX") ON CONFLICT REPLACE) WITHOUT ROWID',
+    "COLMI_ACTIVITY_SAMPLE": f'CREATE TABLE "COLMI_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, '
+                             f'"CALORIES" INTEGER NOT NULL, "DISTANCE" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "COLMI_HEART_RATE_SAMPLE": f'CREATE TABLE "COLMI_HEART_RATE_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                               f'"HEART_RATE" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "COLMI_SPO2_SAMPLE": f'CREATE TABLE "COLMI_SPO2_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                         f'"SPO2" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "COLMI_SLEEP_STAGE_SAMPLE": f'CREATE TABLE "COLMI_SLEEP_STAGE_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                                f'"DURATION" INTEGER NOT NULL, "STAGE" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "MOYOUNG_ACTIVITY_SAMPLE": f'CREATE TABLE "MOYOUNG_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, '
+                               f'"DATA_SOURCE" INTEGER NOT NULL, "CALORIES_BURNT" INTEGER NOT NULL, '
+                               f'"DISTANCE_METERS" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "MOYOUNG_HEART_RATE_SAMPLE": f'CREATE TABLE "MOYOUNG_HEART_RATE_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                                 f'"HEART_RATE" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "MOYOUNG_SPO2_SAMPLE": f'CREATE TABLE "MOYOUNG_SPO2_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                           f'"SPO2" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "MOYOUNG_SLEEP_STAGE_SAMPLE": f'CREATE TABLE "MOYOUNG_SLEEP_STAGE_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                                  f'"DURATION" INTEGER NOT NULL, "STAGE" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "GARMIN_ACTIVITY_SAMPLE": f'CREATE TABLE "GARMIN_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, '
+                              f'"DISTANCE_CM" INTEGER NOT NULL, "ACTIVE_CALORIES" INTEGER NOT NULL, {SAMPLE_KEY}',
+    "PINE_TIME_ACTIVITY_SAMPLE": f'CREATE TABLE "PINE_TIME_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, {SAMPLE_KEY}',
+    "MI_BAND_ACTIVITY_SAMPLE": f'CREATE TABLE "MI_BAND_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, {SAMPLE_KEY}',
+    "XIAOMI_ACTIVITY_SAMPLE": f'CREATE TABLE "XIAOMI_ACTIVITY_SAMPLE" ({ACTIVITY_COLUMNS}, '
+                              f'"STRESS" INTEGER, "SPO2" INTEGER, {SAMPLE_KEY}',
+    "XIAOMI_DAILY_SUMMARY_SAMPLE": f'CREATE TABLE "XIAOMI_DAILY_SUMMARY_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                                   f'"TIMEZONE" INTEGER, "STEPS" INTEGER, "HR_RESTING" INTEGER, "HR_MAX" INTEGER, '
+                                   f'"HR_MIN" INTEGER, "HR_AVG" INTEGER, "CALORIES" INTEGER, {SAMPLE_KEY}',
+    "XIAOMI_SLEEP_TIME_SAMPLE": f'CREATE TABLE "XIAOMI_SLEEP_TIME_SAMPLE" ({TIME_SAMPLE_COLUMNS}, '
+                                f'"WAKEUP_TIME" INTEGER, "IS_AWAKE" INTEGER, "TOTAL_DURATION" INTEGER, '
+                                f'"DEEP_SLEEP_DURATION" INTEGER, "LIGHT_SLEEP_DURATION" INTEGER, '
+                                f'"REM_SLEEP_DURATION" INTEGER, "AWAKE_DURATION" INTEGER, {SAMPLE_KEY}',
+}
+
+# Per watch profile: the DEVICE row and which tables get samples, matching python/<profile>.py
+PROFILES = {
+    "colmi": {
+        "device": ("Colmi R02", "Colmi", 470),
+        "activity": ("COLMI_ACTIVITY_SAMPLE", "colmi"),
+        "heart_rate": "COLMI_HEART_RATE_SAMPLE",
+        "spo2": "COLMI_SPO2_SAMPLE",
+        "sleep": "COLMI_SLEEP_STAGE_SAMPLE",
+    },
+    "moyoung": {
+        "device": ("Colmi V72", "Moyoung", 400),
+        "activity": ("MOYOUNG_ACTIVITY_SAMPLE", "moyoung"),
+        "heart_rate": "MOYOUNG_HEART_RATE_SAMPLE",
+        "spo2": "MOYOUNG_SPO2_SAMPLE",
+        "sleep": "MOYOUNG_SLEEP_STAGE_SAMPLE",
+    },
+    "garmin": {
+        "device": ("Forerunner 255", "Garmin", 500),
+        "activity": ("GARMIN_ACTIVITY_SAMPLE", "garmin"),
+        "spo2": "MOYOUNG_SPO2_SAMPLE",  # garmin.py reads SpO2 from this table
+    },
+    "pinetime": {
+        "device": ("InfiniTime", "Pine64", 190),
+        "activity": ("PINE_TIME_ACTIVITY_SAMPLE", "plain"),
+    },
+    "amazfitbips": {
+        "device": ("Amazfit Bip S", "Huami", 41),
+        "activity": ("MI_BAND_ACTIVITY_SAMPLE", "plain"),
+    },
+    "xiaomi": {
+        "device": ("Xiaomi Smart Band 8", "Xiaomi", 600),
+        "activity": ("XIAOMI_ACTIVITY_SAMPLE", "xiaomi"),
+        "xiaomi": True,
+    },
+}
+
+
+def mac_for(index):
+    return "02:00:00:00:{:02X}:{:02X}".format(index // 256, index % 256)
+
+
+def create_schema(conn, tables):
+    for table in ("DEVICE", "USER", "BATTERY_LEVEL", "BASE_ACTIVITY_SUMMARY", *sorted(tables)):
+        conn.execute(SCHEMAS[table])
+
+
+def minute_state(rng, ts, sleep_start, sleep_end):
+    """Steps and heart rate for one minute of the day, given tonight's sleep window (minutes of day)."""
+    minute = (ts // 60) % 1440
+    asleep = minute >= sleep_start or minute < sleep_end
+    if asleep:
+        return 0, rng.randint(48, 62), True
+    if rng.random() < 0.25:
+        return rng.randint(40, 130), rng.randint(90, 135), False
+    return rng.randint(0, 12), rng.randint(62, 85), False
+
+
+def activity_rows(rng, kind, device_id, start, end, nights):
+    for ts in range(start, end, 60):
+        day = (ts - start) // 86400
+        steps, hr, asleep = minute_state(rng, ts, *nights[day])
+        if rng.random() < 0.02:
+            hr = 255  # Gadgetbridge's "no reading"
+        intensity = 0 if asleep else min(255, steps * 2)
+        raw_kind = 112 if asleep else 1
+        base = (ts, device_id, 1, intensity, steps, raw_kind, hr)
+        if kind == "colmi":
+            yield base + (steps // 25, int(steps * 0.75))
+        elif kind == "moyoung":
+            yield base + (1, steps // 25, int(steps * 0.75))
+        elif kind == "garmin":
+            yield base + (int(steps * 75), steps // 25)
+        elif kind == "xiaomi":
+            yield base + (rng.randint(10, 60), rng.randint(94, 99) if asleep else None)
+        else:
+            yield base
+
+
+def heart_rate_rows(rng, device_id, start, end, nights):
+    for ts in range(start, end, 300):  # default 5 minute measurement interval
+        day = (ts - start) // 86400
+        _, hr, _ = minute_state(rng, ts, *nights[day])
+        yield ts * 1000, device_id, 1, hr
+
+
+def spo2_rows(rng, device_id, start, end, nights):
+    for ts in range(start, end, 3600):
+        day = (ts - start) // 86400
+        asleep = minute_state(rng, ts, *nights[day])[2]
+        if asleep or rng.random() < 0.2:
+            yield ts * 1000, device_id, 1, rng.randint(92, 99)
+
+
+def sleep_stage_rows(rng, device_id, start, end, nights):
+    """One row per stage segment; STAGE 0 awake, 1 REM, 2 light, 3 deep; DURATION in minutes."""
+    for day, (sleep_start, sleep_end) in enumerate(nights):
+        ts = start + day * 86400 - (start % 86400) + sleep_start * 60
+        stop = ts + ((1440 - sleep_start) + sleep_end) * 60
+        while ts < min(stop, end):
+            duration = rng.randint(10, 45)
+            yield ts * 1000, device_id, 1, duration, rng.choices((0, 1, 2, 3), (1, 3, 6, 3))[0]
+            ts += duration * 60
+
+
+def battery_rows(rng, device_id, start, end):
+    level = 100
+    for ts in range(start, end, 3600):
+        level -= rng.randint(0, 2)
+        if level < 15:
+            level = 100
+        yield ts, device_id, level, 0
+
+
+def workout_rows(rng, device_id, start, end):
+    """A run or walk most evenings, with SUMMARY_DATA in Gadgetbridge's {"name": {"value", "unit"}} form
+    and a raw blob, as the summary table holds for most devices. START_TIME/END_TIME are in ms."""
+    for day_start in range(start - start % 86400, end, 86400):
+        if rng.random() < 0.4:
+            continue
+        begin = day_start + 17 * 3600 + rng.randint(0, 7200)
+        minutes = rng.randint(20, 75)
+        if begin + minutes * 60 > end:
+            break
+        kind, speed = rng.choice(((16, 160), (32, 85)))   # running, walking; meters per minute
+        avg_hr = rng.randint(110, 160) if kind == 16 else rng.randint(90, 115)
+        summary = {
+            "activeSeconds": {"value": minutes * 60, "unit": "seconds"},
+            "distanceMeters": {"value": minutes * speed, "unit": "meters"},
+            "caloriesBurnt": {"value": minutes * (11 if kind == 16 else 5), "unit": "calories_unit"},
+            "steps": {"value": minutes * (165 if kind == 16 else 110), "unit": "steps_unit"},
+            "averageHR": {"value": avg_hr, "unit": "bpm"},
+            "maxHR": {"value": avg_hr + rng.randint(10, 30), "unit": "bpm"},
+            "minHR": {"value": avg_hr - rng.randint(20, 40), "unit": "bpm"},
+        }
+        yield (None, None, begin * 1000, (begin + minutes * 60) * 1000, kind, None, None, None, None, None,
+               device_id, 1, json.dumps(summary), rng.randbytes(256))
+
+
+def xiaomi_daily_rows(rng, device_id, start, end):
+    for ts in range(start - start % 86400, end, 86400):
+        steps = rng.randint(3000, 15000)
+        yield (ts * 1000, device_id, 1, 0, steps, rng.randint(50, 60), rng.randint(120, 170),
+               rng.randint(45, 55), rng.randint(65, 80), steps // 25)
+
+
+def xiaomi_sleep_rows(rng, device_id, start, end, nights):
+    for day, (sleep_start, sleep_end) in enumerate(nights):
+        ts = start + day * 86400 - (start % 86400) + sleep_start * 60
+        if ts >= end:
+            break
+        total = (1440 - sleep_start) + sleep_end
+        deep, rem = total // 5, total // 5
+        yield (ts * 1000, device_id, 1, (ts + total * 60) * 1000, 1, total, deep, total - deep - rem - 10, rem, 10)
+
+
+def insert(conn, table, rows):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    placeholders = ",".join("?" * len(first))
+    sql = f"INSERT INTO {table} VALUES ({placeholders})"
+    conn.execute(sql, first)
+    cur = conn.executemany(sql, rows)
+    return cur.rowcount + 1
+
+
+def generate(out, days=30, profiles=("colmi",), devices=1, seed=0, end=None, birthday="1985-06-15"):
+    """Write a synthetic Gadgetbridge.db to out. Returns the devices it created."""
+    if os.path.exists(out):
+        os.remove(out)
+    rng = random.Random(seed)
+    end = int(end if end is not None else time.time())
+    end -= end % 60
+    start = end - days * 86400
+    tables = set()
+    for profile in profiles:
+        spec = PROFILES[profile]
+        tables.add(spec["activity"][0])
+        tables.update(spec[key] for key in ("heart_rate", "spo2", "sleep") if key in spec)
+        if spec.get("xiaomi"):
+            tables.update(("XIAOMI_DAILY_SUMMARY_SAMPLE", "XIAOMI_SLEEP_TIME_SAMPLE"))
+
+    conn = sqlite3.connect(out)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    create_schema(conn, tables)
+    born = int(time.mktime(time.strptime(birthday, "%Y-%m-%d")) * 1000)
+    conn.execute("INSERT INTO USER (NAME, BIRTHDAY, GENDER) VALUES (?, ?, ?)", ("alice", born, 1))
+
+    created = []
+    rows = {}
+    for profile in profiles:
+        spec = PROFILES[profile]
+        for n in range(devices):
+            name, manufacturer, device_type = spec["device"]
+            mac = mac_for(len(created) + 1)
+            cur = conn.execute(
+                "INSERT INTO DEVICE (NAME, MANUFACTURER, IDENTIFIER, TYPE, MODEL, ALIAS) VALUES (?, ?, ?, ?, ?, ?)",
+                (f"{name} {n + 1}" if devices > 1 else name, manufacturer, mac, device_type, name, None),
+            )
+            device_id = cur.lastrowid
+            # Sleep window for each night, in minutes of the day: bed 22:00-00:00, up 06:00-08:00
+            nights = [(rng.randint(1320, 1439), rng.randint(360, 480)) for _ in range(days + 1)]
+            table, kind = spec["activity"]
+            counts = {table: insert(conn, table, activity_rows(rng, kind, device_id, start, end, nights))}
+            if "heart_rate" in spec:
+                counts[spec["heart_rate"]] = insert(conn, spec["heart_rate"], heart_rate_rows(rng, device_id, start, end, nights))
+            if "spo2" in spec:
+                counts[spec["spo2"]] = insert(conn, spec["spo2"], spo2_rows(rng, device_id, start, end, nights))
+            if "sleep" in spec:
+                counts[spec["sleep"]] = insert(conn, spec["sleep"], sleep_stage_rows(rng, device_id, start, end, nights))
+            if spec.get("xiaomi"):
+                counts["XIAOMI_DAILY_SUMMARY_SAMPLE"] = insert(conn, "XIAOMI_DAILY_SUMMARY_SAMPLE", xiaomi_daily_rows(rng, device_id, start, end))
+                counts["XIAOMI_SLEEP_TIME_SAMPLE"] = insert(conn, "XIAOMI_SLEEP_TIME_SAMPLE", xiaomi_sleep_rows(rng, device_id, start, end, nights))
+            counts["BATTERY_LEVEL"] = insert(conn, "BATTERY_LEVEL", battery_rows(rng, device_id, start, end))
+            counts["BASE_ACTIVITY_SUMMARY"] = insert(conn, "BASE_ACTIVITY_SUMMARY", workout_rows(rng, device_id, start, end))
+            for table, count in counts.items():
+                rows[table] = rows.get(table, 0) + count
+            created.append({"watch_type": profile, "mac_address": mac, "device_id": device_id, "name": name})
+    conn.commit()
+    conn.close()
+    return {"path": out, "days": days, "devices": created, "rows": rows, "bytes": os.path.getsize(out)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="Gadgetbridge.db", help="Path of the database to write")
+    parser.add_argument("--days", type=int, default=30, help="Days of per-minute samples")
+    parser.add_argument("--profiles", default="colmi", help=f"Comma separated, from: {', '.join(PROFILES)}")
+    parser.add_argument("--devices", type=int, default=1, help="Devices per profile")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    info = generate(args.out, args.days, args.profiles.split(","), args.devices, args.seed)
+    print(json.dumps(info, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+In-process MQTT broker stand-in for the replay harness.
+Speaks enough MQTT 3.1.1 for aiomqtt/paho: CONNECT, PUBLISH (QoS 0-2), SUBSCRIBE with + and #
+wildcards, UNSUBSCRIBE, PINGREQ, DISCONNECT and retained messages. Every publish it receives is
+timestamped in self.log, so a harness can measure when the publisher got something out.
+Clients asking for another protocol level (e.g. MQTT 5) are refused with return code 1, as a 3.1.1
+broker would. With mqtt5=True it also accepts MQTT 5 clients: it offers topic_alias_maximum aliases in
+its CONNACK, resolves topic aliases and records each publish's properties (message expiry, user
+properties), but otherwise treats them like 3.1.1 clients. Every logged publish has its size on the
+wire, to compare what the two protocol versions cost.
+"""
+
+import asyncio
+import struct
+import time
+
+
+def topic_matches(pattern, topic):
+    pattern_parts, topic_parts = pattern.split("/"), topic.split("/")
+    for i, part in enumerate(pattern_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts) or (part != "+" and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+def encode_length(length):
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(out)
+
+
+def encode_string(text):
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def decode_length(data, offset):
+    """A variable byte integer, as (value, offset after it)."""
+    multiplier, value = 1, 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value, offset
+
+
+def decode_string(data, offset):
+    length = struct.unpack("!H", data[offset:offset + 2])[0]
+    return data[offset + 2:offset + 2 + length].decode(), offset + 2 + length
+
+
+# MQTT 5 property identifiers -> (name, kind)
+PROPERTIES = {
+    0x01: ("payload_format", "byte"), 0x02: ("message_expiry", "int4"), 0x03: ("content_type", "string"),
+    0x08: ("response_topic", "string"), 0x09: ("correlation_data", "binary"), 0x0B: ("subscription_id", "varint"),
+    0x11: ("session_expiry", "int4"), 0x15: ("auth_method", "string"), 0x16: ("auth_data", "binary"),
+    0x17: ("request_problem_info", "byte"), 0x19: ("request_response_info", "byte"), 0x21: ("receive_maximum", "int2"),
+    0x22: ("topic_alias_maximum", "int2"), 0x23: ("topic_alias", "int2"), 0x26: ("user_property", "pair"),
+    0x27: ("maximum_packet_size", "int4"),
+}
+
+
+def decode_properties(data, offset):
+    """The property block at offset, as ({name: value}, offset after it). User properties are a list of pairs."""
+    length, offset = decode_length(data, offset)
+    end, properties = offset + length, {}
+    while offset < end:
+        name, kind = PROPERTIES[data[offset]]
+        offset += 1
+        if kind == "byte":
+            value, offset = data[offset], offset + 1
+        elif kind == "int2":
+            value, offset = struct.unpack("!H", data[offset:offset + 2])[0], offset + 2
+        elif kind == "int4":
+            value, offset = struct.unpack("!I", data[offset:offset + 4])[0], offset + 4
+        elif kind == "varint":
+            value, offset = decode_length(data, offset)
+        elif kind == "binary":
+            length = struct.unpack("!H", data[offset:offset + 2])[0]
+            value, offset = data[offset + 2:offset + 2 + length], offset + 2 + length
+        elif kind == "string":
+            value, offset = decode_string(data, offset)
+        else:
+            key, offset = decode_string(data, offset)
+            text, offset = decode_string(data, offset)
+            properties.setdefault(name, []).append((key, text))
+            continue
+        properties[name] = value
+    return properties, end
+
+
+class LoggedMessage:
+    def __init__(self, client_id, topic, payload, qos, retain, size=None, properties=None):
+        self.time = time.monotonic()
+        self.client_id = client_id
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.size = size                    # bytes of the PUBLISH packet on the wire
+        self.properties = properties or {}  # MQTT 5 properties, decoded
+
+
+class MiniBroker:
+    def __init__(self, host="127.0.0.1", port=0, mqtt5=False, topic_alias_maximum=100):
+        self.host = host
+        self.port = port
+        self.mqtt5 = mqtt5
+        self.topic_alias_maximum = topic_alias_maximum
+        self.server = None
+        self.retained = {}            # topic -> payload
+        self.subscriptions = {}       # writer -> set of topic filters
+        self.client_ids = {}          # writer -> client id
+        self.levels = {}              # writer -> protocol level (4 = 3.1.1, 5 = MQTT 5)
+        self.log = []                 # every PUBLISH received from a client
+        self.connects = 0
+        self.listeners = []           # callables(LoggedMessage), called for every received publish
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """Close the listener and drop every client, like a broker restart."""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for writer in list(self.subscriptions):
+            writer.close()
+        self.subscriptions.clear()
+        self.client_ids.clear()
+        self.levels.clear()
+
+    async def inject(self, topic, payload, retain=False):
+        """Publish from the broker side, e.g. a command from Home Assistant."""
+        if isinstance(payload, str):
+            payload = payload.encode()
+        if retain:
+            self.retained[topic] = payload
+        await self._route(topic, payload, retain=False)
+
+    async def _route(self, topic, payload, retain):
+        for writer, filters in list(self.subscriptions.items()):
+            if any(topic_matches(f, topic) for f in filters):
+                self._send_publish(writer, topic, payload, retain)
+
+    def _send_publish(self, writer, topic, payload, retain):
+        body = encode_string(topic) + (b"\x00" if self.levels.get(writer) == 5 else b"") + payload
+        try:
+            writer.write(bytes([0x30 | (1 if retain else 0)]) + encode_length(len(body)) + body)
+        except Exception:
+            pass
+
+    async def _read_packet(self, reader):
+        first = (await reader.readexactly(1))[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+    async def _handle(self, reader, writer):
+        self.subscriptions[writer] = set()
+        aliases = {}   # this connection's topic aliases
+        try:
+            while True:
+                kind, flags, body = await self._read_packet(reader)
+                v5 = self.levels.get(writer) == 5
+                if kind == 1:      # CONNECT
+                    name_len = struct.unpack("!H", body[:2])[0]
+                    level = body[2 + name_len]
+                    offset = 2 + name_len + 4
+                    if level == 5 and self.mqtt5:
+                        _, offset = decode_properties(body, offset)
+                    id_len = struct.unpack("!H", body[offset:offset + 2])[0]
+                    self.client_ids[writer] = body[offset + 2:offset + 2 + id_len].decode()
+                    if level not in (3, 4) and not (level == 5 and self.mqtt5):
+                        writer.write(b"\x20\x02\x00\x01")  # unacceptable protocol version
+                        await writer.drain()
+                        break
+                    self.connects += 1
+                    self.levels[writer] = level
+                    if level == 5:
+                        writer.write(b"\x20\x06\x00\x00\x03\x22" + struct.pack("!H", self.topic_alias_maximum))
+                    else:
+                        writer.write(b"\x20\x02\x00\x00")
+                elif kind == 3:    # PUBLISH
+                    qos, retain = (flags >> 1) & 0x03, flags & 0x01
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    topic = body[2:2 + topic_len].decode()
+                    offset = 2 + topic_len
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                    properties = {}
+                    if v5:
+                        properties, offset = decode_properties(body, offset)
+                        if "topic_alias" in properties:
+                            if topic:
+                                aliases[properties["topic_alias"]] = topic
+                            else:
+                                topic = aliases[properties["topic_alias"]]
+                    payload = body[offset:]
+                    size = 1 + len(encode_length(len(body))) + len(body)
+                    message = LoggedMessage(
+                        self.client_ids.get(writer), topic, payload, qos, bool(retain), size, properties
+                    )
+                    self.log.append(message)
+                    for listener in self.listeners:
+                        listener(message)
+                    if retain:
+                        if payload:
+                            self.retained[topic] = payload
+                        else:
+                            self.retained.pop(topic, None)
+                    await self._route(topic, payload, retain=False)
+                    if qos == 1:
+                        writer.write(b"\x40\x02" + packet_id)
+                    elif qos == 2:
+                        writer.write(b"\x50\x02" + packet_id)
+                elif kind == 6:    # PUBREL
+                    writer.write(b"\x70\x02" + body[:2])
+                elif kind == 8:    # SUBSCRIBE
+                    packet_id, offset, filters = body[:2], 2, []
+                    if v5:
+                        _, offset = decode_properties(body, offset)
+                    while offset < len(body):
+                        filter_len = struct.unpack("!H", body[offset:offset + 2])[0]
+                        filters.append(body[offset + 2:offset + 2 + filter_len].decode())
+                        offset += 2 + filter_len + 1
+                    self.subscriptions[writer].update(filters)
+                    acks = (b"\x00" if v5 else b"") + bytes(len(filters))
+                    writer.write(b"\x90" + encode_length(2 + len(acks)) + packet_id + acks)
+                    for topic, payload in self.retained.items():
+                        if any(topic_matches(f, topic) for f in filters):
+                            self._send_publish(writer, topic, payload, True)
+                elif kind == 10:   # UNSUBSCRIBE
+                    packet_id, offset, count = body[:2], 2, 0
+                    if v5:
+                        _, offset = decode_properties(body, offset)
+                    while offset < len(body):
+                        filter_len = struct.unpack("!H", body[offset:offset + 2])[0]
+                        self.subscriptions[writer].discard(body[offset + 2:offset + 2 + filter_len].decode())
+                        offset += 2 + filter_len
+                        count += 1
+                    acks = b"\x00" + bytes(count) if v5 else b""
+                    writer.write(b"\xb0" + encode_length(2 + len(acks)) + packet_id + acks)
+                elif kind == 12:   # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 14:   # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # swallowing the cancel keeps Python 3.11's stream callback quiet on stop()
+        finally:
+            self.subscriptions.pop(writer, None)
+            self.client_ids.pop(writer, None)
+            self.levels.pop(writer, None)
+            writer.close()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+End-to-end replay harness.
+Runs the real GadgetbridgeMQTTPublisher.run() loop against an in-process MQTT broker stand-in and a
+synthetic Gadgetbridge.db, then replays a scenario: database exports landing (in-place copies, atomic
+renames, slow partial writes) and publish/ping commands on gadgetbridge/command. It reports
+trigger-to-publish latency percentiles, duplicate and premature publishes, missed updates, and
+publishes that carried stale data. A broker_restart event takes the broker down for a while, to check
+that the publisher reconnects and restores its retained messages without re-reading the database.
+With --mqtt5 the publisher and the broker speak MQTT 5; the report's "mqtt" section has the bytes of
+every publish on the wire either way, so two runs show what topic aliases save.
+
+Each export adds a battery reading with a unique level, so the harness can tell which export a
+publish cycle actually read. The end of a cycle is recognised by the MQTT failures diagnostic
+sensor, which is published last.
+
+Scenario files are JSON lists of events, with "at" in seconds from the start of the replay:
+    [{"at": 1, "type": "export", "mode": "rename"},
+     {"at": 4, "type": "export", "mode": "partial", "pause": 2.5},
+     {"at": 9, "type": "command", "payload": "publish"},
+     {"at": 11, "type": "command", "payload": "ping"},
+     {"at": 13, "type": "broker_restart", "down": 3, "clear_retained": true}]
+
+Example:
+    python bench/replay.py --scenario my_scenario.json --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from benchmark import make_publisher  # also puts ../python on sys.path
+from generate_db import generate
+from mini_broker import MiniBroker
+
+DEFAULT_SCENARIO = [
+    {"at": 1, "type": "export", "mode": "copy"},
+    {"at": 5, "type": "command", "payload": "publish"},
+    {"at": 7, "type": "command", "payload": "ping"},
+    {"at": 9, "type": "export", "mode": "rename"},
+    {"at": 14, "type": "export", "mode": "partial", "pause": 2.5},
+    {"at": 21, "type": "export", "mode": "rename"},
+    {"at": 21.2, "type": "command", "payload": "publish"},
+    {"at": 26, "type": "command", "payload": "ping"},
+    {"at": 28, "type": "broker_restart", "down": 2, "clear_retained": True},
+    {"at": 34, "type": "command", "payload": "ping"},
+]
+
+COMMAND_TOPIC = "gadgetbridge/command"
+REPLY_TOPIC = "gadgetbridge/reply"
+MARKER_BASE = 1000  # battery level written by export n is MARKER_BASE + n
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "p50_ms": percentile(ms, 50),
+        "p90_ms": percentile(ms, 90),
+        "p99_ms": percentile(ms, 99),
+        "max_ms": max(ms) if ms else None,
+    }
+
+
+def stage_export(base, staging, device_id, marker):
+    """Copy the base DB and add a battery reading that identifies this export."""
+    shutil.copyfile(base, staging)
+    conn = sqlite3.connect(staging)
+    conn.execute("INSERT INTO BATTERY_LEVEL VALUES (?, ?, ?, 0)", (int(time.time()), device_id, marker))
+    conn.commit()
+    conn.close()
+
+
+async def land_export(event, staging, live):
+    """Put the staged DB in place the way the event says. Returns (begin, ready) monotonic times."""
+    mode = event.get("mode", "rename")
+    begin = time.monotonic()
+    if mode == "copy":
+        await asyncio.to_thread(shutil.copyfile, staging, live)
+    elif mode == "rename":
+        await asyncio.to_thread(shutil.copyfile, staging, live + ".part")
+        os.replace(live + ".part", live)
+    elif mode == "partial":
+        with open(staging, "rb") as f:
+            data = f.read()
+        half = len(data) // 2
+        with open(live, "r+b") as out:
+            out.write(data[:half])
+            out.flush()
+            os.fsync(out.fileno())
+            await asyncio.sleep(float(event.get("pause", 2)))
+            out.write(data[half:])
+            out.truncate()
+    else:
+        raise ValueError(f"Unknown export mode: {mode}")
+    return begin, time.monotonic()
+
+
+async def replay(scenario, watch_type="colmi", days=7, check_interval=1, settle=5.0, mqtt5=False):
+    broker = await MiniBroker(mqtt5=mqtt5).start()
+    cycles = []   # (time, battery level published in that cycle)
+    pongs = []
+    received = []   # time of every message from the publisher
+    battery = {"value": None}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base.db")
+        device = generate(base, days=days, profiles=[watch_type])["devices"][0]
+        live = os.path.join(tmp, "Gadgetbridge.db")
+        shutil.copyfile(base, live)
+
+        os.environ.update({
+            "MQTT_BROKER": broker.host,
+            "MQTT_PORT": str(broker.port),
+            "CHECK_INTERVAL_SECONDS": str(check_interval),
+            "DIAGNOSTIC_SENSORS": "true",
+            "MQTT_PROTOCOL": "5" if mqtt5 else "3.1.1",
+        })
+        publisher = make_publisher(live, device, os.path.join(tmp, "state"))
+        marker_topic = publisher.sensor_mqtt_failures["state_topic"]
+        battery_topic = publisher.sensor_battery_level["state_topic"]
+
+        def listen(message):
+            received.append(message.time)
+            if message.topic == battery_topic:
+                battery["value"] = message.payload.decode()
+            elif message.topic == marker_topic:
+                cycles.append((message.time, battery["value"]))
+            elif message.topic == REPLY_TOPIC:
+                pongs.append(message.time)
+        broker.listeners.append(listen)
+
+        task = asyncio.create_task(publisher.run())
+        try:
+            deadline = time.monotonic() + 60
+            while not cycles:
+                if task.done() or time.monotonic() > deadline:
+                    raise RuntimeError("Publisher never completed its initial publish")
+                await asyncio.sleep(0.05)
+            initial_cycles = len(cycles)
+            expected = battery["value"]
+
+            triggers, pings, restarts = [], [], []
+            start = time.monotonic()
+            exports = 0
+            for event in sorted(scenario, key=lambda e: e["at"]):
+                await asyncio.sleep(max(0.0, start + event["at"] - time.monotonic()))
+                if event["type"] == "export":
+                    exports += 1
+                    marker = MARKER_BASE + exports
+                    staging = os.path.join(tmp, f"export_{exports}.db")
+                    await asyncio.to_thread(stage_export, base, staging, device["device_id"], marker)
+                    begin, ready = await land_export(event, staging, live)
+                    expected = str(marker)
+                    triggers.append({"event": event, "begin": begin, "ready": ready, "expected": expected})
+                elif event["type"] == "command":
+                    now = time.monotonic()
+                    await broker.inject(COMMAND_TOPIC, event["payload"])
+                    if event["payload"] == "ping":
+                        pings.append({"event": event, "sent": now})
+                    else:
+                        triggers.append({"event": event, "begin": now, "ready": now, "expected": expected})
+                elif event["type"] == "broker_restart":
+                    down = time.monotonic()
+                    await broker.stop()
+                    if event.get("clear_retained"):
+                        broker.retained.clear()
+                    await asyncio.sleep(float(event.get("down", 2)))
+                    await broker.start()
+                    restarts.append({"event": event, "down": down, "up": time.monotonic()})
+                else:
+                    raise ValueError(f"Unknown event type: {event['type']}")
+            await asyncio.sleep(settle)
+            end = time.monotonic()
+        finally:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+            await broker.stop()
+
+    # Retained messages re-sent after a reconnect look like a cycle, so a restart closes the window
+    boundaries = [r["down"] for r in restarts]
+    report = analyse(triggers, pings, cycles[initial_cycles:], pongs, end, boundaries)
+    report["broker_restarts"] = analyse_restarts(restarts, received, broker.retained, broker.connects)
+    report["mqtt"] = {
+        "protocol": "5" if mqtt5 else "3.1.1",
+        "publishes": len(broker.log),
+        "publish_bytes": sum(m.size for m in broker.log),
+        "bytes_per_publish": round(sum(m.size for m in broker.log) / len(broker.log), 1) if broker.log else None,
+    }
+    return report
+
+
+def analyse_restarts(restarts, received, retained, connects):
+    """How long the publisher took to come back after each broker restart, and whether the
+    retained state topics were restored."""
+    results = []
+    for restart in restarts:
+        back = [t for t in received if t >= restart["up"]]
+        results.append({
+            "event": restart["event"],
+            "reconnect_ms": round((back[0] - restart["up"]) * 1000, 1) if back else None,
+        })
+    return {"restarts": results, "connects": connects, "retained_topics_at_end": len(retained)}
+
+
+def analyse(triggers, pings, cycles, pongs, end, boundaries=()):
+    per_event, latencies = [], []
+    duplicates = premature = missed = stale = 0
+    for i, trigger in enumerate(triggers):
+        boundary = min([end] + [b for b in boundaries if b > trigger["begin"]])
+        window_end = min(triggers[i + 1]["begin"] if i + 1 < len(triggers) else end, boundary)
+        in_window = [c for c in cycles if trigger["begin"] <= c[0] < window_end]
+        # A cycle serves every pending trigger that expects what it published, e.g. an export followed at
+        # once by a publish command, so a trigger is only served by cycles up to the next different marker
+        later = [t["begin"] for t in triggers[i + 1:] if t["expected"] != trigger["expected"]]
+        serve_end = min(later[:1] + [boundary])
+        after_ready = [c for c in cycles if trigger["ready"] <= c[0] < serve_end]
+        record = {
+            "event": trigger["event"],
+            "cycles": len(in_window),
+            "premature": len([c for c in in_window if c[0] < trigger["ready"]]),
+        }
+        premature += record["premature"]
+        duplicates += max(0, len(in_window) - 1)
+        if after_ready:
+            record["latency_ms"] = round((after_ready[0][0] - trigger["ready"]) * 1000, 1)
+            latencies.append(after_ready[0][0] - trigger["ready"])
+            record["published"] = after_ready[-1][1]
+            if after_ready[-1][1] != trigger["expected"]:
+                record["stale"] = True
+                stale += 1
+        else:
+            record["missed"] = True
+            missed += 1
+        per_event.append(record)
+
+    ping_latencies = []
+    for ping in pings:
+        replies = [t for t in pongs if t >= ping["sent"]]
+        if replies:
+            ping_latencies.append(replies[0] - ping["sent"])
+        else:
+            per_event.append({"event": ping["event"], "missed": True})
+            missed += 1
+
+    return {
+        "triggers": len(triggers),
+        "cycles": len(cycles),
+        "publish_latency": latency_summary(latencies),
+        "ping_latency": latency_summary(ping_latencies),
+        "duplicates": duplicates,
+        "premature": premature,
+        "missed": missed,
+        "stale": stale,
+        "events": per_event,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", help="JSON file with the events to replay (default: built-in scenario)")
+    parser.add_argument("--watch-type", default="colmi")
+    parser.add_argument("--days", type=int, default=7, help="Size of the synthetic database")
+    parser.add_argument("--check-interval", type=int, default=1, help="CHECK_INTERVAL_SECONDS for the publisher")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds to wait after the last event")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--mqtt5", action="store_true", help="Publish over MQTT 5 (topic aliases, message expiry)")
+    args = parser.parse_args()
+
+    scenario = DEFAULT_SCENARIO
+    if args.scenario:
+        with open(args.scenario) as f:
+            scenario = json.load(f)
+    report = asyncio.run(replay(scenario, args.watch_type, args.days, args.check_interval, args.settle, args.mqtt5))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0 if not (report["missed"] or report["stale"]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Intraday and multi-day activity totals from one grouped scan of the activity table.
+The scan sums steps (and distance and calories where the watch has them) per 15 minutes, which
+lines up with local midnight in every time zone, and NumPy spreads those buckets over local days and
+today's hours. Days the watch has synced past are cached, so after the first cycle only today is
+read again.
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from hr_zones import local_midnight
+
+BUCKET = 900
+
+
+class ActivityTrends:
+    def __init__(self, table, columns, tz, days=30):
+        self.table = table
+        self.columns = list(columns)
+        self.tz = tz
+        self.days = days              # longest average window
+        self.cache = {}               # iso date -> [sum per column], or None for a day without samples
+        self.daily = {}               # iso date -> [sum per column] or None, for the whole window
+        self.hourly = []              # today's [sum per column] per local hour
+
+    def refresh(self, cursor, scale, today=None, device_id=None):
+        today = today or datetime.now(self.tz).date()
+        dates = [today - timedelta(days=n) for n in range(self.days, -1, -1)]
+        scan = dates[next(i for i, d in enumerate(dates) if d.isoformat() not in self.cache):]
+        edges = np.array([local_midnight(d, self.tz) for d in scan + [today + timedelta(days=1)]])
+
+        sums = ", ".join(f"SUM({column})" for column in self.columns)
+        query = f"""
+            SELECT (TIMESTAMP / {scale}) / {BUCKET} * {BUCKET} AS BUCKET, {sums}
+            FROM {self.table}
+            WHERE TIMESTAMP >= ? AND TIMESTAMP < ?
+        """
+        params = [int(edges[0]) * scale, int(edges[-1]) * scale]
+        if device_id is not None:
+            query += " AND DEVICE_ID = ?"
+            params.append(device_id)
+        cursor.execute(query + " GROUP BY BUCKET", params)
+        rows = np.array(cursor.fetchall(), dtype=float).reshape(-1, 1 + len(self.columns))
+        buckets, values = rows[:, 0], np.nan_to_num(rows[:, 1:])
+
+        day = np.searchsorted(edges, buckets, side="right") - 1
+        per_day = np.zeros((len(scan), len(self.columns)))
+        np.add.at(per_day, day, values)
+        present = np.bincount(day, minlength=len(scan)) > 0
+        newest = buckets.max() if len(buckets) else 0
+
+        fresh = {}
+        for i, d in enumerate(scan):
+            fresh[d.isoformat()] = [round(v, 2) for v in per_day[i].tolist()] if present[i] else None
+            if d != today and newest >= edges[i + 1]:
+                self.cache[d.isoformat()] = fresh[d.isoformat()]
+        for key in [k for k in self.cache if k < dates[0].isoformat()]:
+            del self.cache[key]
+        self.daily = {d.isoformat(): fresh.get(d.isoformat(), self.cache.get(d.isoformat())) for d in dates}
+
+        today_rows = day == len(scan) - 1
+        hours = int(edges[-1] - edges[-2]) // 3600       # 23 or 25 on a DST change
+        hour = ((buckets[today_rows] - edges[-2]) // 3600).astype(int)
+        hourly = np.zeros((hours, len(self.columns)))
+        np.add.at(hourly, hour, values[today_rows])
+        self.hourly = hourly.tolist()
+
+    def average(self, column, days):
+        """Average per day over the last `days` full days that have samples, excluding today."""
+        index = self.columns.index(column)
+        values = [v[index] for v in list(self.daily.values())[-days - 1:-1] if v is not None]
+        return round(sum(values) / len(values), 1) if values else None
+
+    def history(self, column, days):
+        index = self.columns.index(column)
+        return {d: (v[index] if v is not None else None) for d, v in list(self.daily.items())[-days - 1:-1]}
+
+    def today_by_hour(self, column):
+        index = self.columns.index(column)
+        return [round(h[index], 2) for h in self.hourly]
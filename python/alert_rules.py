@@ -0,0 +1,126 @@
+"""
+Threshold alerts on newly synced samples.
+A rule names a metric and a threshold ("above" and/or "below"), and optionally how long the value has
+to stay past it ("for_seconds"). Each cycle only the rows added since the last one are read, one query
+per table, so the cost follows the amount of new data. A run of consecutive matching samples gives one
+event, when it has lasted long enough; a gap longer than "max_gap_seconds" between samples ends a run.
+Runs still going at the end of a batch are carried over to the next cycle.
+
+Example ALERT_RULES:
+    [{"name": "high_heart_rate", "metric": "heart_rate", "above": 150, "for_seconds": 300},
+     {"name": "low_spo2", "metric": "spo2", "below": 90}]
+"""
+
+import logging
+from datetime import datetime
+
+from sample_stream import timestamp_scale
+
+
+class AlertRule:
+    def __init__(self, name, metric, above=None, below=None, for_seconds=0, max_gap_seconds=600):
+        if above is None and below is None:
+            raise ValueError(f"Alert rule {name} needs 'above' or 'below'")
+        self.name = name
+        self.metric = metric
+        self.above = above
+        self.below = below
+        self.for_seconds = for_seconds
+        self.max_gap_seconds = max_gap_seconds
+
+    def matches(self, value):
+        return (self.above is not None and value > self.above) or (self.below is not None and value < self.below)
+
+    def worse(self, value, peak):
+        """The more extreme of two matching values, for the event's peak."""
+        return max(value, peak) if self.above is not None and peak > self.above else min(value, peak)
+
+
+def parse_rules(rules):
+    """AlertRules from the decoded ALERT_RULES list; bad entries are logged and skipped."""
+    parsed = []
+    for i, rule in enumerate(rules):
+        try:
+            parsed.append(AlertRule(**{"name": f"rule_{i}", **rule}))
+        except (TypeError, ValueError) as e:
+            logging.getLogger(__name__).error(f"Ignoring alert rule {rule}: {e}")
+    return parsed
+
+
+class AlertEngine:
+    def __init__(self, rules, metrics, tz=None):
+        self.metrics = metrics        # metric name -> (table, column, lowest valid value, highest valid value)
+        self.rules = [r for r in rules if r.metric in metrics]
+        self.tz = tz
+        for rule in rules:
+            if rule.metric not in metrics:
+                logging.getLogger(__name__).warning(
+                    f"Alert rule {rule.name}: metric {rule.metric} is not available for this watch"
+                )
+
+    def scan(self, cursor, state, device_id=None):
+        """Evaluate the rules over rows newer than each table's high-water mark.
+        Returns (events, new state); state is {"marks": {table: timestamp}, "runs": {rule: run}}."""
+        marks = dict(state.get("marks", {}))
+        runs = dict(state.get("runs", {}))
+        events = []
+        tables = {}
+        for rule in self.rules:
+            tables.setdefault(self.metrics[rule.metric][0], []).append(rule)
+
+        for table, rules in tables.items():
+            columns = sorted({self.metrics[r.metric][1] for r in rules})
+            device_filter = " AND DEVICE_ID = ?" if device_id is not None else ""
+            params = [device_id] if device_id is not None else []
+            if table not in marks:
+                # First run: start from the newest row instead of alerting on the whole history
+                cursor.execute(f"SELECT MAX(TIMESTAMP) FROM {table} WHERE 1 = 1{device_filter}", params)
+                marks[table] = cursor.fetchone()[0] or 0
+                continue
+            scale = timestamp_scale(cursor, table)
+            cursor.execute(
+                f"SELECT TIMESTAMP, {', '.join(columns)} FROM {table} WHERE TIMESTAMP > ?{device_filter} "
+                "ORDER BY TIMESTAMP",
+                [marks[table]] + params,
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                continue
+            marks[table] = rows[-1][0]
+            for rule in rules:
+                _, column, low, high = self.metrics[rule.metric]
+                index = columns.index(column) + 1
+                run = runs.get(rule.name)
+                for row in rows:
+                    value, ts = row[index], row[0] // scale
+                    if value is None or not low <= value <= high:
+                        continue   # no reading
+                    if run and ts - run["last"] > rule.max_gap_seconds:
+                        run = None
+                    if not rule.matches(value):
+                        run = None
+                        continue
+                    if run is None:
+                        run = {"start": ts, "last": ts, "peak": value, "fired": False}
+                    run["last"], run["peak"] = ts, rule.worse(value, run["peak"])
+                    if not run["fired"] and run["last"] - run["start"] >= rule.for_seconds:
+                        run["fired"] = True
+                        events.append(self.event(rule, run, value))
+                if run:
+                    runs[rule.name] = run
+                else:
+                    runs.pop(rule.name, None)
+        return events, {"marks": marks, "runs": runs}
+
+    def event(self, rule, run, value):
+        return {
+            "rule": rule.name,
+            "metric": rule.metric,
+            "above": rule.above,
+            "below": rule.below,
+            "value": value,
+            "peak": run["peak"],
+            "start": datetime.fromtimestamp(run["start"], self.tz).isoformat(),
+            "time": datetime.fromtimestamp(run["last"], self.tz).isoformat(),
+            "duration_seconds": run["last"] - run["start"],
+        }
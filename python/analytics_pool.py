@@ -0,0 +1,55 @@
+"""
+Analytics tasks (sleep, heart rate zones, activity trends) and the optional process pool they run on.
+Each task is a module-level function taking a cursor and an engine object and returning
+(result, engine), so the same task runs in the publisher's worker thread against the snapshot
+connection, or in another process. A worker process opens the snapshot file itself, read-only; only
+the engines (their small caches) and the results cross the process boundary.
+
+With several devices, the NumPy and SQLite work of each device then runs on its own core instead of
+taking turns on the GIL, and the main process is left with MQTT.
+"""
+
+import multiprocessing
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+from sample_stream import timestamp_scale
+
+
+def sleep_task(cursor, engine, activity_table, device_id):
+    cursor.execute(f"SELECT MAX(TIMESTAMP) FROM {activity_table} WHERE DEVICE_ID = ?", (device_id,))
+    newest = (cursor.fetchone()[0] or 0) // timestamp_scale(cursor, activity_table)
+    return engine.summary(cursor, timestamp_scale(cursor, engine.table), newest, device_id=device_id), engine
+
+
+def hr_zones_task(cursor, engine, state, max_hr, device_id):
+    updated = engine.update(cursor, state, max_hr, timestamp_scale(cursor, engine.table), device_id=device_id)
+    return (updated, engine.totals(updated)), engine
+
+
+def trends_task(cursor, engine, device_id):
+    engine.refresh(cursor, timestamp_scale(cursor, engine.table), device_id=device_id)
+    return None, engine
+
+
+def snapshot_path(conn):
+    """File behind the connection's main database, or None for an in-memory one."""
+    for _, name, path in conn.execute("PRAGMA database_list"):
+        if name == "main":
+            return path or None
+    return None
+
+
+def analyse_snapshot(path, tasks):
+    """Worker process entry point: run each (function, args) task against the snapshot at path."""
+    conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+    try:
+        return [function(conn.cursor(), *args) for function, args in tasks]
+    finally:
+        conn.close()
+
+
+def make_pool(processes):
+    # spawn, not fork: the parent has an event loop and worker threads that a fork would copy mid-flight
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
@@ -0,0 +1,127 @@
+"""
+Compact binary encoding of a batch of raw samples, for BACKFILL_ENCODING=binary.
+A JSON batch spells out every timestamp and value as text; this layout stores the timestamps as
+deltas and every column as a packed array of the narrowest integer type that holds it, so a batch
+of per-minute samples takes a few bytes per row. The encoder works on whole columns with numpy; the
+decoder below only needs the standard library and is meant as a reference for other languages.
+
+Layout, all integers little-endian:
+    magic          4 bytes  b"GBS1"
+    flags          uint8    bit 0 set: TIMESTAMP is in milliseconds, otherwise seconds
+    columns        uint8    number of columns C, TIMESTAMP first
+    rows           uint32   number of rows N
+    stream         uint8 length + UTF-8 name of the stream ("activity", "heart_rate")
+    C times:       uint8 length + UTF-8 column name, then a type byte
+    TIMESTAMP      int64 first timestamp, then N-1 deltas to the previous row in its type
+    other columns  a null bitmap if the type byte has 0x80 set (ceil(N/8) bytes, row i is bit i % 8 of
+                   byte i // 8; NULL rows hold 0 in the values), then N values in its type
+The type byte (without 0x80) is an ASCII struct/array code: "b" int8, "h" int16, "i" int32, "q" int64
+or "d" float64. With N = 0 nothing follows the column headers.
+"""
+
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+import numpy as np
+
+MAGIC = b"GBS1"
+NULLS = 0x80
+INT_TYPES = ((np.int8, "b"), (np.int16, "h"), (np.int32, "i"), (np.int64, "q"))
+SIZES = {"b": 1, "h": 2, "i": 4, "q": 8, "d": 8}
+
+
+def packed(values):
+    """(type code, little-endian bytes) of a numeric column in the narrowest type that holds it."""
+    if values.dtype.kind == "f":
+        return "d", values.astype("<f8").tobytes()
+    low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    for dtype, code in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return code, values.astype(np.dtype(dtype).newbyteorder("<")).tobytes()
+
+
+def column_array(values):
+    """A column tuple as a numeric array and its null mask (None if there are no NULLs)."""
+    array_ = np.array(values)
+    if array_.dtype != object:
+        return array_, None
+    nulls = np.equal(array_, None)
+    filled = np.where(nulls, 0, array_)
+    kinds = {type(v) for v in filled}
+    return filled.astype(float if float in kinds else np.int64), nulls
+
+
+def encode_batch(stream, columns, rows, scale):
+    """Encode rows (tuples, columns[0] being TIMESTAMP) of a sample table. scale is 1000 for ms."""
+    head = [MAGIC, struct.pack("<BBI", 1 if scale == 1000 else 0, len(columns), len(rows)), name_bytes(stream)]
+    body = []
+    for i, values in enumerate(zip(*rows) if rows else [()] * len(columns)):
+        values, nulls = column_array(values)
+        if i == 0:
+            code, data = packed(np.diff(values))
+            data = struct.pack("<q", int(values[0])) + data if len(values) else b""
+        else:
+            code, data = packed(values)
+            if nulls is not None:
+                data = np.packbits(nulls, bitorder="little").tobytes() + data
+        head.append(name_bytes(columns[i]) + bytes([ord(code) | (NULLS if nulls is not None else 0)]))
+        body.append(data)
+    return b"".join(head + body)
+
+
+def name_bytes(name):
+    data = name.encode()
+    return bytes([len(data)]) + data
+
+
+def read_name(data, offset):
+    length = data[offset]
+    return data[offset + 1:offset + 1 + length].decode(), offset + 1 + length
+
+
+def read_array(code, data, offset, count):
+    values = array(code, data[offset:offset + count * SIZES[code]])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, offset + count * SIZES[code]
+
+
+def decode_batch(data):
+    """The batch as the dict a JSON backfill message holds: stream, columns, timestamp_unit, samples."""
+    if data[:4] != MAGIC:
+        raise ValueError("not a binary sample batch")
+    flags, count, rows = struct.unpack_from("<BBI", data, 4)
+    stream, offset = read_name(data, 10)
+    columns, types = [], []
+    for _ in range(count):
+        name, offset = read_name(data, offset)
+        columns.append(name)
+        types.append(data[offset])
+        offset += 1
+    values = []
+    for i, type_byte in enumerate(types):
+        code = chr(type_byte & ~NULLS)
+        if not rows:
+            values.append([])
+        elif i == 0:
+            first = struct.unpack_from("<q", data, offset)[0]
+            deltas, offset = read_array(code, data, offset + 8, rows - 1)
+            values.append(list(accumulate(deltas, initial=first)))
+        else:
+            nulls = None
+            if type_byte & NULLS:
+                nulls, offset = data[offset:offset + (rows + 7) // 8], offset + (rows + 7) // 8
+            column, offset = read_array(code, data, offset, rows)
+            column = column.tolist()
+            if nulls is not None:
+                column = [None if nulls[r // 8] >> (r % 8) & 1 else v for r, v in enumerate(column)]
+            values.append(column)
+    return {
+        "stream": stream,
+        "columns": columns,
+        "timestamp_unit": "ms" if flags & 1 else "s",
+        "samples": [list(row) for row in zip(*values)],
+    }
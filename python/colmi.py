@@ -15,9 +15,13 @@ self.sensors = [
     self.sensor_avg_heart_rate_24h,
     self.sensor_min_heart_rate_24h,
     self.sensor_max_heart_rate_24h,
+    *self.sensor_hr_zones,
     self.sensor_daily_steps,
     self.sensor_weekly_steps,
     self.sensor_monthly_steps,
+    *self.sensor_step_trends,
+    *self.sensor_distance_trends,
+    *self.sensor_calories_trends,
     self.sensor_daily_distance,
     self.sensor_weekly_distance,
     self.sensor_monthly_distance,
@@ -28,4 +32,13 @@ self.sensors = [
     self.sensor_deep_sleep_duration,
     self.sensor_light_sleep_duration,
     self.sensor_rem_sleep_duration,
+    self.sensor_awake_duration,
+    self.sensor_total_sleep_duration,
+    self.sensor_sleep_onset,
+    self.sensor_sleep_offset,
+    self.sensor_awakenings,
+    self.sensor_sleep_efficiency,
+    self.sensor_average_sleep_duration,
+    self.sensor_average_sleep_efficiency,
+    *self.sensor_last_workout,
 ]
@@ -27,15 +27,20 @@ self.sensors = [
     self.sensor_avg_heart_rate_24h,
     self.sensor_min_heart_rate_24h,
     self.sensor_max_heart_rate_24h,
+    *self.sensor_hr_zones,
     self.sensor_daily_steps,
     self.sensor_weekly_steps,
     self.sensor_monthly_steps,
+    *self.sensor_step_trends,
+    *self.sensor_distance_trends,
+    *self.sensor_calories_trends,
     self.sensor_daily_distance,
     self.sensor_weekly_distance,
     self.sensor_monthly_distance,
     self.sensor_daily_calories,
     self.sensor_weekly_calories,
     self.sensor_monthly_calories,
+    *self.sensor_last_workout,
 ]
 # Additional query definitions may be added here as needed above. Here is an example
 #def query_monthly_steps(self, cursor) -> Any:
@@ -0,0 +1,80 @@
+"""
+Health of the running publisher, kept in the process and written to a small heartbeat file.
+The heartbeat is rewritten on a timer by the event loop itself, so a fresh file also proves the loop is
+not stuck. healthcheck.py only reads this file: it never opens the database or connects to the broker.
+
+The file holds one JSON object:
+    {"time": ..., "pid": ..., "mqtt": {"connected": ..., "since": ..., ...},
+     "devices": [{"device": ..., "last_cycle": ..., "cycle_started": ..., "snapshot_age_seconds": ...,
+                  "sensor_errors": {unique_id: count}}, ...]}
+Times are Unix seconds.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+DEFAULT_HEALTH_FILE = "/tmp/gadgetbridge2mqtt-health.json"
+
+
+def mqtt_health(session):
+    return {
+        "connected": session.connected,
+        "since": round(session.since, 1),   # last connect or disconnect
+        "connects": session.connects,
+        "failures": session.failures,
+        "queued": session.queued,
+        "dropped": session.dropped,
+    }
+
+
+def heartbeat_state(session, devices):
+    return {"time": round(time.time(), 1), "pid": os.getpid(), "mqtt": mqtt_health(session), "devices": devices}
+
+
+def write_heartbeat(path, state):
+    """Replace the heartbeat file atomically, so a reader never sees half a file."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".health-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+def read_heartbeat(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def problems(state, now=None, max_age=180, max_cycle_seconds=600):
+    """Reasons the heartbeat state counts as unhealthy; an empty list means healthy."""
+    now = now or time.time()
+    found = []
+    if now - state["time"] > max_age:
+        found.append(f"heartbeat is {now - state['time']:.0f}s old")
+    mqtt = state["mqtt"]
+    if not mqtt["connected"] and now - mqtt["since"] > max_age:
+        found.append(f"MQTT disconnected for {now - mqtt['since']:.0f}s")
+    for device in state["devices"]:
+        started = device.get("cycle_started")
+        if started and now - started > max_cycle_seconds:
+            found.append(f"{device['device']}: cycle running for {now - started:.0f}s")
+    return found
+
+
+async def heartbeat(render, path, interval):
+    """Write render() to path every interval seconds."""
+    logger = logging.getLogger(__name__)
+    while True:
+        try:
+            write_heartbeat(path, render())
+        except Exception as e:
+            logger.warning(f"Could not write heartbeat file {path}: {e}")
+        await asyncio.sleep(interval)
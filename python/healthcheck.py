@@ -1,53 +1,34 @@
 #!/usr/bin/env python3
 """
 Health check script for Gadgetbridge MQTT integration
+Reads the heartbeat file the running publisher keeps up to date (see health.py). It does not open the
+database or connect to the broker, so it costs the same however large the database is.
 """
 
 import os
-import sqlite3
-import socket
 
+from health import DEFAULT_HEALTH_FILE, problems, read_heartbeat
 
-def check_database():
-    """Check if Gadgetbridge database is accessible"""
-    db_path = os.getenv("GADGETBRIDGE_DB_PATH", "/data/Gadgetbridge.db")
 
-    if not os.path.exists(db_path):
-        return False
-
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name='MOYOUNG_ACTIVITY_SAMPLE'"
-        )
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
-    except Exception:
-        return False
-
-
-def check_mqtt_connection():
-    """Check MQTT broker TCP connectivity (no paho)"""
-    host = os.getenv("MQTT_BROKER", "localhost")
-    port = int(os.getenv("MQTT_PORT", "1883"))
+def main():
+    path = os.getenv("HEALTH_FILE", DEFAULT_HEALTH_FILE)
     try:
-        with socket.create_connection((host, port), timeout=5):
-            return True
-    except Exception:
-        return False
-
+        state = read_heartbeat(path)
+    except (OSError, ValueError) as e:
+        print(f"Health check failed - no heartbeat: {e}")
+        exit(1)
 
-def main():
-    db_ok = check_database()
-    mqtt_ok = check_mqtt_connection()
-    if db_ok and mqtt_ok:
-        print("Health check passed")
-        exit(0)
-    else:
-        print(f"Health check failed - DB: {db_ok}, MQTT: {mqtt_ok}")
+    found = problems(
+        state,
+        max_age=float(os.getenv("HEALTH_MAX_AGE_SECONDS", "180")),
+        max_cycle_seconds=float(os.getenv("HEALTH_MAX_CYCLE_SECONDS", "600")),
+    )
+    if found:
+        print(f"Health check failed - {'; '.join(found)}")
         exit(1)
+    errors = sum(sum(device["sensor_errors"].values()) for device in state["devices"])
+    print(f"Health check passed - {len(state['devices'])} device(s), {errors} sensor query errors since start")
+    exit(0)
 
 
 if __name__ == "__main__":
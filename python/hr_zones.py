@@ -0,0 +1,101 @@
+"""
+Heart rate zones and time in zone.
+Zones are fractions of maximum heart rate: zone 1 from 50%, zone 2 from 60%, zone 3 from 70%,
+zone 4 from 80% and zone 5 from 90%. Anything below zone 1 is counted as zone 0. Each sample counts for
+the time until the next sample, capped at max_gap so a watch that was taken off does not fill the gap.
+
+Minutes are accumulated per local day and only new samples are read each cycle. The newest sample is
+left for the next cycle, because its duration is only known once the following sample arrives.
+Binning is done with NumPy on whole arrays, so a day of per-second samples costs about as much as a
+day of 5 minute samples.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+ZONE_FLOORS = (0.5, 0.6, 0.7, 0.8, 0.9)   # lower bound of zones 1-5, as a fraction of max heart rate
+ZONES = len(ZONE_FLOORS) + 1
+
+
+def max_heart_rate(age):
+    return round(220 - age)
+
+
+def zone_minutes(timestamps, heart_rates, day_edges, max_hr, max_gap=600):
+    """Minutes per (day, zone) as a (len(day_edges) - 1, ZONES) array.
+    timestamps are seconds, sorted; the last sample is not counted."""
+    days = len(day_edges) - 1
+    if len(timestamps) < 2 or days < 1:
+        return np.zeros((max(days, 0), ZONES))
+    seconds = np.minimum(np.diff(timestamps), max_gap)
+    starts, rates = timestamps[:-1], heart_rates[:-1]
+    zone = np.searchsorted(np.array(ZONE_FLOORS) * max_hr, rates, side="right")
+    day = np.searchsorted(day_edges, starts, side="right") - 1
+    valid = (day >= 0) & (day < days) & (rates > 1) & (rates < 255)
+    totals = np.bincount(day[valid] * ZONES + zone[valid], weights=seconds[valid], minlength=days * ZONES)
+    return totals.reshape(days, ZONES) / 60
+
+
+def intensity_minutes(minutes):
+    """Moderate minutes (zones 2-3) count once, vigorous minutes (zones 4-5) twice."""
+    return minutes[2] + minutes[3] + 2 * (minutes[4] + minutes[5])
+
+
+def local_midnight(day: date, tz):
+    midnight = datetime(day.year, day.month, day.day)
+    return int((tz.localize(midnight) if hasattr(tz, "localize") else midnight.replace(tzinfo=tz)).timestamp())
+
+
+class HeartRateZones:
+    def __init__(self, table, column, tz, max_gap=600, keep_days=8):
+        self.table = table
+        self.column = column
+        self.tz = tz
+        self.max_gap = max_gap
+        self.keep_days = keep_days    # enough for a full week plus today
+
+    def update(self, cursor, state, max_hr, scale, today=None, device_id=None):
+        """Add the minutes of samples newer than state["until"]. state is a plain dict
+        {"until": seconds, "days": {iso date: [minutes per zone]}} and is returned updated."""
+        today = today or datetime.now(self.tz).date()
+        monday = today - timedelta(days=today.weekday())
+        start = state.get("until") or local_midnight(monday, self.tz)
+        query = f"""
+            SELECT TIMESTAMP, {self.column} FROM {self.table}
+            WHERE TIMESTAMP >= ?
+        """
+        params = [start * scale]
+        if device_id is not None:
+            query += " AND DEVICE_ID = ?"
+            params.append(device_id)
+        cursor.execute(query + " ORDER BY TIMESTAMP", params)
+        samples = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+        if len(samples) < 2:
+            return state
+        timestamps = samples[:, 0] // scale
+
+        first = datetime.fromtimestamp(int(timestamps[0]), self.tz).date()
+        last = datetime.fromtimestamp(int(timestamps[-1]), self.tz).date()
+        dates = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+        edges = np.array([local_midnight(d, self.tz) for d in dates + [last + timedelta(days=1)]])
+        minutes = zone_minutes(timestamps, samples[:, 1], edges, max_hr, self.max_gap)
+
+        days = dict(state.get("days", {}))
+        for d, row in zip(dates, minutes):
+            if row.any():
+                previous = days.get(d.isoformat(), [0.0] * ZONES)
+                days[d.isoformat()] = [round(a + b, 2) for a, b in zip(previous, row.tolist())]
+        oldest = (today - timedelta(days=self.keep_days)).isoformat()
+        return {"until": int(timestamps[-1]), "days": {d: m for d, m in days.items() if d > oldest}}
+
+    def totals(self, state, today=None):
+        """{"today": [...], "week": [...]} minutes per zone, the week starting on Monday."""
+        today = today or datetime.now(self.tz).date()
+        monday = (today - timedelta(days=today.weekday())).isoformat()
+        days = state.get("days", {})
+        week = np.array([m for d, m in days.items() if monday <= d <= today.isoformat()] or [[0.0] * ZONES])
+        return {
+            "today": days.get(today.isoformat(), [0.0] * ZONES),
+            "week": [round(float(v), 2) for v in week.sum(axis=0)],
+        }
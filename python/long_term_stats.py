@@ -0,0 +1,94 @@
+"""
+Hourly long-term statistics from the raw sample tables, in the shape Home Assistant imports.
+Home Assistant only records a sensor when it is published, so a watch synced once a day shows one
+step per day. These hourly rows (mean/min/max for heart rate, running sums for steps, distance and
+calories) let the real intraday curve be imported with recorder.import_statistics, or
+async_add_external_statistics from a custom integration.
+
+An hour is only emitted once it is closed, meaning a later sample exists in the same table. A watch
+that syncs late therefore still gets all of its hours, just later.
+"""
+
+from datetime import datetime, timezone
+
+HOUR = 3600
+
+
+def hour_iso(hour_start) -> str:
+    return datetime.fromtimestamp(hour_start, timezone.utc).isoformat()
+
+
+def closed_until(cursor, table, scale, device_id=None) -> int:
+    """Start of the hour holding the newest sample; every hour before it is complete."""
+    query = f"SELECT MAX(TIMESTAMP) FROM {table}"
+    params = ()
+    if device_id is not None:
+        query += " WHERE DEVICE_ID = ?"
+        params = (device_id,)
+    cursor.execute(query, params)
+    row = cursor.fetchone()
+    if not row or row[0] is None:
+        return 0
+    newest = row[0] // scale
+    return newest - newest % HOUR
+
+
+def hourly_heart_rate(cursor, table, column, start, end, scale, device_id=None):
+    """[(hour_start, mean, min, max)] for hours in [start, end), timestamps in seconds."""
+    query = f"""
+        SELECT (TIMESTAMP / {scale}) / {HOUR} * {HOUR} AS HOUR, AVG({column}), MIN({column}), MAX({column})
+        FROM {table}
+        WHERE TIMESTAMP >= ? AND TIMESTAMP < ? AND {column} < 255 AND {column} > 1
+    """
+    params = [start * scale, end * scale]
+    if device_id is not None:
+        query += " AND DEVICE_ID = ?"
+        params.append(device_id)
+    cursor.execute(query + " GROUP BY HOUR ORDER BY HOUR", params)
+    return [(hour, round(mean, 2), low, high) for hour, mean, low, high in cursor.fetchall()]
+
+
+def hourly_sums(cursor, table, columns, start, end, scale, device_id=None):
+    """[(hour_start, [sum per column])] for hours in [start, end), timestamps in seconds."""
+    sums = ", ".join(f"SUM({column})" for column in columns)
+    query = f"""
+        SELECT (TIMESTAMP / {scale}) / {HOUR} * {HOUR} AS HOUR, {sums}
+        FROM {table}
+        WHERE TIMESTAMP >= ? AND TIMESTAMP < ?
+    """
+    params = [start * scale, end * scale]
+    if device_id is not None:
+        query += " AND DEVICE_ID = ?"
+        params.append(device_id)
+    cursor.execute(query + " GROUP BY HOUR ORDER BY HOUR", params)
+    return [(row[0], [value or 0 for value in row[1:]]) for row in cursor.fetchall()]
+
+
+def mean_statistic(statistic_id, name, unit, rows):
+    return {
+        "statistic_id": statistic_id,
+        "source": statistic_id.split(":")[0],
+        "name": name,
+        "unit_of_measurement": unit,
+        "has_mean": True,
+        "has_sum": False,
+        "stats": [{"start": hour_iso(hour), "mean": mean, "min": low, "max": high} for hour, mean, low, high in rows],
+    }
+
+
+def sum_statistic(statistic_id, name, unit, rows, total):
+    """rows are (hour_start, value for that hour); total is the running sum before the first row.
+    Returns the statistic and the new running total."""
+    stats = []
+    for hour, value in rows:
+        total += value
+        stats.append({"start": hour_iso(hour), "state": total, "sum": total})
+    return {
+        "statistic_id": statistic_id,
+        "source": statistic_id.split(":")[0],
+        "name": name,
+        "unit_of_measurement": unit,
+        "has_mean": False,
+        "has_sum": True,
+        "stats": stats,
+    }, total
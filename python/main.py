@@ -21,27 +21,54 @@ import time
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any
 import asyncio
-import aiomqtt
 import re
 import pytz
 import shutil
 import tempfile
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import importlib.util
 from pathlib import Path
+from query_budget import QueryBudget
+from result_cache import CachingCursor, ResultCache
+from metrics import Metrics, serve_prometheus
+from health import DEFAULT_HEALTH_FILE, heartbeat, heartbeat_state
+from mqtt_session import MQTTSession
+from state_store import StateStore
+from warm_start import db_header, payload_hash, same_database, unchanged
+from sample_stream import iter_sample_batches, timestamp_scale
+from alert_rules import AlertEngine, parse_rules
+from workouts import WorkoutTracker
+from query_api import QUERY_TOPIC, QueryService
+from sinks import make_sinks
+from analytics_pool import analyse_snapshot, hr_zones_task, make_pool, sleep_task, snapshot_path, trends_task
+from long_term_stats import closed_until, hourly_heart_rate, hourly_sums, mean_statistic, sum_statistic
+try:
+    from sleep_analysis import SleepEngine
+    from hr_zones import HeartRateZones, intensity_minutes, max_heart_rate
+    from activity_trends import ActivityTrends
+    from sample_archive import SampleArchive
+    from batch_encoding import encode_batch
+except ImportError:   # numpy not installed: per-stage sleep totals in SQL, no heart rate zones, trends, archive
+    SleepEngine = HeartRateZones = ActivityTrends = SampleArchive = encode_batch = None   # or binary backfill
 
 @contextmanager
-def open_db_snapshot(db_path):
-    """Context manager: open a stable snapshot of the SQLite DB even if the source file is being replaced."""
+def open_db_snapshot(db_path, stats=None):
+    """Context manager: open a stable snapshot of the SQLite DB even if the source file is being replaced.
+    If a stats dict is given, the copy time and size are recorded in it."""
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"DB file not found: {db_path}")
 
     tmp_path = None
     try:
         # Copy DB to a temp file
+        start = time.monotonic()
         with tempfile.NamedTemporaryFile(delete=False) as tmp:
             shutil.copy2(db_path, tmp.name)
             tmp_path = tmp.name
+        if stats is not None:
+            stats["copy_seconds"] = time.monotonic() - start
+            stats["bytes"] = os.path.getsize(tmp_path)
 
         # Open snapshot in read-only mode
         conn = sqlite3.connect(f"file:{tmp_path}?mode=ro", uri=True)
@@ -62,18 +89,70 @@ def open_db_snapshot(db_path):
             except OSError as e:
                 logging.warning(f"Could not remove temp DB snapshot: {e}")
 
+def load_mqtt_config():
+    """MQTT configuration from environment variables"""
+    return {
+        "broker": os.getenv("MQTT_BROKER", "localhost"),
+        "port": int(os.getenv("MQTT_PORT", "1883")),
+        "username": os.getenv("MQTT_USERNAME", ""),
+        "password": os.getenv("MQTT_PASSWORD", ""),
+        "protocol": os.getenv("MQTT_PROTOCOL", "3.1.1"),   # "5" for MQTT 5, see mqtt_session.py
+    }
+
+
+def make_mqtt_session(on_connect, on_message):
+    subscriptions = ["gadgetbridge/command"]
+    if os.getenv("QUERY_API", "true").lower() == "true":
+        subscriptions.append(QUERY_TOPIC)
+    return MQTTSession(
+        load_mqtt_config(),
+        subscriptions=subscriptions,
+        on_connect=on_connect,
+        on_message=on_message,
+        queue_size=int(os.getenv("MQTT_QUEUE_SIZE", "1000")),
+        backoff_max=float(os.getenv("MQTT_BACKOFF_MAX_SECONDS", "60")),
+    )
+
+
 class GadgetbridgeMQTTPublisher:
-    def __init__(self):
+    def __init__(self, db_path=None, watch_type=None, mac_address=None, mqtt_session=None, executor=None,
+                 analytics_pool=None, sinks=None):
+        """One watch in one Gadgetbridge database. Anything not passed in comes from the environment.
+        When several publishers run in one process (see MultiPublisher) they share mqtt_session,
+        executor (the worker threads that database reads run on), analytics_pool and the output sinks."""
         self.setup_logging()
-        self.db_path = os.getenv("GADGETBRIDGE_DB_PATH", "/data/Gadgetbridge.db")
+        self.db_path = db_path or os.getenv("GADGETBRIDGE_DB_PATH", "/data/Gadgetbridge.db")
         self.check_interval = int(os.getenv("CHECK_INTERVAL_SECONDS", "30"))
         self.load_config()
-        self.mqtt_client = None
+        try:
+            self.local_tz = pytz.timezone(os.getenv("TZ", "UTC"))   # TZ as set in the compose file
+        except pytz.UnknownTimeZoneError:
+            self.local_tz = datetime.now().astimezone().tzinfo
+        self.mqtt_session = mqtt_session or make_mqtt_session(self._on_mqtt_connect, self._on_mqtt_message)
+        self.executor = executor   # None = asyncio's default thread pool
+        processes = int(os.getenv("ANALYTICS_PROCESSES", "0"))
+        self.analytics_pool = analytics_pool or (make_pool(processes) if processes and SleepEngine else None)
+        self.sinks = make_sinks() if sinks is None else sinks   # outputs next to MQTT, see sinks.py
+        self._initial_publish_done = False
         self._db_mtime = None   # <- baseline mtime shared by tasks
-        self.watch_type = os.getenv("WATCH_TYPE","error").lower()
+        self._snapshot_mtime = None   # mtime of the DB when the last snapshot was taken
+        self._cycle_lock = asyncio.Lock()   # one snapshot/publish cycle at a time
+        self._loop = None   # event loop of the running cycle, for publishes from the worker thread
+        self.query_budget = QueryBudget(maximum=float(os.getenv("QUERY_TIMEOUT_SECONDS", "10")))
+        self.sensor_status = {}   # unique_id -> "ok", "timeout" or "error" for the last cycle; sets availability
+        cache_size = int(os.getenv("QUERY_CACHE_SIZE", "256"))   # 0 = no result cache
+        self.result_cache = (
+            ResultCache(cache_size, int(os.getenv("QUERY_CACHE_MAX_ROWS", "1000"))) if cache_size else None
+        )
+        self.metrics = Metrics()
+        self.prometheus_port = int(os.getenv("PROMETHEUS_PORT", "0"))   # 0 = no endpoint
+        self.health_file = os.getenv("HEALTH_FILE", DEFAULT_HEALTH_FILE)   # empty = no heartbeat file
+        self.health_interval = float(os.getenv("HEALTH_INTERVAL_SECONDS", "15"))
+        self.message_expiry = int(os.getenv("MQTT_MESSAGE_EXPIRY_SECONDS", "604800"))   # MQTT 5 only; 0 = never
+        self.watch_type = (watch_type or os.getenv("WATCH_TYPE","error")).lower()
         if self.watch_type == "error":
             print('No watch type specified in docker.')
-        self.mac_address = os.getenv("MAC_ADDRESS","error")
+        self.mac_address = mac_address or os.getenv("MAC_ADDRESS","error")
         if self.mac_address == "error":
             print('No watch MAC address is specified in docker.')
         self.device_name = self.get_device_alias_initial() # Used to create the first subtopic for the MQTT sensors
@@ -153,6 +232,8 @@ class GadgetbridgeMQTTPublisher:
                     "icon": "mdi:walk",
                     "state_class": "total_increasing",
                     "query": self.query_daily_steps,
+                    "json_attributes_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/steps/daily/attributes",
+                    "attributes": lambda cursor: self.query_activity_trend(cursor, "steps", hourly=True),
                 }
         self.sensor_weekly_steps =       {
                     "name": "Weekly Steps",
@@ -238,33 +319,448 @@ class GadgetbridgeMQTTPublisher:
                     "unique_id": "deep_sleep_duration",
                     "unit_of_measurement": "h",
                     "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/deep_sleep_duration",
-                    "query": lambda cursor: self.query_sleep_stage_durations(cursor)[3]
+                    "query": lambda cursor: self.query_sleep(cursor, "deep")
                 }
         self.sensor_light_sleep_duration =           {
                     "name": "Light Sleep Duration",
                     "unique_id": "light_sleep_duration",
                     "unit_of_measurement": "h",
                     "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/light_sleep_duration",
-                    "query": lambda cursor: self.query_sleep_stage_durations(cursor)[2]
+                    "query": lambda cursor: self.query_sleep(cursor, "light")
                 }
         self.sensor_rem_sleep_duration =           {
                     "name": "REM Sleep Duration",
                     "unique_id": "rem_sleep_duration",
                     "unit_of_measurement": "h",
                     "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/rem_sleep_duration",
-                    "query": lambda cursor: self.query_sleep_stage_durations(cursor)[1]
+                    "query": lambda cursor: self.query_sleep(cursor, "rem")
+                }
+        self.sensor_awake_duration =           {
+                    "name": "Awake Duration",
+                    "unique_id": "awake_duration",
+                    "unit_of_measurement": "h",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/awake_duration",
+                    "query": lambda cursor: self.query_sleep(cursor, "awake")
+                }
+        self.sensor_total_sleep_duration =           {
+                    "name": "Sleep Duration",
+                    "unique_id": "sleep_duration",
+                    "unit_of_measurement": "h",
+                    "icon": "mdi:sleep",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_duration",
+                    "query": lambda cursor: self.query_sleep(cursor, "total")
+                }
+        self.sensor_sleep_onset =           {
+                    "name": "Fell Asleep",
+                    "unique_id": "sleep_onset",
+                    "device_class": "timestamp",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_onset",
+                    "query": lambda cursor: self.query_sleep(cursor, "onset")
+                }
+        self.sensor_sleep_offset =           {
+                    "name": "Woke Up",
+                    "unique_id": "sleep_offset",
+                    "device_class": "timestamp",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_offset",
+                    "query": lambda cursor: self.query_sleep(cursor, "offset")
+                }
+        self.sensor_awakenings =           {
+                    "name": "Awakenings",
+                    "unique_id": "awakenings",
+                    "icon": "mdi:eye-outline",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/awakenings",
+                    "query": lambda cursor: self.query_sleep(cursor, "awakenings")
+                }
+        self.sensor_sleep_efficiency =           {
+                    "name": "Sleep Efficiency",
+                    "unique_id": "sleep_efficiency",
+                    "unit_of_measurement": "%",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_efficiency",
+                    "query": lambda cursor: self.query_sleep(cursor, "efficiency")
+                }
+        self.sensor_average_sleep_duration =           {
+                    "name": "Average Sleep Duration",
+                    "unique_id": "average_sleep_duration",
+                    "unit_of_measurement": "h",
+                    "icon": "mdi:sleep",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_duration/average",
+                    "query": lambda cursor: self.query_sleep(cursor, "total", average=True)
                 }
+        self.sensor_average_sleep_efficiency =           {
+                    "name": "Average Sleep Efficiency",
+                    "unique_id": "average_sleep_efficiency",
+                    "unit_of_measurement": "%",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/sleep_efficiency/average",
+                    "query": lambda cursor: self.query_sleep(cursor, "efficiency", average=True)
+                }
+# Minutes in each heart rate zone, today and since Monday, plus intensity minutes
+        self.sensor_hr_zones = []
+        for period, label in (("today", "Today"), ("week", "This Week")):
+            for zone in range(1, 6):
+                self.sensor_hr_zones.append({
+                    "name": f"Heart Rate Zone {zone} {label}",
+                    "unique_id": f"hr_zone_{zone}_{period}",
+                    "unit_of_measurement": "min",
+                    "icon": "mdi:heart-pulse",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/heart_rate/zones/{period}/zone_{zone}",
+                    "query": lambda cursor, period=period, zone=zone: self.query_hr_zones(cursor, period, zone),
+                })
+            self.sensor_hr_zones.append({
+                "name": f"Intensity Minutes {label}",
+                "unique_id": f"intensity_minutes_{period}",
+                "unit_of_measurement": "min",
+                "icon": "mdi:run-fast",
+                "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/heart_rate/zones/{period}/intensity_minutes",
+                "query": lambda cursor, period=period: self.query_hr_zones(cursor, period),
+            })
+
+# Average per day over the last 7 and 30 full days; the daily values are in the attributes
+        self.sensor_step_trends, self.sensor_distance_trends, self.sensor_calories_trends = [], [], []
+        for trends, kind, label, extra in (
+            (self.sensor_step_trends, "steps", "Steps", {"unit_of_measurement": "steps", "icon": "mdi:walk"}),
+            (self.sensor_distance_trends, "distance", "Distance",
+             {"device_class": "distance", "unit_of_measurement": "meters", "icon": "mdi:walk"}),
+            (self.sensor_calories_trends, "calories", "Calories",
+             {"device_class": "energy", "unit_of_measurement": "kcal", "icon": "mdi:fire"}),
+        ):
+            for days in (7, 30):
+                trends.append({
+                    "name": f"Average Daily {label} {days} Days",
+                    "unique_id": f"average_daily_{kind}_{days}d",
+                    "state_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/{kind}/average_{days}d",
+                    "json_attributes_topic": f"gadgetbridge/{self.user_name}_{self.device_name}/{kind}/average_{days}d/attributes",
+                    "query": lambda cursor, kind=kind, days=days: self.query_activity_trend(cursor, kind, days),
+                    "attributes": lambda cursor, kind=kind, days=days: self.query_activity_trend(cursor, kind, days, history=True),
+                    **extra,
+                })
+
+# The newest workout from BASE_ACTIVITY_SUMMARY; its full summary is in the attributes of the type sensor
+        workout_topic = f"gadgetbridge/{self.user_name}_{self.device_name}/workout/last"
+        self.sensor_last_workout = [
+            {
+                "name": "Last Workout",
+                "unique_id": "last_workout_type",
+                "icon": "mdi:run",
+                "state_topic": f"{workout_topic}/type",
+                "json_attributes_topic": f"{workout_topic}/attributes",
+                "query": lambda cursor: self.query_last_workout(cursor, "type"),
+                "attributes": lambda cursor: self.query_last_workout(cursor),
+            },
+            {
+                "name": "Last Workout Start",
+                "unique_id": "last_workout_start",
+                "device_class": "timestamp",
+                "state_topic": f"{workout_topic}/start",
+                "query": lambda cursor: self.query_last_workout(cursor, "start"),
+            },
+            {
+                "name": "Last Workout Duration",
+                "unique_id": "last_workout_duration",
+                "unit_of_measurement": "min",
+                "icon": "mdi:timer-outline",
+                "state_topic": f"{workout_topic}/duration",
+                "query": lambda cursor: self.query_last_workout(cursor, "duration_minutes"),
+            },
+            {
+                "name": "Last Workout Distance",
+                "unique_id": "last_workout_distance",
+                "device_class": "distance",
+                "unit_of_measurement": "meters",
+                "state_topic": f"{workout_topic}/distance",
+                "query": lambda cursor: self.query_last_workout(cursor, "distance"),
+            },
+            {
+                "name": "Last Workout Calories",
+                "unique_id": "last_workout_calories",
+                "device_class": "energy",
+                "unit_of_measurement": "kcal",
+                "icon": "mdi:fire",
+                "state_topic": f"{workout_topic}/calories",
+                "query": lambda cursor: self.query_last_workout(cursor, "calories"),
+            },
+            {
+                "name": "Last Workout Average Heart Rate",
+                "unique_id": "last_workout_average_heart_rate",
+                "unit_of_measurement": "bpm",
+                "icon": "mdi:heart-pulse",
+                "state_topic": f"{workout_topic}/average_heart_rate",
+                "query": lambda cursor: self.query_last_workout(cursor, "average_heart_rate"),
+            },
+            {
+                "name": "Last Workout Maximum Heart Rate",
+                "unique_id": "last_workout_max_heart_rate",
+                "unit_of_measurement": "bpm",
+                "icon": "mdi:heart-pulse",
+                "state_topic": f"{workout_topic}/max_heart_rate",
+                "query": lambda cursor: self.query_last_workout(cursor, "max_heart_rate"),
+            },
+        ]
+
+# Diagnostic sensors describe the publisher itself rather than the watch. Their values come from
+# self.metrics after each cycle, not from the database.
+        diagnostics_topic = f"gadgetbridge/{self.user_name}_{self.device_name}/diagnostics"
+        self.sensor_snapshot_time =           {
+                    "name": "Snapshot Copy Time",
+                    "unique_id": "snapshot_copy_time",
+                    "unit_of_measurement": "s",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/snapshot_copy_time",
+                    "value": lambda: self.metrics.snapshot_seconds,
+                }
+        self.sensor_snapshot_size =           {
+                    "name": "Snapshot Size",
+                    "unique_id": "snapshot_size",
+                    "unit_of_measurement": "B",
+                    "device_class": "data_size",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/snapshot_size",
+                    "value": lambda: self.metrics.snapshot_bytes,
+                }
+        self.sensor_query_time =           {
+                    "name": "Query Time",
+                    "unique_id": "query_time",
+                    "unit_of_measurement": "s",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/query_time",
+                    "json_attributes_topic": f"{diagnostics_topic}/query_time/attributes",
+                    "value": self.metrics.total_query_seconds,
+                    "attributes": self.metrics.query_stats,
+                }
+        self.sensor_publish_time =           {
+                    "name": "Publish Time",
+                    "unique_id": "publish_time",
+                    "unit_of_measurement": "s",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/publish_time",
+                    "value": lambda: self.metrics.publish_seconds,
+                }
+        self.sensor_publish_lag =           {
+                    "name": "Publish Lag",
+                    "unique_id": "publish_lag",
+                    "unit_of_measurement": "s",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/publish_lag",
+                    "value": lambda: self.metrics.publish_lag_seconds,
+                }
+        self.sensor_query_cache =           {
+                    "name": "Query Cache Hit Rate",
+                    "unique_id": "query_cache_hit_rate",
+                    "unit_of_measurement": "%",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/query_cache_hit_rate",
+                    "json_attributes_topic": f"{diagnostics_topic}/query_cache_hit_rate/attributes",
+                    "value": lambda: self.result_cache.hit_ratio(),
+                    "attributes": lambda: self.result_cache.stats(),
+                }
+        self.sensor_mqtt_failures =           {
+                    "name": "MQTT Failures",
+                    "unique_id": "mqtt_failures",
+                    "state_class": "total_increasing",
+                    "entity_category": "diagnostic",
+                    "state_topic": f"{diagnostics_topic}/mqtt_failures",
+                    "value": lambda: self.metrics.mqtt_failures,
+                }
+        self.diagnostic_sensors = [
+            self.sensor_snapshot_time,
+            self.sensor_snapshot_size,
+            self.sensor_query_time,
+            self.sensor_publish_time,
+            self.sensor_publish_lag,
+            self.sensor_mqtt_failures,
+            *([self.sensor_query_cache] if self.result_cache else []),
+        ] if os.getenv("DIAGNOSTIC_SENSORS", "true").lower() == "true" else []
 
 # Defines the database table and column names appropriate for that device.
 # Also includes the sensors available.
         with open(f"{self.watch_type}.py") as watch:
             exec(watch.read())
 
+# Persistent cursors and watermarks, one file per device, so a restart carries on where it left off.
+        self.state = StateStore(
+            os.path.join(os.getenv("STATE_DIR", "state"), f"{self.mac_address.replace(':','')}.json")
+        )
+
+# Extra work done against the same snapshot as the sensor queries, in the worker thread.
+# Each stage is called with the snapshot connection after the sensor states have been published.
+        self.snapshot_stages = []
+        self.backfill_batch_size = int(os.getenv("BACKFILL_BATCH_SIZE", "500"))
+        self.backfill_interval = 1 / float(os.getenv("BACKFILL_BATCHES_PER_SECOND", "10"))
+        self.backfill_initial_hours = float(os.getenv("BACKFILL_INITIAL_HOURS", "24"))
+        self.backfill_encoding = os.getenv("BACKFILL_ENCODING", "json").lower()   # json or binary (batch_encoding.py)
+        if self.backfill_encoding == "binary" and not encode_batch:
+            self.logger.warning("numpy is not installed; backfill batches are sent as JSON")
+            self.backfill_encoding = "json"
+        if os.getenv("BACKFILL", "false").lower() == "true":
+            self.snapshot_stages.append(self.run_backfill)
+        self.statistics_mode = os.getenv("STATISTICS", "false").lower()   # false, mqtt or file
+        self.statistics_file = os.getenv("STATISTICS_FILE", os.path.join(os.getenv("STATE_DIR", "state"), "statistics.jsonl"))
+        self.statistics_initial_days = float(os.getenv("STATISTICS_INITIAL_DAYS", "7"))
+        if self.statistics_mode in ("mqtt", "file"):
+            self.snapshot_stages.append(self.run_statistics)
+
+# Raw samples for the output sinks, read once per snapshot for all of them.
+        self.sink_initial_hours = float(os.getenv("LINE_PROTOCOL_INITIAL_HOURS", "24"))
+        if any(sink.wants_samples for sink in self.sinks):
+            self.snapshot_stages.append(self.run_sink_samples)
+
+# Raw samples are copied to a compressed monthly archive per table (see sample_archive.py).
+        self.archive = None
+        if os.getenv("ARCHIVE", "false").lower() == "true":
+            if SampleArchive:
+                self.archive = SampleArchive(
+                    os.path.join(
+                        os.getenv("ARCHIVE_DIR", os.path.join(os.getenv("STATE_DIR", "state"), "archive")),
+                        self.mac_address.replace(":", ""),
+                    ),
+                    int(os.getenv("ARCHIVE_BATCH_ROWS", "50000")),
+                )
+                self.archive_rows_per_cycle = int(os.getenv("ARCHIVE_ROWS_PER_CYCLE", "100000"))
+                self.snapshot_stages.append(self.run_archive)
+            else:
+                self.logger.warning("numpy is not installed; the sample archive is off")
+
+# New workouts are found by _id and published as events; the last one also feeds the workout sensors.
+        self.workouts = WorkoutTracker(self.local_tz)
+        self._workouts = None     # this snapshot's (new workouts, state), shared by the sensors and the stage
+        self.snapshot_stages.append(self.run_workouts)
+
+# Metrics that alert rules and ad-hoc range queries can use: name -> (table, column, lowest, highest valid value)
+        self.range_metrics = {"steps": (self.watch_type_activity, "STEPS", 0, 65535)}
+        if hasattr(self, "distance_column"):
+            self.range_metrics["distance"] = (self.watch_type_activity, self.distance_column, 0, 2**31)
+        if hasattr(self, "calories_column"):
+            self.range_metrics["calories"] = (self.watch_type_activity, self.calories_column, 0, 2**31)
+        if hasattr(self, "watch_type_heart_rate"):
+            self.range_metrics["heart_rate"] = (self.watch_type_heart_rate, self.heart_rate_column, 2, 254)
+        if hasattr(self, "watch_type_spo2"):
+            self.range_metrics["spo2"] = (self.watch_type_spo2, self.spo2_column, 1, 100)
+
+# Ad-hoc range queries on gadgetbridge/query; with several watches MultiPublisher runs one service for all
+        self.query_service = None
+        if mqtt_session is None and QUERY_TOPIC in self.mqtt_session.subscriptions:
+            self.query_service = QueryService([self], self.mqtt_session, open_db_snapshot, self.executor)
+
+# Alert rules run first, so events go out before the slower stages
+        self.alert_engine = None
+        if os.getenv("ALERT_RULES"):
+            try:
+                rules = parse_rules(json.loads(os.getenv("ALERT_RULES")))
+            except (json.JSONDecodeError, TypeError) as e:
+                self.logger.error(f"ALERT_RULES is not a JSON list of rules, alerts are off: {e}")
+                rules = []
+            self.alert_engine = AlertEngine(rules, self.range_metrics, self.local_tz)
+            if self.alert_engine.rules:
+                self.snapshot_stages.insert(0, self.run_alerts)
+
+# Sleep analysis keeps the nights that are over, so a cycle only reads the newest night.
+        self.sleep_engine = None
+        self._sleep = None    # this snapshot's sleep summary, shared by the sleep sensors
+        sleep_sensors = (
+            self.sensor_deep_sleep_duration, self.sensor_light_sleep_duration, self.sensor_rem_sleep_duration,
+            self.sensor_awake_duration, self.sensor_total_sleep_duration, self.sensor_sleep_onset,
+            self.sensor_sleep_offset, self.sensor_awakenings, self.sensor_sleep_efficiency,
+            self.sensor_average_sleep_duration, self.sensor_average_sleep_efficiency,
+        )
+        if hasattr(self, "watch_type_sleep") and any(sensor in self.sensors for sensor in sleep_sensors):
+            if SleepEngine:
+                self.sleep_engine = SleepEngine(
+                    self.watch_type_sleep, self.local_tz, int(os.getenv("SLEEP_AVERAGE_NIGHTS", "7"))
+                )
+            else:
+                self.logger.warning("numpy is not installed; only sleep stage durations are available")
+
+# Daily and hourly activity totals come from one grouped scan; days that are over are cached.
+        self.activity_trends = None
+        self._activity_trends_fresh = False
+        if ActivityTrends:
+            self.trend_columns = {"steps": "STEPS"}
+            if hasattr(self, "distance_column"):
+                self.trend_columns["distance"] = self.distance_column
+            if hasattr(self, "calories_column"):
+                self.trend_columns["calories"] = self.calories_column
+            self.activity_trends = ActivityTrends(self.watch_type_activity, self.trend_columns.values(), self.local_tz)
+
+# Heart rate zone minutes are accumulated in the state file as new samples arrive.
+        self.max_heart_rate = os.getenv("MAX_HEART_RATE")   # default 220 - age
+        self.hr_zones = None
+        self._hr_zone_totals = None   # this snapshot's zone totals, shared by the zone sensors
+        if HeartRateZones and hasattr(self, "watch_type_heart_rate"):
+            self.hr_zones = HeartRateZones(
+                self.watch_type_heart_rate, self.heart_rate_column, self.local_tz,
+                int(os.getenv("HR_ZONE_MAX_GAP_SECONDS", "600")),
+            )
+
+# Warm start: payload hashes and engine caches are checkpointed after every cycle (see warm_start.py)
+        self._published = {}        # state topic -> hash of the payload on the broker
+        self._published_at = {}     # state topic -> when it was last sent, for refreshing before it expires
+        self._discovery = {}        # discovery topic -> hash of the config on the broker
+        self._snapshot_header = None
+        self.warm_unchanged = False   # the database is exactly as it was at the last checkpoint
+        self.restore_checkpoint()
+
 # ----------------- Calls to the database for sensor data ------------------------------------
 
 # More sensors and hints are available here: https://gadgetbridge.org/internals/development/data-management/
 # However, it is probably necessary to examine the database for better information (e.g., through DBbrowser for SQLITE)
 
+    # ---------------- Warm start ----------------
+    def restore_checkpoint(self):
+        saved = self.state.get("checkpoint")
+        header = db_header(self.db_path)
+        if not saved or not header:
+            return
+        if not same_database(saved["header"], header):
+            self.logger.warning(f"{self.db_path} is not the database of the saved state; starting cold")
+            self.state.clear()
+            self.state.save()
+            return
+        self._published = saved.get("published", {})
+        self._published_at = saved.get("published_at", {})
+        self._discovery = saved.get("discovery", {})
+        if self.sleep_engine:
+            self.sleep_engine.cache = saved.get("sleep_nights", {})
+        if self.activity_trends:
+            self.activity_trends.cache = saved.get("trend_days", {})
+        self.warm_unchanged = (
+            unchanged(saved["header"], header) and saved.get("db_mtime") == os.path.getmtime(self.db_path)
+            and saved.get("day") == self.local_day()   # today and week sensors roll over at midnight
+            and not self.states_expiring()
+        )
+        if self.warm_unchanged:
+            self._snapshot_header, self._snapshot_mtime = saved["header"], saved["db_mtime"]
+        self.logger.info(
+            f"Resuming from saved state ({len(self._published)} published values"
+            f"{', database unchanged' if self.warm_unchanged else ''})"
+        )
+
+    def checkpoint(self):
+        if not self._snapshot_header:
+            return
+        self.state.set("checkpoint", {
+            "header": self._snapshot_header,
+            "db_mtime": self._snapshot_mtime,
+            "day": self.local_day(),
+            "published": self._published,
+            "published_at": self._published_at,
+            "discovery": self._discovery,
+            "sleep_nights": self.sleep_engine.cache if self.sleep_engine else {},
+            "trend_days": self.activity_trends.cache if self.activity_trends else {},
+        })
+        self.state.save()
+
+    def local_day(self):
+        return datetime.now(self.local_tz).date().isoformat()
+
+    def states_expiring(self):
+        """Whether a retained state has used up half its MQTT 5 expiry, when publish_state would send it again."""
+        expiry = self.message_expiry if self.mqtt_session.mqtt5 else None
+        return bool(expiry) and time.time() - min(self._published_at.values(), default=0) >= expiry / 2
+
+    def forget_published(self):
+        """Publish everything again on the next cycle, e.g. for a broker that lost its retained messages."""
+        self._published = {}
+        self._discovery = {}
+
     # ---------------- INITIAL DB fetch (one-shot, tolerates missing DB) ----------------
     def get_device_alias_initial(self):
         try:
@@ -532,46 +1028,160 @@ class GadgetbridgeMQTTPublisher:
         row = cursor.fetchone()
         return float(row[0]) if row and row[0] is not None else None
 
-    def get_local_noon_window_utc_ms(self, timezone_str="America/Chicago"):
-        local_tz = pytz.timezone(timezone_str)
+    def get_local_noon_window_utc_ms(self, tz=None):
+        local_tz = tz or self.local_tz
         now_local = datetime.now(local_tz)
 
         # Noon today in local time
-        noon_today_local = local_tz.localize(
-            datetime(now_local.year, now_local.month, now_local.day, 12)
-        )
+        noon_today_local = local_tz.localize(datetime(now_local.year, now_local.month, now_local.day, 12)) \
+            if hasattr(local_tz, "localize") else datetime(now_local.year, now_local.month, now_local.day, 12, tzinfo=local_tz)
 
         # Noon yesterday
         noon_yesterday_local = noon_today_local - timedelta(days=1)
 
-        # Convert to UTC
-        noon_today_utc = noon_today_local.astimezone(pytz.utc)
-        noon_yesterday_utc = noon_yesterday_local.astimezone(pytz.utc)
-
         # Convert to ms
-        ts_start_utc_ms = int(noon_yesterday_utc.timestamp() * 1000)
-        ts_end_utc_ms = int(noon_today_utc.timestamp() * 1000)
+        ts_start_utc_ms = int(noon_yesterday_local.timestamp() * 1000)
+        ts_end_utc_ms = int(noon_today_local.timestamp() * 1000)
 
         return ts_start_utc_ms, ts_end_utc_ms
 
     def query_sleep_stage_durations(self, cursor) -> dict:
-        ts_start, ts_end = self.get_local_noon_window_utc_ms("America/Chicago")
-        results = {}
-        for stage in range(4):  # stages 0, 1, 2, 3
-            cursor.execute(
-                f"""
-                SELECT SUM(DURATION)
-                FROM {self.watch_type_sleep}
-                WHERE TIMESTAMP >= ? AND TIMESTAMP < ? AND STAGE = ?
-                """,
-                (ts_start, ts_end, stage)
-            )
-            row = cursor.fetchone()
-            total_min = float(row[0]) if row and row[0] is not None else 0.0
-            results[stage] = round(total_min / (60),2)  # convert min → hours
-
+        """Hours per stage since yesterday noon, in one query. Used when numpy is not available."""
+        ts_start, ts_end = self.get_local_noon_window_utc_ms()
+        cursor.execute(
+            f"""
+            SELECT STAGE, SUM(DURATION)
+            FROM {self.watch_type_sleep}
+            WHERE TIMESTAMP >= ? AND TIMESTAMP < ?
+            GROUP BY STAGE
+            """,
+            (ts_start, ts_end)
+        )
+        results = {stage: 0.0 for stage in range(4)}  # stages 0, 1, 2, 3
+        for stage, total_min in cursor.fetchall():
+            results[stage] = round(float(total_min or 0) / 60, 2)  # convert min → hours
         return results
 
+    def query_sleep(self, cursor, key, average=False) -> Any:
+        """One value from last night's sleep analysis (or the rolling average over the last nights).
+        The analysis runs once per snapshot; the other sleep sensors reuse it."""
+        if self.sleep_engine is None:
+            stage = {"awake": 0, "rem": 1, "light": 2, "deep": 3}.get(key)
+            return None if stage is None or average else self.query_sleep_stage_durations(cursor)[stage]
+        if self._sleep is None:
+            self.analytics("sleep", cursor)
+        value = (self._sleep["average"] if average else self._sleep["night"]).get(key)
+        if key in ("onset", "offset") and value is not None:
+            return datetime.fromtimestamp(value, self.local_tz).isoformat()
+        return value
+
+    def query_hr_zones(self, cursor, period, zone=None) -> Any:
+        """Minutes in a heart rate zone (or intensity minutes when zone is None) for "today" or "week".
+        New samples are binned once per snapshot; the other zone sensors reuse the result."""
+        if self.hr_zones is None:
+            return None
+        if self._hr_zone_totals is None:
+            self.analytics("hr_zones", cursor)
+        minutes = self._hr_zone_totals[period]
+        return round(intensity_minutes(minutes) if zone is None else minutes[zone], 1)
+
+    def query_activity_trend(self, cursor, kind, days=None, history=False, hourly=False) -> Any:
+        """Average daily steps/distance/calories over `days`, the daily values behind it (history), or
+        today's values per hour (hourly). The activity table is scanned once per snapshot."""
+        if self.activity_trends is None:
+            return None
+        if not self._activity_trends_fresh:
+            self.analytics("trends", cursor)
+        column = self.trend_columns[kind]
+        if hourly:
+            return {"hourly": self.activity_trends.today_by_hour(column)}
+        if history:
+            return {"daily": self.activity_trends.history(column, days)}
+        return self.activity_trends.average(column, days)
+
+# The sleep, heart rate zone and trend engines run as tasks from analytics_pool.py: in this thread,
+# on first use by a sensor, or for the whole snapshot at once in a worker process (ANALYTICS_PROCESSES).
+
+    def analytics_kinds(self):
+        engines = (("sleep", self.sleep_engine), ("hr_zones", self.hr_zones), ("trends", self.activity_trends))
+        return [kind for kind, engine in engines if engine is not None]
+
+    def analytics_task(self, kind, cursor):
+        """(function, args) of one analytics task for this device."""
+        device_id = self.get_device_id(cursor)
+        if kind == "sleep":
+            return sleep_task, (self.sleep_engine, self.watch_type_activity, device_id)
+        if kind == "hr_zones":
+            max_hr = int(self.max_heart_rate) if self.max_heart_rate else max_heart_rate(self.get_age(cursor))
+            return hr_zones_task, (self.hr_zones, self.state.get("hr_zones", {}), max_hr, device_id)
+        return trends_task, (self.activity_trends, device_id)
+
+    def store_analytics(self, kind, result, engine):
+        """Keep a task's result for the sensors of this snapshot, and its engine with the updated caches."""
+        if kind == "sleep":
+            self.sleep_engine, self._sleep = engine, result
+        elif kind == "hr_zones":
+            self.hr_zones = engine
+            updated, self._hr_zone_totals = result
+            if updated != self.state.get("hr_zones", {}):
+                self.state.set("hr_zones", updated)
+                self.state.save()
+        else:
+            self.activity_trends, self._activity_trends_fresh = engine, True
+
+    def analytics(self, kind, cursor):
+        function, args = self.analytics_task(kind, cursor)
+        self.store_analytics(kind, *function(cursor, *args))
+
+    def start_analytics(self, conn):
+        """Hand this device's analytics to the process pool, which reads the same snapshot file.
+        Returns (future, kinds), or None to run them in this thread instead."""
+        path = snapshot_path(conn) if self.analytics_pool else None
+        if not path:
+            return None
+        try:
+            cursor = conn.cursor()
+            kinds = self.analytics_kinds()
+            tasks = [self.analytics_task(kind, cursor) for kind in kinds]
+            return self.analytics_pool.submit(analyse_snapshot, path, tasks), kinds
+        except Exception as e:
+            self.logger.warning(f"Could not start analytics in a worker process, running them here: {e}")
+            return None
+
+    def finish_analytics(self, pending):
+        future, kinds = pending
+        try:
+            for kind, (result, engine) in zip(kinds, future.result()):
+                self.store_analytics(kind, result, engine)
+        except Exception as e:
+            self.logger.warning(f"Analytics worker process failed, running them here: {e}")
+
+    def scan_workouts(self, cursor):
+        if self._workouts is None:
+            self._workouts = self.workouts.scan(cursor, self.state.get("workouts", {}), self.get_device_id(cursor))
+        return self._workouts
+
+    def query_last_workout(self, cursor, key=None) -> Any:
+        """One field of the newest workout, or all of it when key is None."""
+        last = self.scan_workouts(cursor)[1].get("last")
+        if last is None:
+            return None
+        return last if key is None else last.get(key)
+
+    def run_workouts(self, conn):
+        """Publish each workout added since the last cycle on gadgetbridge/<user>_<device>/workout."""
+        if not self.mqtt_session.connected:
+            return   # the offline queue keeps one message per topic; publish these once reconnected
+        workouts, state = self.scan_workouts(conn.cursor())
+        topic = f"gadgetbridge/{self.user_name}_{self.device_name}/workout"
+        for workout in workouts:
+            if not self.publish_threadsafe(topic, json.dumps(workout), qos=1):
+                return   # keep the old _id watermark, so these are published again
+            self.logger.info(f"New workout: {workout['type']} at {workout['start']}")
+        if state != self.state.get("workouts"):
+            self.state.set("workouts", state)
+            self.state.save()
+
 # Untested Xiaomi queries:
     def query_latest_weight(self, cursor) -> Any:
         cursor.execute(
@@ -640,12 +1250,7 @@ class GadgetbridgeMQTTPublisher:
 
     def load_config(self):
         """Load MQTT configuration from environment variables"""
-        self.mqtt_config = {
-            "broker": os.getenv("MQTT_BROKER", "localhost"),
-            "port": int(os.getenv("MQTT_PORT", "1883")),
-            "username": os.getenv("MQTT_USERNAME", ""),
-            "password": os.getenv("MQTT_PASSWORD", ""),
-        }
+        self.mqtt_config = load_mqtt_config()
 
 # ------------------------------ Configure Home Assistant automatic discovery -----------------------
 
@@ -659,13 +1264,17 @@ class GadgetbridgeMQTTPublisher:
         discovery_topic = (
             f"homeassistant/{entity_type}/{self.mac_address.replace(':','')}_{entity_id}/config"
         )
-        try:
-            await self.mqtt_client.publish(
-                discovery_topic, json.dumps(config), qos=0, retain=True
-            )
+        payload = json.dumps(config)
+        if self._discovery.get(discovery_topic) == payload_hash(payload):
+            return   # already on the broker, retained
+        if await self.mqtt_publish(discovery_topic, payload, qos=0, retain=True):
+            self._discovery[discovery_topic] = payload_hash(payload)
             self.logger.info(f"Published discovery config for {entity_id}")
-        except Exception as e:
-            self.logger.error(f"Failed to publish discovery config: {e}")
+
+    def availability_topic(self, sensor):
+        """Topic holding "online" while the sensor's query succeeds and "offline" after a timeout or error, so
+        Home Assistant shows the sensor as unavailable instead of presenting the last retained value as current."""
+        return f"{sensor['state_topic']}/availability"
 
     async def setup_home_assistant_entities(self):
         """Setup Home Assistant entities via MQTT discovery"""
@@ -675,7 +1284,7 @@ class GadgetbridgeMQTTPublisher:
             "model": f"{self.device_name}",
             "manufacturer": f"{self.manufacturer}",
         }
-        for sensor in self.sensors:
+        for sensor in self.sensors + self.diagnostic_sensors:
             config = {
                 "name": sensor['name'],
                 "unique_id": f"{self.mac_address.replace(':','')}_{sensor['unique_id']}",
@@ -683,51 +1292,392 @@ class GadgetbridgeMQTTPublisher:
                 "device": device_info,
             }
             # Add optional fields if present
-            for key in ["unit_of_measurement", "icon", "state_class", "device_class"]:
+            for key in ["unit_of_measurement", "icon", "state_class", "device_class",
+                        "entity_category", "json_attributes_topic"]:
                 if key in sensor:
                     config[key] = sensor[key]
+            if "query" in sensor:
+                config["availability_topic"] = self.availability_topic(sensor)
             await self.publish_home_assistant_discovery(
                 "sensor", sensor["unique_id"], config
             )
+            if "query" in sensor and self.availability_topic(sensor) not in self._published:
+                # Until the first cycle says otherwise, the retained value on the broker counts as current
+                await self.publish_state(self.availability_topic(sensor), "online")
+        self.checkpoint()
 
 
 # ----------------------- Fetch sensor data from database -------------------------
 
-    def get_sensor_data(self, delay=30) -> Dict[str, Any]:
-        """Query all sensors in one DB session with full retry."""
+    def get_sensor_data(self, delay=30, publish=None) -> Dict[str, Any]:
+        """Query all sensors in one DB session with full retry.
+        publish, if given, is called with the sensor data while the snapshot is still open; the snapshot
+        stages run after it, so a long backfill or archive run never holds up the sensor states.
+        Blocking: run it in a worker thread so the event loop stays responsive."""
         while True:
             try:
                 if not os.path.exists(self.db_path):
                     raise FileNotFoundError(f"DB file not found while fetching sensors: {self.db_path}")
 
-                with open_db_snapshot(self.db_path) as conn:
-                    cursor = conn.cursor()
-                    data = {}
-                    for sensor in self.sensors:
-                        try:
-                            data[sensor["unique_id"]] = sensor["query"](cursor)
-                        except Exception as e:
-                            self.logger.error(f"Error querying {sensor['unique_id']}: {e}")
-                            data[sensor["unique_id"]] = None
+                snapshot_stats = {}
+                mtime = os.path.getmtime(self.db_path)
+                with open_db_snapshot(self.db_path, snapshot_stats) as conn:
+                    self.record_snapshot(snapshot_stats, mtime)
+                    data = self.read_snapshot(conn)
+                    if publish:
+                        publish(data)
+                    self.run_stages(conn)
                     return data  # success — return immediately
             except (sqlite3.OperationalError, FileNotFoundError) as e:
                 self.logger.warning(f"DB access failed while fetching sensors, retrying in {delay}s: {e}")
                 time.sleep(delay)
 
+    def record_snapshot(self, snapshot_stats, mtime):
+        self._snapshot_mtime = mtime
+        self.metrics.snapshot_time = time.time()
+        self.metrics.snapshot_seconds = round(snapshot_stats["copy_seconds"], 4)
+        self.metrics.snapshot_bytes = snapshot_stats["bytes"]
+
+    def read_snapshot(self, conn, analytics=None) -> Dict[str, Any]:
+        """Run every sensor query against an open snapshot.
+        analytics is what start_analytics returned, if the caller started them already."""
+        if self.result_cache:
+            self.result_cache.new_snapshot()
+            cursor = CachingCursor(conn, self.result_cache)
+        else:
+            cursor = conn.cursor()
+        self.forget_snapshot_results()
+        self._snapshot_header = db_header(snapshot_path(conn) or self.db_path)
+        analytics = analytics or self.start_analytics(conn)
+        if analytics:
+            self.finish_analytics(analytics)
+        data = {}
+        for sensor in self.sensors:
+            data[sensor["unique_id"]] = self.run_sensor_query(conn, cursor, sensor)
+            if "attributes" in sensor:
+                data[f"{sensor['unique_id']}_attributes"] = self.run_sensor_query(conn, cursor, sensor, "attributes")
+        return data
+
+    def forget_snapshot_results(self):
+        """Drop the analytics and workout results shared by the sensors, so the next read computes them again."""
+        self._sleep = None
+        self._hr_zone_totals = None
+        self._activity_trends_fresh = False
+        self._workouts = None
+
+    def run_stages(self, conn):
+        for stage in self.snapshot_stages:
+            try:
+                stage(conn)
+            except Exception as e:
+                self.logger.error(f"Error in {stage.__name__}: {e}")
+
+    def run_sensor_query(self, conn, cursor, sensor, field="query") -> Any:
+        """Run one sensor query (or its "attributes" query) within its time budget; a timeout or error yields None."""
+        unique_id = sensor["unique_id"] if field == "query" else f"{sensor['unique_id']}_{field}"
+        value = None
+        misses = getattr(cursor, "misses", None)
+        with self.query_budget.limit(conn, unique_id) as budget:
+            try:
+                value = sensor[field](cursor)
+                status = "ok"
+                budget.record = misses is None or cursor.misses > misses   # not when answered from cache
+            except Exception as e:
+                if budget.timed_out:
+                    self.logger.warning(
+                        f"Query for {unique_id} exceeded its {budget.budget:.2f}s budget and was interrupted; "
+                        "marking it unavailable for this cycle"
+                    )
+                    status = "timeout"
+                else:
+                    self.logger.error(f"Error querying {unique_id}: {e}")
+                    status = "error"
+                self.metrics.record_query_error(unique_id)
+        with self.metrics.lock:   # health() reads sensor_status on the event loop
+            self.sensor_status[unique_id] = status
+        self.metrics.record_query(unique_id, budget.elapsed, budget.steps)
+        return value
+
+# ----------------------- Backfill of raw samples -------------------------
+
+    def publish_threadsafe(self, topic, payload, qos=0, retain=False, queue=True) -> bool:
+        """Publish from the worker thread: hand the message to the event loop and wait until it is sent.
+        Waiting gives the snapshot stages natural back-pressure from the broker."""
+        future = asyncio.run_coroutine_threadsafe(
+            self.mqtt_publish(topic, payload, qos, retain, queue=queue), self._loop
+        )
+        return future.result()
+
+    def run_alerts(self, conn):
+        """Check the rows synced since the last cycle against the alert rules and publish an event on
+        gadgetbridge/<user>_<device>/alert for each rule they set off."""
+        if not self.mqtt_session.connected:
+            return   # the offline queue keeps one message per topic; check these rows once reconnected
+        cursor = conn.cursor()
+        events, state = self.alert_engine.scan(cursor, self.state.get("alerts", {}), self.get_device_id(cursor))
+        topic = f"gadgetbridge/{self.user_name}_{self.device_name}/alert"
+        for event in events:
+            if not self.publish_threadsafe(topic, json.dumps(event), qos=1):
+                return   # keep the old high-water marks, so these rows are checked again
+            self.logger.info(f"Alert {event['rule']}: {event['metric']} {event['value']} at {event['time']}")
+        self.state.set("alerts", state)
+        self.state.save()
+
+    def backfill_streams(self):
+        """(stream name, table, columns) for each raw sample table that is backfilled."""
+        activity_columns = ["TIMESTAMP", "STEPS"]
+        for attr in ("distance_column", "calories_column"):
+            if hasattr(self, attr):
+                activity_columns.append(getattr(self, attr))
+        heart_rate_table = getattr(self, "watch_type_heart_rate", None)
+        if heart_rate_table == self.watch_type_activity:
+            activity_columns.append(self.heart_rate_column)
+        streams = [("activity", self.watch_type_activity, activity_columns)]
+        if heart_rate_table and heart_rate_table != self.watch_type_activity:
+            streams.append(("heart_rate", heart_rate_table, ["TIMESTAMP", self.heart_rate_column]))
+        return streams
+
+    def run_backfill(self, conn):
+        """Stream every sample newer than the persisted cursor, in timestamped batches, to
+        gadgetbridge/<user>_<device>/backfill/<stream>. The cursor only moves past batches the broker
+        acknowledged (QoS 1). A batch that could not be sent is not queued in the session: the next cycle
+        sends it again from the cursor, so a reconnect does not deliver it twice."""
+        if not self.mqtt_session.connected:
+            self.logger.info("Backfill skipped while MQTT is disconnected")
+            return
+        cursors = self.state.get("backfill", {})
+        device_id = self.get_device_id(conn.cursor())
+        for stream, table, columns in self.backfill_streams():
+            cursor = conn.cursor()
+            scale = timestamp_scale(cursor, table)
+            since = cursors.get(table)
+            if since is None:
+                since = int((time.time() - self.backfill_initial_hours * 3600) * scale)
+            topic = f"gadgetbridge/{self.user_name}_{self.device_name}/backfill/{stream}"
+            sent = 0
+            for rows in iter_sample_batches(cursor, table, columns, since, self.backfill_batch_size, device_id):
+                if sent:
+                    time.sleep(self.backfill_interval)   # rate limit between batches, not after the last one
+                if self.backfill_encoding == "binary":
+                    payload = encode_batch(stream, columns, rows, scale)
+                else:
+                    payload = json.dumps({
+                        "stream": stream,
+                        "columns": columns,
+                        "timestamp_unit": "ms" if scale == 1000 else "s",
+                        "samples": rows,
+                    })
+                if not self.publish_threadsafe(topic, payload, qos=1, queue=False):
+                    break
+                cursors[table] = rows[-1][0]
+                sent += len(rows)
+            self.state.set("backfill", cursors)
+            self.state.save()
+            if sent:
+                self.logger.info(f"Backfilled {sent} {stream} samples from {table}")
+
+# ----------------------- Output sinks -------------------------
+
+    def run_sink_samples(self, conn):
+        """Hand samples newer than the persisted watermark to every sink that takes them. Waiting for each
+        sink to accept a batch passes its back-pressure on to this stage."""
+        marks = self.state.get("sink_samples", {})
+        device_id = self.get_device_id(conn.cursor())
+        device = f"{self.user_name}_{self.device_name}"
+        sinks = [sink for sink in self.sinks if sink.wants_samples]
+        for stream, table, columns in self.backfill_streams():
+            cursor = conn.cursor()
+            scale = timestamp_scale(cursor, table)
+            since = marks.get(table)
+            if since is None:
+                since = int((time.time() - self.sink_initial_hours * 3600) * scale)
+            for rows in iter_sample_batches(cursor, table, columns, since, 1000, device_id):
+                for sink in sinks:
+                    asyncio.run_coroutine_threadsafe(
+                        sink.write_samples(device, stream, columns, rows, scale), self._loop
+                    ).result()
+                marks[table] = rows[-1][0]
+            self.state.set("sink_samples", marks)
+            self.state.save()
+
+# ----------------------- Sample archive -------------------------
+
+    def archive_tables(self):
+        tables = [getattr(self, name, None) for name in
+                  ("watch_type_activity", "watch_type_heart_rate", "watch_type_spo2", "watch_type_sleep")]
+        return list(dict.fromkeys(t for t in tables if t))   # pinetime keeps heart rate in the activity table
+
+    def run_archive(self, conn):
+        """Append samples past each table's watermark to the archive; the watermark moves per batch written.
+        At most archive_rows_per_cycle rows per table are copied in one cycle, so the first run works
+        through years of history over several cycles instead of all at once."""
+        marks = self.state.get("archive", {})
+        device_id = self.get_device_id(conn.cursor())
+        for table in self.archive_tables():
+            archived = 0
+            batches = self.archive.archive_table(conn, table, marks.get(table, 0), device_id)
+            for count, mark in batches:
+                archived += count
+                marks[table] = mark
+                self.state.set("archive", marks)
+                self.state.save()
+                if archived >= self.archive_rows_per_cycle:
+                    batches.close()
+                    self.logger.info(f"Archived {archived} rows of {table}; the rest follows in the next cycles")
+                    break
+            else:
+                if archived:
+                    self.logger.info(f"Archived {archived} rows of {table}")
+
+# ----------------------- Hourly long-term statistics -------------------------
+
+    def run_statistics(self, conn):
+        """Emit Home Assistant long-term statistics for every hour closed since the persisted watermark."""
+        state = dict(self.state.get("statistics", {}))
+        cursor = conn.cursor()
+        device_id = self.get_device_id(cursor)
+        prefix = "gadgetbridge:" + re.sub(r"\W+", "_", f"{self.user_name}_{self.device_name}").lower()
+        initial = int(time.time() - self.statistics_initial_days * 86400)
+        initial -= initial % 3600
+        statistics = []
+
+        heart_rate_table = getattr(self, "watch_type_heart_rate", None)
+        if heart_rate_table:
+            scale = timestamp_scale(cursor, heart_rate_table)
+            start = state.get("heart_rate_until", initial)
+            end = closed_until(cursor, heart_rate_table, scale, device_id)
+            if end > start:
+                rows = hourly_heart_rate(cursor, heart_rate_table, self.heart_rate_column, start, end, scale, device_id)
+                if rows:
+                    statistics.append(mean_statistic(f"{prefix}_heart_rate", "Heart Rate", "bpm", rows))
+                state["heart_rate_until"] = end
+
+        metrics = [("steps", "Steps", "steps", "STEPS")]
+        if hasattr(self, "distance_column"):
+            metrics.append(("distance", "Distance", "meters", self.distance_column))
+        if hasattr(self, "calories_column"):
+            metrics.append(("calories", "Calories", "kcal", self.calories_column))
+        scale = timestamp_scale(cursor, self.watch_type_activity)
+        start = state.get("activity_until", initial)
+        end = closed_until(cursor, self.watch_type_activity, scale, device_id)
+        if end > start:
+            rows = hourly_sums(cursor, self.watch_type_activity, [m[3] for m in metrics], start, end, scale, device_id)
+            totals = dict(state.get("sums", {}))
+            for i, (key, name, unit, _) in enumerate(metrics):
+                statistic, totals[key] = sum_statistic(
+                    f"{prefix}_{key}", name, unit, [(hour, values[i]) for hour, values in rows], totals.get(key, 0)
+                )
+                if statistic["stats"]:
+                    statistics.append(statistic)
+            state["sums"] = totals
+            state["activity_until"] = end
+
+        if statistics and not self.emit_statistics(statistics):
+            return   # keep the old watermark, so the same hours are tried again next cycle
+        self.state.set("statistics", state)
+        self.state.save()
+        if statistics:
+            hours = sum(len(s["stats"]) for s in statistics)
+            self.logger.info(f"Emitted {hours} hourly statistics rows for {len(statistics)} statistics")
+
+    def emit_statistics(self, statistics) -> bool:
+        payload = json.dumps(statistics)
+        if self.statistics_mode == "file":
+            try:
+                os.makedirs(os.path.dirname(self.statistics_file) or ".", exist_ok=True)
+                with open(self.statistics_file, "a") as f:
+                    f.write(payload + "\n")
+                return True
+            except OSError as e:
+                self.logger.error(f"Could not write statistics to {self.statistics_file}: {e}")
+                return False
+        topic = f"gadgetbridge/{self.user_name}_{self.device_name}/statistics"
+        return self.publish_threadsafe(topic, payload, qos=1)
+
 # ---------------------------- Sensor Loop -------------------------------
 
     async def publish_sensor_data(self, data: Dict[str, Any]):
         """Publish all sensor data to MQTT asynchronously"""
+        start = time.monotonic()
         for sensor in self.sensors:
             value = data.get(sensor["unique_id"])
             if value is not None:
-                try:
-                    await self.mqtt_client.publish(
-                        sensor["state_topic"], str(value), qos=0, retain=True
+                await self.publish_state(sensor["state_topic"], str(value))
+            attributes = data.get(f"{sensor['unique_id']}_attributes")
+            if attributes is not None:
+                await self.publish_state(sensor["json_attributes_topic"], json.dumps(attributes))
+            status = self.sensor_status.get(sensor["unique_id"])
+            if status:
+                await self.publish_state(self.availability_topic(sensor), "online" if status == "ok" else "offline")
+        self.checkpoint()
+        values = {k: v for k, v in data.items() if not k.endswith("_attributes")}
+        for sink in self.sinks:
+            await sink.write_values(f"{self.user_name}_{self.device_name}", values, time.time())
+        self.metrics.publish_seconds = round(time.monotonic() - start, 4)
+        if self._snapshot_mtime is not None:
+            self.metrics.publish_lag_seconds = round(time.time() - self._snapshot_mtime, 2)
+        self.metrics.cycles += 1
+        self.metrics.last_cycle = round(time.time(), 1)
+        self.logger.info(f"Published sensor data: { {k: v for k, v in data.items() if not k.endswith('_attributes')} }")
+        await self.publish_diagnostics()
+
+    async def publish_state(self, topic, payload):
+        """Publish a retained sensor state, unless the broker already has exactly this payload.
+        Over MQTT 5 the state expires after message_expiry seconds, so a watch that stops syncing
+        leaves no stale values behind; an unchanged state is sent again half way through its lifetime.
+        It also carries the time of the database export it was read from (Unix seconds) as a "timestamp"
+        user property."""
+        expiry = self.message_expiry if self.mqtt_session.mqtt5 else None
+        fresh = not expiry or time.time() - self._published_at.get(topic, 0) < expiry / 2
+        if self._published.get(topic) == payload_hash(payload) and fresh:
+            return
+        timestamp = [("timestamp", str(int(self._snapshot_mtime)))] if self._snapshot_mtime else []
+        if await self.mqtt_publish(topic, payload, qos=0, retain=True, expiry=expiry, user_properties=timestamp):
+            self._published[topic] = payload_hash(payload)
+            self._published_at[topic] = round(time.time())
+
+    async def publish_diagnostics(self):
+        """Publish the diagnostic sensors from the metrics of the cycle just finished."""
+        for sensor in self.diagnostic_sensors:
+            try:
+                value = sensor["value"]()
+                if value is not None:
+                    await self.mqtt_publish(sensor["state_topic"], str(value), qos=0, retain=True)
+                if "attributes" in sensor:
+                    await self.mqtt_publish(
+                        sensor["json_attributes_topic"], json.dumps(sensor["attributes"]()), qos=0, retain=True
                     )
-                except Exception as e:
-                    self.logger.error(f"Failed to publish {sensor['unique_id']}: {e}")
-        self.logger.info(f"Published sensor data: {data}")
+            except Exception as e:
+                self.logger.error(f"Failed to publish {sensor['unique_id']}: {e}")
+
+    async def mqtt_publish(self, topic, payload, qos=0, retain=False, expiry=None, user_properties=(), queue=True) -> bool:
+        """Publish through the MQTT session. While disconnected the message is queued (latest per topic),
+        unless queue is False."""
+        sent = await self.mqtt_session.publish(
+            topic, payload, qos=qos, retain=retain, expiry=expiry, user_properties=user_properties, queue=queue
+        )
+        if not sent:
+            self.metrics.mqtt_failures += 1
+        return sent
+
+    def publish_from_worker(self, data):
+        """Publish the sensor states from the worker thread, waiting until they are out."""
+        asyncio.run_coroutine_threadsafe(self.publish_sensor_data(data), self._loop).result()
+
+    async def publish_cycle(self, republish=False):
+        """Fetch sensor data in a worker thread and publish it, then run the snapshot stages. Cycles never overlap.
+        With republish, first forget what was published and send the discovery configs again."""
+        async with self._cycle_lock:
+            if republish:
+                # Under the lock: a running cycle updates and checkpoints the same published-value dicts
+                self.forget_published()
+                await self.setup_home_assistant_entities()
+            self._loop = asyncio.get_running_loop()   # for publish_threadsafe from the worker thread
+            self.metrics.cycle_started = time.time()
+            try:
+                await self._loop.run_in_executor(self.executor, self.get_sensor_data, 30, self.publish_from_worker)
+            finally:
+                self.metrics.cycle_started = None
 
 # --------------------------- Main Program -------------------------------
 
@@ -735,7 +1685,7 @@ class GadgetbridgeMQTTPublisher:
         """Handle incoming MQTT commands"""
         try:
             if payload == "ping":
-                await self.mqtt_client.publish("gadgetbridge/response", "pong")
+                await self.mqtt_publish("gadgetbridge/response", "pong")
                 self.logger.info("Replied to ping with pong")
             else:
                 self.logger.warning(f"Unknown command: {payload}")
@@ -744,7 +1694,33 @@ class GadgetbridgeMQTTPublisher:
 
     async def run(self):
         """Run MQTT listener and file watcher concurrently."""
-        await asyncio.gather(self._mqtt_listener(), self._watch_file_changes())
+        tasks = [self.mqtt_session.run(), self._watch_file_changes()] + [sink.run() for sink in self.sinks]
+        if self.prometheus_port:
+            tasks.append(serve_prometheus(self.prometheus_text, self.prometheus_port))
+        if self.health_file:
+            render = lambda: heartbeat_state(self.mqtt_session, [self.health()])
+            tasks.append(heartbeat(render, self.health_file, self.health_interval))
+        await asyncio.gather(*tasks)
+
+    def prometheus_text(self) -> str:
+        return self.metrics.prometheus_text(
+            {"device": f"{self.user_name}_{self.device_name}"}, self.result_cache.stats() if self.result_cache else None
+        )
+
+    def health(self) -> Dict[str, Any]:
+        """This device's part of the heartbeat file (see health.py). Built from memory only."""
+        snapshot_time = self.metrics.snapshot_time
+        with self.metrics.lock:
+            unavailable = sorted(k for k, v in self.sensor_status.items() if v != "ok")
+        return {
+            "device": f"{self.user_name}_{self.device_name}",
+            "last_cycle": self.metrics.last_cycle,
+            "cycle_started": self.metrics.cycle_started,
+            "snapshot_age_seconds": round(time.time() - snapshot_time, 1) if snapshot_time else None,
+            "db_modified": self._snapshot_mtime,
+            "sensor_errors": self.metrics.query_error_counts(),
+            "unavailable_sensors": unavailable,
+        }
 
     async def _set_mtime_baseline(self):
         """Record current mtime without publishing (baseline)."""
@@ -767,8 +1743,7 @@ class GadgetbridgeMQTTPublisher:
                 elif mtime != self._db_mtime:
                     # File changed -> publish and update baseline
                     self._db_mtime = mtime
-                    sensor_data = self.get_sensor_data()
-                    await self.publish_sensor_data(sensor_data)
+                    await self.publish_cycle()
                     self.logger.info("Published data due to DB update")
             except FileNotFoundError:
                 # File missing; clear baseline
@@ -778,45 +1753,231 @@ class GadgetbridgeMQTTPublisher:
 
             await asyncio.sleep(self.check_interval)  # set in compose file
 
-    async def _mqtt_listener(self):
-        """Listen for MQTT commands."""
-        async with aiomqtt.Client(
-            hostname=self.mqtt_config["broker"],
-            port=self.mqtt_config["port"],
-            username=self.mqtt_config["username"] or None,
-            password=self.mqtt_config["password"] or None,
-        ) as client:
-            self.mqtt_client = client
-
-            # Set up entities and do a one-time publish on startup
-            await self.setup_home_assistant_entities()
-            sensor_data = self.get_sensor_data()
-            await self.publish_sensor_data(sensor_data)
+    async def _on_mqtt_connect(self):
+        """Called after every (re)connect. Only the first one sets up entities and reads the DB;
+        after a reconnect the session re-sends the retained discovery configs and states itself."""
+        if self._initial_publish_done:
+            return
+        # Set up entities and do a one-time publish on startup
+        await self.setup_home_assistant_entities()
+        if self.warm_unchanged:
+            self.logger.info("Database unchanged since the last run; sensor states on the broker are current")
+        else:
+            await self.publish_cycle()
             self.logger.info("Published initial sensor data")
+        self._initial_publish_done = True
+
+        # Set time baseline after the initial publish
+        await self._set_mtime_baseline()
+
+    async def _on_mqtt_message(self, message):
+        """Handle a command received on gadgetbridge/command, or a range query."""
+        if str(message.topic) == QUERY_TOPIC:
+            await self.query_service.submit(message.payload)
+            return
+        payload = message.payload.decode().strip().lower()
+        self.logger.info(f"Received command on {message.topic}: {payload}")
+
+        if payload in ("status", "publish", "go", "republish"):
+            # Manual trigger: publish regardless of mtime, then refresh baseline
+            await self.publish_cycle(republish=payload == "republish")
+            try:
+                self._db_mtime = os.path.getmtime(self.db_path)
+            except FileNotFoundError:
+                self._db_mtime = None
+            self.logger.info("Published sensor data (command)")
+        elif payload == "ping":
+            await self.mqtt_publish("gadgetbridge/reply", "pong")
+        else:
+            self.logger.warning(f"Unknown command: {payload}")
+
+# --------------------- Several databases in one process ------------------------
+
+class DatabaseGroup:
+    """One Gadgetbridge database and the publishers of the watches in it. A change to the file
+    triggers one snapshot, read by every publisher in turn, on a worker from the shared pool.
+    Only one cycle per database runs at a time, so a busy export holds at most one worker."""
+
+    def __init__(self, db_path, publishers, executor, check_interval):
+        self.db_path = db_path
+        self.publishers = publishers
+        self.executor = executor
+        self.check_interval = check_interval
+        self.logger = logging.getLogger(__name__)
+        self._lock = asyncio.Lock()
+        self._db_mtime = None
+
+    def read_all(self, delay=30):
+        """Snapshot the database once and read every publisher's sensors from it, with full retry.
+        The sensor states of all watches are published before any snapshot stage runs."""
+        while True:
+            try:
+                snapshot_stats = {}
+                mtime = os.path.getmtime(self.db_path)
+                with open_db_snapshot(self.db_path, snapshot_stats) as conn:
+                    # Start every device's analytics first, so they run side by side in the process pool
+                    analytics = [publisher.start_analytics(conn) for publisher in self.publishers]
+                    results = []
+                    for publisher, pending in zip(self.publishers, analytics):
+                        publisher.record_snapshot(snapshot_stats, mtime)
+                        results.append(publisher.read_snapshot(conn, pending))
+                    for publisher, data in zip(self.publishers, results):
+                        publisher.publish_from_worker(data)
+                    for publisher in self.publishers:
+                        publisher.run_stages(conn)
+                    return results
+            except (sqlite3.OperationalError, FileNotFoundError) as e:
+                self.logger.warning(f"DB access failed for {self.db_path}, retrying in {delay}s: {e}")
+                time.sleep(delay)
+
+    async def publish_cycle(self, republish=False):
+        async with self._lock:
+            if republish:
+                for publisher in self.publishers:
+                    publisher.forget_published()
+                    await publisher.setup_home_assistant_entities()
+            loop = asyncio.get_running_loop()
+            for publisher in self.publishers:
+                publisher._loop = loop   # for publish_threadsafe from the worker thread
+                publisher.metrics.cycle_started = time.time()
+            try:
+                await loop.run_in_executor(self.executor, self.read_all)
+            finally:
+                for publisher in self.publishers:
+                    publisher.metrics.cycle_started = None
+        try:
+            self._db_mtime = os.path.getmtime(self.db_path)
+        except FileNotFoundError:
+            self._db_mtime = None
+
+    async def watch(self):
+        """Poll the DB mtime and publish when it changes."""
+        while True:
+            try:
+                mtime = os.path.getmtime(self.db_path)
+                if self._db_mtime is None:
+                    self._db_mtime = mtime
+                elif mtime != self._db_mtime:
+                    self._db_mtime = mtime
+                    await self.publish_cycle()
+                    self.logger.info(f"Published data due to DB update of {self.db_path}")
+            except FileNotFoundError:
+                if self._db_mtime is not None:
+                    self.logger.warning(f"DB file missing: {self.db_path}")
+                self._db_mtime = None
+            await asyncio.sleep(self.check_interval)
+
+
+class MultiPublisher:
+    """Several Gadgetbridge databases, each with its own watches, in one process: one event loop,
+    one MQTT connection and one bounded pool of worker threads for all the database reads.
+
+    GADGETBRIDGE_DB_PATH lists the databases separated by ";". WATCH_TYPE and MAC_ADDRESS have one
+    ";"-separated group per database, with the watches in a group separated by ",". A group with a
+    single watch type uses it for every MAC address in that group.
+    """
+
+    def __init__(self):
+        db_paths = [p.strip() for p in os.getenv("GADGETBRIDGE_DB_PATH", "/data/Gadgetbridge.db").split(";")]
+        watch_groups = os.getenv("WATCH_TYPE", "error").split(";")
+        mac_groups = os.getenv("MAC_ADDRESS", "error").split(";")
+        if not len(db_paths) == len(watch_groups) == len(mac_groups):
+            raise ValueError("GADGETBRIDGE_DB_PATH, WATCH_TYPE and MAC_ADDRESS need one ;-separated group per database")
+        self.check_interval = int(os.getenv("CHECK_INTERVAL_SECONDS", "30"))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("WORKER_THREADS", str(min(4, len(db_paths))))),
+            thread_name_prefix="snapshot",
+        )
+        self.mqtt_session = make_mqtt_session(self._on_mqtt_connect, self._on_mqtt_message)
+        self.prometheus_port = int(os.getenv("PROMETHEUS_PORT", "0"))
+        self.health_file = os.getenv("HEALTH_FILE", DEFAULT_HEALTH_FILE)
+        self.health_interval = float(os.getenv("HEALTH_INTERVAL_SECONDS", "15"))
+        processes = int(os.getenv("ANALYTICS_PROCESSES", "0"))
+        self.analytics_pool = make_pool(processes) if processes and SleepEngine else None
+        self.sinks = make_sinks()
+        self.groups = []
+        for db_path, watch_types, macs in zip(db_paths, watch_groups, mac_groups):
+            macs = [m.strip() for m in macs.split(",")]
+            watch_types = [w.strip() for w in watch_types.split(",")]
+            if len(watch_types) == 1:
+                watch_types *= len(macs)
+            if len(watch_types) != len(macs):
+                raise ValueError(f"{db_path}: {len(watch_types)} watch types for {len(macs)} MAC addresses")
+            publishers = [
+                GadgetbridgeMQTTPublisher(
+                    db_path, watch_type, mac, self.mqtt_session, self.executor, self.analytics_pool, self.sinks
+                )
+                for watch_type, mac in zip(watch_types, macs)
+            ]
+            self.groups.append(DatabaseGroup(db_path, publishers, self.executor, self.check_interval))
+        self.publishers = [p for group in self.groups for p in group.publishers]
+        self.query_service = QueryService(self.publishers, self.mqtt_session, open_db_snapshot, self.executor)
+        self.logger = logging.getLogger(__name__)
+        self._initial_publish_done = False
+
+    async def run(self):
+        tasks = [self.mqtt_session.run()] + [group.watch() for group in self.groups] + [s.run() for s in self.sinks]
+        if self.prometheus_port:
+            tasks.append(serve_prometheus(self.prometheus_text, self.prometheus_port))
+        if self.health_file:
+            render = lambda: heartbeat_state(self.mqtt_session, [p.health() for p in self.publishers])
+            tasks.append(heartbeat(render, self.health_file, self.health_interval))
+        await asyncio.gather(*tasks)
+
+    async def publish_all(self, republish=False):
+        await asyncio.gather(*(group.publish_cycle(republish) for group in self.groups))
+
+    def prometheus_text(self) -> str:
+        return combine_prometheus(p.prometheus_text() for p in self.publishers)
+
+    async def _on_mqtt_connect(self):
+        if self._initial_publish_done:
+            return
+        for publisher in self.publishers:
+            await publisher.setup_home_assistant_entities()
+        changed = [group for group in self.groups if not all(p.warm_unchanged for p in group.publishers)]
+        await asyncio.gather(*(group.publish_cycle() for group in changed))
+        self.logger.info(f"Published initial sensor data for {sum(len(g.publishers) for g in changed)} devices")
+        self._initial_publish_done = True
+
+    async def _on_mqtt_message(self, message):
+        if str(message.topic) == QUERY_TOPIC:
+            await self.query_service.submit(message.payload)
+            return
+        payload = message.payload.decode().strip().lower()
+        self.logger.info(f"Received command on {message.topic}: {payload}")
+        if payload in ("status", "publish", "go", "republish"):
+            await self.publish_all(republish=payload == "republish")
+            self.logger.info("Published sensor data (command)")
+        elif payload == "ping":
+            await self.mqtt_session.publish("gadgetbridge/reply", "pong")
+        else:
+            self.logger.warning(f"Unknown command: {payload}")
+
+
+def combine_prometheus(texts):
+    """Merge the expositions of several devices so that each metric family appears once."""
+    families = {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split()[2]
+                if name in families:
+                    continue
+                families[name] = [line]
+            elif line.startswith("# TYPE "):
+                if len(families[name]) == 1:
+                    families[name].append(line)
+            elif line:
+                families[name].append(line)
+    return "\n".join(line for lines in families.values() for line in lines) + "\n"
+
 
-            # Set time baseline after the initial publish
-            await self._set_mtime_baseline()
-
-            # Subscribe and iterate correctly
-            await client.subscribe("gadgetbridge/command")
-            async for message in client.messages:
-                payload = message.payload.decode().strip().lower()
-                self.logger.info(f"Received command on {message.topic}: {payload}")
-
-                if payload in ("status", "publish", "go"):
-                    # Manual trigger: publish regardless of mtime, then refresh baseline
-                    sensor_data = self.get_sensor_data()
-                    await self.publish_sensor_data(sensor_data)
-                    try:
-                        self._db_mtime = os.path.getmtime(self.db_path)
-                    except FileNotFoundError:
-                        self._db_mtime = None
-                    self.logger.info("Published sensor data (command)")
-                elif payload == "ping":
-                    await client.publish("gadgetbridge/reply", "pong")
-                else:
-                    self.logger.warning(f"Unknown command: {payload}")
 # --- Main Entry Point ---
 if __name__ == "__main__":
-    publisher = GadgetbridgeMQTTPublisher()
+    if any(";" in os.getenv(var, "") or "," in os.getenv(var, "") for var in ("GADGETBRIDGE_DB_PATH", "MAC_ADDRESS")):
+        publisher = MultiPublisher()
+    else:
+        publisher = GadgetbridgeMQTTPublisher()
     asyncio.run(publisher.run())
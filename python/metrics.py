@@ -0,0 +1,118 @@
+"""
+Instrumentation for the snapshot -> query -> publish pipeline.
+The publisher records timings and counters here as it works. They are published as Home Assistant
+diagnostic sensors, and can optionally be scraped from a small Prometheus text endpoint.
+Queries are recorded from the worker thread while the event loop renders, so the per-query dicts are
+only changed and copied under a lock.
+"""
+
+import asyncio
+import logging
+import threading
+
+
+class Metrics:
+    def __init__(self):
+        self.cycles = 0
+        self.snapshot_seconds = None    # Time to copy the DB to a snapshot
+        self.snapshot_bytes = None      # Size of that copy
+        self.query_seconds = {}         # unique_id -> seconds for the last cycle
+        self.query_steps = {}           # unique_id -> SQLite VM instructions (rows-scanned proxy)
+        self.publish_seconds = None     # Time to publish all sensor states
+        self.publish_lag_seconds = None # DB mtime -> publish finished
+        self.mqtt_failures = 0          # Failed publishes since start
+        self.query_errors = {}          # unique_id -> failed or timed out queries since start
+        self.snapshot_time = None       # When the last snapshot was taken
+        self.cycle_started = None       # Set while a cycle is running
+        self.last_cycle = None          # When the last cycle finished publishing
+        self.lock = threading.Lock()    # Guards the per-query dicts
+
+    def record_query(self, unique_id, seconds, steps):
+        with self.lock:
+            self.query_seconds[unique_id] = round(seconds, 4)
+            self.query_steps[unique_id] = steps
+
+    def record_query_error(self, unique_id):
+        with self.lock:
+            self.query_errors[unique_id] = self.query_errors.get(unique_id, 0) + 1
+
+    def query_stats(self):
+        """Copies of the per-query timings, safe to read while a cycle records new ones."""
+        with self.lock:
+            return {"seconds": dict(self.query_seconds), "vm_steps": dict(self.query_steps)}
+
+    def query_error_counts(self):
+        with self.lock:
+            return dict(self.query_errors)
+
+    def total_query_seconds(self):
+        seconds = self.query_stats()["seconds"]
+        return round(sum(seconds.values()), 4) if seconds else None
+
+    def prometheus_text(self, labels: dict, cache_stats=None) -> str:
+        """Render the current values in the Prometheus text exposition format.
+        cache_stats are the query result cache's counters, if it is enabled."""
+        base = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        lines = []
+        stats, errors = self.query_stats(), self.query_error_counts()
+
+        def metric(name, kind, help_text, value, extra=None):
+            if value is None:
+                return
+            label_str = base if not extra else ",".join([base] + [f'{k}="{v}"' for k, v in extra.items()])
+            lines.append(f"# HELP gadgetbridge_{name} {help_text}")
+            lines.append(f"# TYPE gadgetbridge_{name} {kind}")
+            lines.append(f"gadgetbridge_{name}{{{label_str}}} {value}")
+
+        metric("cycles_total", "counter", "Completed publish cycles", self.cycles)
+        metric("snapshot_seconds", "gauge", "Time to copy the DB snapshot", self.snapshot_seconds)
+        metric("snapshot_bytes", "gauge", "Size of the DB snapshot", self.snapshot_bytes)
+        metric("publish_seconds", "gauge", "Time to publish all sensor states", self.publish_seconds)
+        metric("publish_lag_seconds", "gauge", "DB modification to publish finished", self.publish_lag_seconds)
+        metric("mqtt_failures_total", "counter", "Failed MQTT publishes", self.mqtt_failures)
+        metric("last_cycle_timestamp_seconds", "gauge", "When the last cycle finished publishing", self.last_cycle)
+        if cache_stats:
+            metric("query_cache_hits_total", "counter", "Queries answered from the result cache", cache_stats["hits"])
+            metric("query_cache_misses_total", "counter", "Queries run against the snapshot", cache_stats["misses"])
+            metric("query_cache_evictions_total", "counter", "Results dropped from the full cache", cache_stats["evictions"])
+            metric("query_cache_entries", "gauge", "Results held in the cache", cache_stats["entries"])
+        if stats["seconds"]:
+            lines.append("# HELP gadgetbridge_query_seconds Sensor query latency in the last cycle")
+            lines.append("# TYPE gadgetbridge_query_seconds gauge")
+            for unique_id, seconds in stats["seconds"].items():
+                lines.append(f'gadgetbridge_query_seconds{{{base},sensor="{unique_id}"}} {seconds}')
+            lines.append("# HELP gadgetbridge_query_vm_steps SQLite VM instructions per sensor query, approximate")
+            lines.append("# TYPE gadgetbridge_query_vm_steps gauge")
+            for unique_id, steps in stats["vm_steps"].items():
+                lines.append(f'gadgetbridge_query_vm_steps{{{base},sensor="{unique_id}"}} {steps}')
+        if errors:
+            lines.append("# HELP gadgetbridge_query_errors_total Failed or timed out sensor queries")
+            lines.append("# TYPE gadgetbridge_query_errors_total counter")
+            for unique_id, count in errors.items():
+                lines.append(f'gadgetbridge_query_errors_total{{{base},sensor="{unique_id}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+async def serve_prometheus(render, port, host="0.0.0.0"):
+    """Serve render() as text/plain to any HTTP request on host:port."""
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            body = render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Prometheus request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.getLogger(__name__).info(f"Prometheus metrics on port {port}")
+    async with server:
+        await server.serve_forever()
@@ -15,9 +15,13 @@ self.sensors = [
     self.sensor_avg_heart_rate_24h,
     self.sensor_min_heart_rate_24h,
     self.sensor_max_heart_rate_24h,
+    *self.sensor_hr_zones,
     self.sensor_daily_steps,
     self.sensor_weekly_steps,
     self.sensor_monthly_steps,
+    *self.sensor_step_trends,
+    *self.sensor_distance_trends,
+    *self.sensor_calories_trends,
     self.sensor_daily_distance,
     self.sensor_weekly_distance,
     self.sensor_monthly_distance,
@@ -25,5 +29,6 @@ self.sensors = [
     self.sensor_weekly_calories,
     self.sensor_monthly_calories,
     self.sensor_spO2,
+    *self.sensor_last_workout,
 ]
 
@@ -0,0 +1,217 @@
+"""
+Supervised MQTT session.
+Keeps one aiomqtt connection alive: when the broker goes away it reconnects with jittered exponential
+backoff instead of letting the exception end the program. Publishes made while disconnected go into
+a bounded queue that keeps only the latest payload per topic, and are flushed on reconnect. Retained
+messages (discovery configs and sensor states) are also remembered, one per topic and never evicted,
+and re-sent after a reconnect, so a broker that restarted without persistence gets them back without
+re-reading the database.
+
+With protocol "5" the session speaks MQTT 5. A publish may then carry a message expiry interval and
+user properties. The expiry counts from the first publish: a re-send carries what is left of it, and a
+message whose expiry ran out while it waited is not sent again. Topics published more than once on a
+connection get topic aliases, up to the number the broker offers in its CONNACK, so from then on only a
+two-byte alias goes over the wire instead of the topic string; one-off topics such as discovery configs
+never use up an alias. Since the publisher only sends changed states, few topics repeat, so this saves
+little. A broker that refuses MQTT 5 is connected to again with 3.1.1, where those extras are left out,
+for the rest of the session.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+import aiomqtt
+from aiomqtt.exceptions import MqttConnectError
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+UNSUPPORTED_PROTOCOL = (1, 0x84)   # CONNACK codes of 3.1.1 and MQTT 5 for "unsupported protocol version"
+
+
+class Client(aiomqtt.Client):
+    """aiomqtt.Client that keeps the CONNACK properties, which carry the broker's topic alias maximum."""
+
+    connack_properties = None
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        self.connack_properties = properties
+        super()._on_connect(client, userdata, flags, reason_code, properties)
+
+
+class MQTTSession:
+    def __init__(self, config, subscriptions=(), on_connect=None, on_message=None,
+                 queue_size=1000, backoff_min=1.0, backoff_max=60.0):
+        self.config = config
+        self.mqtt5 = config.get("protocol") == "5"   # cleared if the broker refuses MQTT 5
+        self.subscriptions = list(subscriptions)
+        self.on_connect = on_connect      # async callable(), run after every (re)connect
+        self.on_message = on_message      # async callable(message)
+        self.queue_size = queue_size
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.logger = logging.getLogger(__name__)
+
+        self.client = None                # set while connected
+        self.since = time.time()          # when the session last connected or disconnected
+        self.connects = 0
+        self.failures = 0                 # publishes that could not be sent immediately (not counting flushes)
+        self.dropped = 0                  # queued publishes evicted because the queue was full
+        self._pending = OrderedDict()     # topic -> (payload, qos, retain), latest value only
+        self._retained = OrderedDict()    # topic -> (payload, qos, extras), last retained payload sent; no cap
+        self._flushing = False            # re-sending after a reconnect; new publishes wait in the queue
+        self.alias_maximum = 0            # topic aliases the broker accepts on this connection
+        self._aliases = {}                # topic -> alias, for this connection
+        self._seen = set()                # topics published on this connection without an alias
+
+    @property
+    def connected(self):
+        return self.client is not None
+
+    @property
+    def queued(self):
+        return len(self._pending)
+
+    async def publish(self, topic, payload, qos=0, retain=False, expiry=None, user_properties=(), queue=True) -> bool:
+        """Send now if connected, otherwise queue. Returns True if the message went out.
+        expiry (seconds) and user_properties (name, value) pairs are only sent over MQTT 5.
+        With queue=False a message that cannot be sent now is dropped instead, for callers that keep
+        their own cursor and send it again themselves."""
+        extras = (expiry, tuple(user_properties), time.time())
+        if self._flushing and queue:
+            self._enqueue(topic, payload, qos, retain, extras)   # the running flush drains the queue
+            return True
+        if self.client is not None:
+            try:
+                await self._send(self.client, topic, payload, qos, retain, extras)
+                if retain:
+                    self._remember(topic, payload, qos, extras)
+                return True
+            except aiomqtt.MqttError as e:
+                self.logger.warning(f"Publish to {topic} failed{', queueing until reconnect' if queue else ''}: {e}")
+        self.failures += 1
+        if queue:
+            self._enqueue(topic, payload, qos, retain, extras)
+        return False
+
+    async def _send(self, client, topic, payload, qos, retain, extras) -> bool:
+        """Publish one message. Returns False, without sending, if its expiry ran out since it was first published."""
+        if not self.mqtt5:
+            await client.publish(topic, payload, qos=qos, retain=retain)
+            return True
+        expiry, user_properties, published_at = extras
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry:
+            expiry = int(expiry - (time.time() - published_at))   # what is left since the first publish
+            if expiry <= 0:
+                return False
+            properties.MessageExpiryInterval = expiry
+        if user_properties:
+            properties.UserProperty = list(user_properties)
+        alias = self._aliases.get(topic)
+        if alias is not None:
+            properties.TopicAlias = alias
+            topic = ""
+        elif topic in self._seen and len(self._aliases) < self.alias_maximum:
+            alias = self._aliases[topic] = len(self._aliases) + 1
+            properties.TopicAlias = alias
+        else:
+            self._seen.add(topic)
+        await client.publish(topic, payload, qos=qos, retain=retain, properties=properties)
+        return True
+
+    def _remember(self, topic, payload, qos, extras):
+        # Not bounded by queue_size: that would evict the discovery configs, published first, and a broker
+        # that lost its retained store would never get them back. There is one entry per retained topic.
+        self._retained.pop(topic, None)
+        if payload not in ("", b"", None):   # an empty retained payload deletes the topic
+            self._retained[topic] = (payload, qos, extras)
+
+    def _enqueue(self, topic, payload, qos, retain, extras):
+        self._pending.pop(topic, None)    # keep only the newest value, at the back of the queue
+        self._pending[topic] = (payload, qos, retain, extras)
+        while len(self._pending) > self.queue_size:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+
+    async def _flush(self, client):
+        """Re-send remembered retained messages, then everything queued while offline."""
+        outbox = OrderedDict(
+            (topic, (payload, qos, True, extras)) for topic, (payload, qos, extras) in self._retained.items()
+        )
+        for topic, message in self._pending.items():
+            outbox.pop(topic, None)
+            outbox[topic] = message
+        self._flushing = True
+        try:
+            for topic, message in outbox.items():
+                await self._resend(client, topic, *message)
+                if self._pending.get(topic) is message:
+                    del self._pending[topic]
+            # Anything published while the flush was running went into the queue; drain it too
+            while self._pending:
+                topic, message = next(iter(self._pending.items()))
+                await self._resend(client, topic, *message)
+                if self._pending.get(topic) is message:
+                    del self._pending[topic]
+        finally:
+            self._flushing = False
+        if outbox:
+            self.logger.info(f"Flushed {len(outbox)} messages after reconnect")
+
+    async def _resend(self, client, topic, payload, qos, retain, extras):
+        if await self._send(client, topic, payload, qos, retain, extras):
+            if retain:
+                self._remember(topic, payload, qos, extras)
+        elif self._retained.get(topic, (None,))[0] == payload:
+            del self._retained[topic]   # expired on the broker too, so it is not re-sent again
+
+    async def run(self):
+        """Connect, and keep reconnecting, forever."""
+        delay = self.backoff_min
+        while True:
+            try:
+                async with Client(
+                    hostname=self.config["broker"],
+                    port=self.config["port"],
+                    username=self.config["username"] or None,
+                    password=self.config["password"] or None,
+                    protocol=aiomqtt.ProtocolVersion.V5 if self.mqtt5 else aiomqtt.ProtocolVersion.V311,
+                ) as client:
+                    self.connects += 1
+                    delay = self.backoff_min
+                    self._aliases, self._seen = {}, set()   # aliases only live as long as the connection
+                    self.alias_maximum = getattr(client.connack_properties, "TopicAliasMaximum", 0) if self.mqtt5 else 0
+                    await self._flush(client)
+                    self.client = client
+                    self.since = time.time()
+                    self.logger.info(f"Connected to MQTT broker {self.config['broker']}:{self.config['port']}")
+                    if self.on_connect:
+                        await self.on_connect()
+                    for topic in self.subscriptions:
+                        await client.subscribe(topic)
+                    async for message in client.messages:
+                        try:
+                            await self.on_message(message)
+                        except aiomqtt.MqttError:
+                            raise
+                        except Exception as e:
+                            self.logger.error(f"Error handling message on {message.topic}: {e}")
+            except MqttConnectError as e:
+                if self.mqtt5 and getattr(e.rc, "value", e.rc) in UNSUPPORTED_PROTOCOL:
+                    self.logger.warning("MQTT broker does not support MQTT 5; using 3.1.1")
+                    self.mqtt5 = False
+                    continue
+                self.logger.warning(f"MQTT connection refused: {e}")
+            except aiomqtt.MqttError as e:
+                self.logger.warning(f"MQTT connection lost or refused: {e}")
+            finally:
+                if self.client is not None:
+                    self.since = time.time()
+                self.client = None
+            wait = random.uniform(delay / 2, delay)   # jitter, so many clients don't reconnect in step
+            self.logger.info(f"Reconnecting to MQTT broker in {wait:.1f}s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, self.backoff_max)
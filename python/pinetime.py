@@ -10,8 +10,11 @@ self.sensors = [
     self.sensor_avg_heart_rate_24h,
     self.sensor_min_heart_rate_24h,
     self.sensor_max_heart_rate_24h,
+    *self.sensor_hr_zones,
     self.sensor_daily_steps,
     self.sensor_weekly_steps,
     self.sensor_monthly_steps,
+    *self.sensor_step_trends,
     self.sensor_latest_heart_rate,
+    *self.sensor_last_workout,
 ]
@@ -0,0 +1,255 @@
+"""
+Ad-hoc aggregates over a time range, requested over MQTT.
+A request is a JSON object published to gadgetbridge/query:
+    {"id": "a1", "metric": "steps", "start": "2026-10-18T14:00", "end": "2026-10-18T18:00"}
+Optional fields are "aggregate" (sum, avg, min, max or count; steps, distance and calories default to
+sum, the rest to avg), "device" (<user>_<device> or MAC address, needed when several watches are
+published) and "response_topic", which must lie under gadgetbridge/query/response/. Times are ISO 8601,
+in the TZ time zone unless they carry an offset, or Unix seconds; the range includes start and excludes end.
+
+The answer goes to gadgetbridge/query/response/<id> (or response_topic):
+    {"id": "a1", "metric": "steps", "aggregate": "sum", "start": ..., "end": ..., "device": ...,
+     "value": 5321, "samples": 240}
+or {"id": "a1", "error": "..."}.
+
+With the sample archive on (ARCHIVE=true), the part of a range older than the oldest sample of the
+watch still in the database is read from the archive, so ranges survive pruning of the phone's export.
+
+Requests arriving within batch_seconds of each other are answered from one snapshot per database.
+Answers are cached until the database changes, so a dashboard asking the same thing again costs
+nothing. At most max_pending requests wait for a snapshot; more are answered with "busy".
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+from sample_stream import timestamp_scale
+
+try:
+    from sample_archive import read_archive
+except ImportError:   # numpy not installed, so there is no archive either
+    read_archive = None
+
+QUERY_TOPIC = "gadgetbridge/query"
+RESPONSE_TOPIC = f"{QUERY_TOPIC}/response/"
+AGGREGATES = ("sum", "avg", "min", "max", "count")
+SUM_METRICS = ("steps", "distance", "calories")
+
+
+def parse_time(value, tz):
+    if isinstance(value, (int, float)):
+        return int(value)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = tz.localize(moment) if hasattr(tz, "localize") else moment.replace(tzinfo=tz)
+    return int(moment.timestamp())
+
+
+def valid_response_topic(topic):
+    """Answers only go below RESPONSE_TOPIC, so a request cannot publish onto state or command topics."""
+    return isinstance(topic, str) and topic.startswith(RESPONSE_TOPIC) and topic != RESPONSE_TOPIC and not set(topic) & set("+#")
+
+
+def parse_request(payload, tz, max_days=366):
+    """The request as a dict with "start" and "end" in Unix seconds. Raises ValueError if it is unusable."""
+    try:
+        request = json.loads(payload)
+    except ValueError:
+        raise ValueError("request is not JSON")
+    if not isinstance(request, dict) or "metric" not in request:
+        raise ValueError("request needs at least id, metric, start and end")
+    request.setdefault("aggregate", "sum" if request["metric"] in SUM_METRICS else "avg")
+    if request["aggregate"] not in AGGREGATES:
+        raise ValueError(f"aggregate must be one of {', '.join(AGGREGATES)}")
+    try:
+        request["start"], request["end"] = parse_time(request["start"], tz), parse_time(request["end"], tz)
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("start and end must be ISO 8601 times or Unix seconds")
+    if not 0 < request["end"] - request["start"] <= max_days * 86400:
+        raise ValueError(f"end must be after start, and the range at most {max_days} days")
+    if "response_topic" in request and not valid_response_topic(request["response_topic"]):
+        raise ValueError(f"response_topic must start with {RESPONSE_TOPIC}")
+    return request
+
+
+def range_aggregate(cursor, spec, aggregate, start, end, device_id):
+    """(value, samples) of one metric over [start, end). spec is (table, column, lowest, highest)."""
+    table, column, low, high = spec
+    scale = timestamp_scale(cursor, table)
+    cursor.execute(
+        f"SELECT {aggregate}({column}), COUNT({column}) FROM {table} "
+        f"WHERE TIMESTAMP >= ? AND TIMESTAMP < ? AND DEVICE_ID = ? AND {column} BETWEEN ? AND ?",
+        (start * scale, end * scale, device_id, low, high),
+    )
+    value, samples = cursor.fetchone()
+    return (round(value, 2) if isinstance(value, float) else value), samples
+
+
+def archive_aggregate(directory, spec, aggregate, start, end):
+    """(value, samples) of one metric over [start, end) from the sample archive of one watch."""
+    table, column, low, high = spec
+    values = read_archive(directory, table, start, end).get(column)
+    if values is None:
+        return None, 0
+    values = values[(values >= low) & (values <= high)]   # NaN (a NULL) fails both
+    if not len(values):
+        return (0 if aggregate == "count" else None), 0
+    value = {"sum": values.sum, "avg": values.mean, "min": values.min, "max": values.max}.get(aggregate, values.size)
+    value = value() if callable(value) else value
+    return value.item() if hasattr(value, "item") else value, len(values)
+
+
+def combine(aggregate, parts):
+    """Merge (value, samples) of adjacent ranges. An "avg" is merged from the parts' sums."""
+    parts = [(value, samples) for value, samples in parts if samples]
+    samples = sum(n for _, n in parts)
+    if not samples:
+        return (0 if aggregate == "count" else None), 0
+    values = [value for value, _ in parts]
+    value = {"min": min, "max": max}.get(aggregate, sum)(values)
+    if aggregate == "avg":
+        value /= samples
+    return (round(value, 2) if isinstance(value, float) else value), samples
+
+
+def budget_name(request):
+    """Name of the adaptive time budget for a request. Ranges are grouped by size in powers of two days,
+    so a year-long range does not run under a budget learned from one-day ranges."""
+    days = max(1, -(-(request["end"] - request["start"]) // 86400))
+    return f"query_{request['metric']}_{1 << (days - 1).bit_length()}d"
+
+
+class QueryService:
+    def __init__(self, publishers, session, open_snapshot, executor=None, tz=None):
+        self.publishers = publishers
+        self.session = session
+        self.open_snapshot = open_snapshot   # main.open_db_snapshot
+        self.executor = executor
+        self.tz = tz or publishers[0].local_tz
+        self.max_pending = int(os.getenv("QUERY_API_MAX_PENDING", "20"))
+        self.max_days = int(os.getenv("QUERY_API_MAX_DAYS", "366"))
+        self.batch_seconds = float(os.getenv("QUERY_API_BATCH_SECONDS", "0.2"))
+        self.cache_size = int(os.getenv("QUERY_API_CACHE_SIZE", "128"))
+        self.logger = logging.getLogger(__name__)
+        self.cache = OrderedDict()   # (device, metric, aggregate, start, end, db mtime) -> (value, samples)
+        self._pending = []           # (publisher, request) waiting for the next batch
+        self._batch = None
+
+    def find_publisher(self, device):
+        if device is None:
+            return self.publishers[0] if len(self.publishers) == 1 else None
+        wanted = device.lower().replace(":", "")
+        for publisher in self.publishers:
+            names = (f"{publisher.user_name}_{publisher.device_name}".lower(), publisher.mac_address.lower().replace(":", ""))
+            if wanted in names:
+                return publisher
+        return None
+
+    def cache_key(self, publisher, request):
+        try:
+            mtime = os.path.getmtime(publisher.db_path)
+        except OSError:
+            mtime = None
+        return (publisher.mac_address, request["metric"], request["aggregate"], request["start"], request["end"], mtime)
+
+    async def reply(self, request, answer):
+        topic = request.get("response_topic")
+        if not valid_response_topic(topic):
+            topic = f"{RESPONSE_TOPIC}{request.get('id', 'none')}"
+        await self.session.publish(topic, json.dumps({"id": request.get("id"), **answer}), qos=1)
+
+    async def submit(self, payload):
+        """Handle one request message. Never blocks on the database: work is left to the batch task."""
+        try:
+            request = parse_request(payload, self.tz, self.max_days)
+        except ValueError as e:
+            try:
+                request = json.loads(payload)
+                request = request if isinstance(request, dict) else {}
+            except ValueError:
+                request = {}
+            return await self.reply(request, {"error": str(e)})
+        publisher = self.find_publisher(request.get("device"))
+        if publisher is None:
+            return await self.reply(request, {"error": f"unknown device {request.get('device')}"})
+        if request["metric"] not in publisher.range_metrics:
+            return await self.reply(request, {"error": f"metric {request['metric']} is not available for this watch"})
+        cached = self.cache.get(self.cache_key(publisher, request))
+        if cached is not None:
+            return await self.reply(request, self.answer(publisher, request, cached))
+        if len(self._pending) >= self.max_pending:
+            return await self.reply(request, {"error": "busy"})
+        self._pending.append((publisher, request))
+        if self._batch is None or self._batch.done():
+            self._batch = asyncio.create_task(self.run_batch())
+
+    async def run_batch(self):
+        await asyncio.sleep(self.batch_seconds)   # let a burst of requests collect
+        while self._pending:
+            batch, self._pending = self._pending, []
+            by_db = {}
+            for publisher, request in batch:
+                by_db.setdefault(publisher.db_path, []).append((publisher, request))
+            loop = asyncio.get_running_loop()
+            for db_path, requests in by_db.items():
+                try:
+                    results = await loop.run_in_executor(self.executor, self.read_all, db_path, requests)
+                except Exception as e:
+                    self.logger.error(f"Query batch on {db_path} failed: {e}")
+                    results = [{"error": "database not readable"}] * len(requests)
+                for (publisher, request), result in zip(requests, results):
+                    await self.reply(request, result)
+
+    def read_all(self, db_path, requests):
+        """Answer requests for one database from a single snapshot. Runs in a worker thread."""
+        answers = []
+        with self.open_snapshot(db_path) as conn:
+            cursor = conn.cursor()
+            for publisher, request in requests:
+                key = self.cache_key(publisher, request)
+                with publisher.query_budget.limit(conn, budget_name(request)) as budget:
+                    try:
+                        result = self.read_range(cursor, publisher, request)
+                    except Exception as e:
+                        answers.append({"error": "timed out" if budget.timed_out else str(e)})
+                        continue
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+                answers.append(self.answer(publisher, request, result))
+        return answers
+
+    def read_range(self, cursor, publisher, request):
+        """(value, samples) of a request: from the database, and for the part before the watch's oldest
+        sample there, from the sample archive."""
+        spec, aggregate = publisher.range_metrics[request["metric"]], request["aggregate"]
+        start, end, device_id = request["start"], request["end"], publisher.get_device_id(cursor)
+        if publisher.archive is None or read_archive is None:
+            return range_aggregate(cursor, spec, aggregate, start, end, device_id)
+        table = spec[0]
+        cursor.execute(f"SELECT MIN(TIMESTAMP) FROM {table} WHERE DEVICE_ID = ?", (device_id,))
+        oldest = cursor.fetchone()[0]
+        oldest = None if oldest is None else -(-oldest // timestamp_scale(cursor, table))   # first whole second
+        if oldest is not None and start >= oldest:
+            return range_aggregate(cursor, spec, aggregate, start, end, device_id)
+        split = end if oldest is None else min(end, oldest)
+        partial = "sum" if aggregate == "avg" else aggregate
+        parts = [archive_aggregate(publisher.archive.directory, spec, partial, start, split)]
+        if split < end:
+            parts.append(range_aggregate(cursor, spec, partial, split, end, device_id))
+        return combine(aggregate, parts)
+
+    def answer(self, publisher, request, result):
+        return {
+            "metric": request["metric"],
+            "aggregate": request["aggregate"],
+            "start": datetime.fromtimestamp(request["start"], self.tz).isoformat(),
+            "end": datetime.fromtimestamp(request["end"], self.tz).isoformat(),
+            "device": f"{publisher.user_name}_{publisher.device_name}",
+            "value": result[0],
+            "samples": result[1],
+        }
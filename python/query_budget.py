@@ -0,0 +1,66 @@
+"""
+Adaptive per-sensor time budgets for queries against the DB snapshot.
+Each sensor keeps a short history of how long its query took, and the budget for the next run is a
+multiple of the slowest recent run, kept between a floor and a ceiling. The budget is enforced with
+sqlite3's progress handler, which interrupts the running statement once the deadline has passed.
+"""
+
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class BudgetState:
+    """What happened to one query run under a budget."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.timed_out = False
+        self.elapsed = 0.0
+        self.steps = 0
+        self.record = True   # set to False when the run did not reflect the query's cost
+
+
+class QueryBudget:
+    def __init__(self, maximum=10.0, minimum=0.5, factor=4.0, history=20, check_every=1000):
+        self.maximum = maximum          # Budget ceiling, also used before a sensor has any history
+        self.minimum = minimum          # Floor, so a normally instant query still tolerates a slow disk
+        self.factor = factor            # Headroom over the slowest recent run
+        self.check_every = check_every  # SQLite VM instructions between deadline checks
+        self.history = defaultdict(lambda: deque(maxlen=history))
+
+    def budget(self, name) -> float:
+        """Seconds the named query may run before it is interrupted."""
+        recent = self.history[name]
+        if not recent:
+            return self.maximum
+        return min(self.maximum, max(self.minimum, self.factor * max(recent)))
+
+    def record(self, name, seconds):
+        self.history[name].append(seconds)
+
+    @contextmanager
+    def limit(self, conn, name):
+        """Interrupt any statement on conn that runs past the named query's budget."""
+        state = BudgetState(self.budget(name))
+        start = time.monotonic()
+        deadline = start + state.budget
+
+        def progress():
+            state.steps += self.check_every
+            if time.monotonic() > deadline:
+                state.timed_out = True
+                return 1  # non-zero aborts the statement with "interrupted"
+            return 0
+
+        conn.set_progress_handler(progress, self.check_every)
+        try:
+            yield state
+        finally:
+            conn.set_progress_handler(None, 0)
+            state.elapsed = time.monotonic() - start
+            # A timed-out run is recorded too, so a query that is legitimately slow earns a larger
+            # budget next time, up to the ceiling. A run answered from the result cache is not: its
+            # near-zero time would shrink the budget the next real run gets.
+            if state.record:
+                self.record(name, state.elapsed)
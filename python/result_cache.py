@@ -0,0 +1,195 @@
+"""
+Query results kept from one cycle to the next, for tables that have not changed in between.
+Sensor queries run through a CachingCursor. A result is stored under the SQL text, its parameters,
+and a change token of every table the statement reads. Tokens are computed at most once per table per
+snapshot, and are cheap:
+
+- small tables (DEVICE, USER): the row count and a hash of every row;
+- tables with a TIMESTAMP column (samples, battery levels, sleep stages): the row count, the newest
+  TIMESTAMP and a hash of the rows of the last recent_seconds before it. Gadgetbridge writes these with
+  INSERT OR REPLACE into WITHOUT ROWID tables keyed on TIMESTAMP and DEVICE_ID, so a sync that rewrites
+  the current minute changes neither the row count nor any key; the hash of the recent rows catches it.
+  Rewrites of rows older than that, with no new row at all, go unnoticed until the next new sample;
+- other large rowid tables: the row count, the largest rowid and a hash of the last small_rows rows.
+
+A DEVICE or USER lookup is then answered from memory until their content changes, and a weekly or
+monthly total until the table gets a new or rewritten sample, e.g. when only the battery level changed.
+Statements reading a WITHOUT ROWID table without a TIMESTAMP column are never cached.
+
+The tables a statement reads are found with an SQLite authorizer the first time the statement runs.
+Statements that call date/time or random functions depend on more than the tables and are never
+cached; neither are results longer than max_rows.
+"""
+
+import hashlib
+import sqlite3
+from collections import OrderedDict
+
+VOLATILE_FUNCTIONS = {
+    "date", "time", "datetime", "julianday", "strftime", "unixepoch", "random", "randomblob",
+    "changes", "total_changes", "last_insert_rowid",
+}
+
+
+class ResultCache:
+    def __init__(self, max_entries=256, max_rows=1000, small_rows=1000, recent_seconds=86400):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.small_rows = small_rows   # largest table whose content is hashed for a change token
+        self.recent_seconds = recent_seconds   # span of a TIMESTAMP table hashed for its change token
+        self.entries = OrderedDict()   # key -> (description, rows), least recently used first
+        self.tables = {}               # sql -> tables it reads, or None if it cannot be cached
+        self.tokens = {}               # table -> change token (None = not cacheable), for the current snapshot
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def new_snapshot(self):
+        self.tokens = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return round(100 * self.hits / total, 1) if total else None
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "max_entries": self.max_entries}
+
+    def token(self, conn, table):
+        if table not in self.tokens:
+            self.tokens[table] = table_token(conn, table, self.small_rows, self.recent_seconds)
+        return self.tokens[table]
+
+    def key(self, conn, sql, params, tables):
+        """Cache key of a statement, or None if a table it reads cannot be cached."""
+        tokens = tuple(self.token(conn, t) for t in tables)
+        return None if None in tokens else (sql, params, tokens)
+
+
+def table_token(conn, table, small_rows, recent_seconds):
+    """Change token of a table (see the module docstring), or None if it cannot be cached."""
+    try:
+        count, newest = conn.execute(f'SELECT COUNT(*), MAX(TIMESTAMP) FROM "{table}"').fetchone()
+    except sqlite3.OperationalError:   # no TIMESTAMP column
+        pass
+    else:
+        if not count:
+            return 0,
+        since = newest - recent_seconds * (1000 if newest > 10**11 else 1)   # TIMESTAMP in ms or s
+        recent = conn.execute(f'SELECT * FROM "{table}" WHERE TIMESTAMP >= ? ORDER BY TIMESTAMP', (since,)).fetchall()
+        return count, newest, content_hash(recent)
+    try:
+        count, last = conn.execute(f'SELECT COUNT(*), MAX(_rowid_) FROM "{table}"').fetchone()
+    except sqlite3.OperationalError:   # WITHOUT ROWID and no TIMESTAMP: rows are replaced in place by their key
+        return None
+    if count <= small_rows:
+        return count, content_hash(conn.execute(f'SELECT * FROM "{table}" ORDER BY _rowid_').fetchall())
+    tail = conn.execute(f'SELECT * FROM "{table}" WHERE _rowid_ > ? ORDER BY _rowid_', (last - small_rows,)).fetchall()
+    return count, last, content_hash(tail)
+
+
+def content_hash(rows):
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+
+def tables_read(conn, sql, params):
+    """Run the statement with an authorizer that records the tables it reads.
+    Returns (cursor, tables); tables is None if the result depends on anything else."""
+    tables, volatile = set(), []
+
+    def authorizer(action, arg1, arg2, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and arg1:
+            tables.add(arg1)
+        elif action == sqlite3.SQLITE_FUNCTION and arg2 and arg2.lower() in VOLATILE_FUNCTIONS:
+            volatile.append(arg2)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        cursor = conn.execute(sql, params)
+    finally:
+        conn.set_authorizer(None)
+    return cursor, (None if volatile or not tables else sorted(tables - {"sqlite_master", "sqlite_schema"}))
+
+
+class CachingCursor:
+    """The part of the sqlite3 cursor interface the sensor queries use, answered from a ResultCache
+    when the tables behind a statement have not changed."""
+
+    def __init__(self, conn, cache):
+        self.conn = conn
+        self.cache = cache
+        self.misses = 0          # statements this cursor had to run, for the caller's bookkeeping
+        self.description = None
+        self._rows = ()
+        self._next = 0           # index of the next row in _rows
+        self._cursor = None      # the real cursor, while an uncached result is being read
+
+    def execute(self, sql, params=()):
+        params = tuple(params)
+        tables = self.cache.tables.get(sql, False)
+        key = None
+        if tables:
+            key = self.cache.key(self.conn, sql, params, tables)
+        if key is not None:
+            entry = self.cache.get(key)
+            if entry is not None:
+                self.cache.hits += 1
+                self.description, self._rows = entry
+                self._next, self._cursor = 0, None
+                return self
+        self.cache.misses += 1
+        self.misses += 1
+        if tables is False:
+            cursor, tables = tables_read(self.conn, sql, params)
+            self.cache.tables[sql] = tables
+            if tables:
+                key = self.cache.key(self.conn, sql, params, tables)
+        else:
+            cursor = self.conn.execute(sql, params)
+        self.description = cursor.description
+        self._rows, self._next = tuple(cursor.fetchmany(self.cache.max_rows + 1)), 0
+        if len(self._rows) <= self.cache.max_rows:
+            self._cursor = None
+            if key is not None:
+                self.cache.put(key, (self.description, self._rows))
+        else:
+            self._cursor = cursor   # too long to keep; the rest is read straight from SQLite
+        return self
+
+    def fetchone(self):
+        if self._next < len(self._rows):
+            self._next += 1
+            return self._rows[self._next - 1]
+        return self._cursor.fetchone() if self._cursor else None
+
+    def fetchmany(self, size=1):
+        rows = list(self._rows[self._next:self._next + size])
+        self._next += len(rows)
+        if len(rows) < size and self._cursor:
+            rows += self._cursor.fetchmany(size - len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = list(self._rows[self._next:])
+        self._next = len(self._rows)
+        if self._cursor:
+            rows += self._cursor.fetchall()
+            self._cursor = None
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
@@ -0,0 +1,129 @@
+"""
+Compressed columnar archive of the raw sample tables, one file per table, device and month.
+Rows are copied out of the snapshot incrementally: each table has a TIMESTAMP watermark in the state
+file, and only rows past it are read. Every numeric column becomes one array in a np.savez_compressed
+file, so long-range analysis loads a few compact arrays instead of scanning the growing database.
+
+Layout: <ARCHIVE_DIR>/<MAC without colons>/<TABLE>/<YYYY-MM>.npz, months in UTC. The newest month of
+a table is <YYYY-MM>.open.npz and is rewritten as rows arrive. As soon as rows of a later month are
+archived it is renamed to <YYYY-MM>.npz and never written again. TIMESTAMP is kept as stored (seconds
+or milliseconds, see the "timestamp_scale" array); integer columns with NULLs are stored as floats
+with NaN.
+"""
+
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+
+from sample_stream import iter_sample_batches, timestamp_scale
+
+OPEN_SUFFIX = ".open.npz"
+
+
+def archive_columns(cursor, table):
+    """TIMESTAMP and the other numeric columns of a table, without DEVICE_ID (one folder per device)."""
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    columns = []
+    for _, name, declared, *_ in cursor.fetchall():
+        declared = (declared or "").upper()
+        if name not in ("TIMESTAMP", "DEVICE_ID") and not any(t in declared for t in ("CHAR", "TEXT", "CLOB", "BLOB")):
+            columns.append(name)
+    return ["TIMESTAMP"] + columns
+
+
+def month_of(timestamp, scale):
+    return datetime.fromtimestamp(timestamp // scale, timezone.utc).strftime("%Y-%m")
+
+
+def to_arrays(rows, columns):
+    data = {}
+    for i, column in enumerate(columns):
+        values = [row[i] for row in rows]
+        if any(v is None or isinstance(v, float) for v in values):
+            data[column] = np.array([np.nan if v is None else v for v in values], dtype=float)
+        else:
+            data[column] = np.array(values, dtype=np.int64)
+    return data
+
+
+def load_partition(path):
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
+
+
+def save_partition(path, data):
+    """Write atomically, so a crash never leaves half a partition."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".archive-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **data)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.remove(tmp_path)
+        raise
+
+
+class SampleArchive:
+    def __init__(self, directory, batch_rows=50000):
+        self.directory = directory
+        self.batch_rows = batch_rows
+
+    def archive_table(self, conn, table, since, device_id=None):
+        """Append rows with TIMESTAMP > since. Yields (rows archived, new watermark) after each batch,
+        so the caller can save the watermark as it goes."""
+        cursor = conn.cursor()
+        scale = timestamp_scale(cursor, table)
+        columns = archive_columns(cursor, table)
+        for rows in iter_sample_batches(cursor, table, columns, since, self.batch_rows, device_id):
+            self.append(table, columns, rows, scale)
+            yield len(rows), rows[-1][0]
+
+    def append(self, table, columns, rows, scale):
+        folder = os.path.join(self.directory, table)
+        os.makedirs(folder, exist_ok=True)
+        months = {}
+        for row in rows:
+            months.setdefault(month_of(row[0], scale), []).append(row)
+        for month, month_rows in months.items():   # oldest first, as rows are sorted
+            self.close_before(folder, month)
+            if os.path.exists(os.path.join(folder, f"{month}.npz")):
+                continue   # closed and immutable; these rows were archived before a crash
+            path = os.path.join(folder, month + OPEN_SUFFIX)
+            data = to_arrays(month_rows, columns)
+            if os.path.exists(path):
+                # Rows at or past the first new one were written before a crash lost the watermark
+                previous = load_partition(path)
+                keep = previous["TIMESTAMP"] < data["TIMESTAMP"][0]
+                data = {c: np.concatenate([previous[c][keep], data[c]]) for c in columns}
+            data["timestamp_scale"] = np.array(scale)
+            save_partition(path, data)
+
+    def close_before(self, folder, month):
+        for name in os.listdir(folder):
+            if name.endswith(OPEN_SUFFIX) and name[:7] < month:
+                os.replace(os.path.join(folder, name), os.path.join(folder, name[:7] + ".npz"))
+
+
+def read_archive(directory, table, start=None, end=None):
+    """Columns of an archived table as arrays, for start <= TIMESTAMP < end (Unix seconds, either may be
+    None). TIMESTAMP is returned in seconds. directory is the device folder, <ARCHIVE_DIR>/<MAC>."""
+    folder = os.path.join(directory, table)
+    first = month_of(start, 1) if start is not None else ""
+    last = month_of(end, 1) if end is not None else "9999-99"
+    parts = []
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if name.endswith(".npz") and not name.startswith(".") and first <= name[:7] <= last:
+            data = load_partition(os.path.join(folder, name))
+            data["TIMESTAMP"] = data["TIMESTAMP"] // int(data.pop("timestamp_scale"))
+            keep = np.ones(len(data["TIMESTAMP"]), dtype=bool)
+            if start is not None:
+                keep &= data["TIMESTAMP"] >= start
+            if end is not None:
+                keep &= data["TIMESTAMP"] < end
+            parts.append({c: v[keep] for c, v in data.items()})
+    if not parts:
+        return {}
+    columns = [c for c in parts[0] if all(c in p for p in parts)]   # a schema change may add columns
+    return {c: np.concatenate([p[c] for p in parts]) for c in columns}
@@ -0,0 +1,29 @@
+"""
+Helpers for reading raw sample tables incrementally.
+Gadgetbridge stores activity samples with TIMESTAMP in seconds, but heart rate, SpO2 and sleep stage
+samples in milliseconds, so callers ask timestamp_scale() which one a table uses.
+"""
+
+
+def timestamp_scale(cursor, table) -> int:
+    """1000 if the table's TIMESTAMP column holds milliseconds, 1 if it holds seconds."""
+    cursor.execute(f"SELECT MAX(TIMESTAMP) FROM {table}")
+    row = cursor.fetchone()
+    return 1000 if row and row[0] and row[0] > 10**11 else 1
+
+
+def iter_sample_batches(cursor, table, columns, since, batch_size=500, device_id=None):
+    """Yield lists of rows with TIMESTAMP > since, oldest first, batch_size rows at a time.
+    One query is run and read with fetchmany, so memory use does not depend on how many rows match.
+    columns must start with TIMESTAMP."""
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE TIMESTAMP > ?"
+    params = [since]
+    if device_id is not None:
+        query += " AND DEVICE_ID = ?"
+        params.append(device_id)
+    cursor.execute(query + " ORDER BY TIMESTAMP", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
@@ -0,0 +1,159 @@
+"""
+Output sinks: other places the data of a cycle goes, next to MQTT.
+A sink gets every cycle's sensor values and the raw samples that arrived since the last cycle, read
+once from the same snapshot for all sinks. It buffers and writes in batches on its own schedule.
+
+LineProtocolSink writes InfluxDB line protocol to a file, a TCP socket or a Unix socket:
+    gadgetbridge,device=alice_colmi_r02 daily_steps=5321i,latest_heart_rate=71i 1792400000000000000
+    activity,device=alice_colmi_r02 STEPS=42i,DISTANCE=30i 1792399940000000000
+Lines are written when batch_lines have collected or every flush_seconds. When the target is slow or
+down, writers wait for room (back-pressure, which also slows the snapshot stage feeding samples); after
+block_seconds without room the oldest buffered lines are dropped and counted.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+
+
+class Sink:
+    """Interface of an output sink. All methods run on the event loop."""
+
+    wants_samples = True
+
+    async def write_values(self, device, values, timestamp):
+        """One cycle's sensor values {unique_id: value}; timestamp in Unix seconds."""
+
+    async def write_samples(self, device, stream, columns, rows, scale):
+        """Raw sample rows, columns[0] being TIMESTAMP in seconds (scale 1) or milliseconds (1000)."""
+
+    async def run(self):
+        """Background work, such as flushing on a timer. Runs for the life of the process."""
+
+
+def escape_tag(value):
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def field_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def line(measurement, tags, fields, timestamp_ns):
+    """One line of line protocol, or None if there are no fields to write."""
+    field_text = ",".join(f"{escape_tag(k)}={field_value(v)}" for k, v in fields.items() if v is not None)
+    if not field_text:
+        return None
+    tag_text = "".join(f",{escape_tag(k)}={escape_tag(v)}" for k, v in tags.items())
+    return f"{escape_tag(measurement)}{tag_text} {field_text} {timestamp_ns}"
+
+
+class LineProtocolSink(Sink):
+    def __init__(self, target, batch_lines=500, flush_seconds=10.0, max_buffered=10000, block_seconds=30.0,
+                 samples=True):
+        self.target = target          # file path, tcp://host:port or unix:/path
+        self.batch_lines = batch_lines
+        self.flush_seconds = flush_seconds
+        self.max_buffered = max_buffered
+        self.block_seconds = block_seconds
+        self.wants_samples = samples
+        self.logger = logging.getLogger(__name__)
+        self.buffer = deque()
+        self.written = 0
+        self.dropped = 0
+        self._room = asyncio.Event()
+        self._room.set()
+        self._writer = None           # stream writer of a socket target, while connected
+        self._flush_lock = asyncio.Lock()
+        self._flushes = set()         # background flushes started by add, referenced until they finish
+
+    async def write_values(self, device, values, timestamp):
+        fields = {k: v for k, v in values.items() if isinstance(v, (int, float, str))}
+        await self.add([line("gadgetbridge", {"device": device}, fields, int(timestamp * 1e9))])
+
+    async def write_samples(self, device, stream, columns, rows, scale):
+        ns = 10**9 // scale
+        await self.add([
+            line(stream, {"device": device}, dict(zip(columns[1:], row[1:])), row[0] * ns) for row in rows
+        ])
+
+    async def add(self, lines):
+        lines = [text for text in lines if text]
+        while self.buffer and len(self.buffer) + len(lines) > self.max_buffered:
+            self._room.clear()
+            if not self._flushes:
+                task = asyncio.create_task(self.flush())
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+            try:
+                await asyncio.wait_for(self._room.wait(), self.block_seconds)
+            except asyncio.TimeoutError:
+                excess = len(self.buffer) + len(lines) - self.max_buffered
+                self.buffer.extend(lines)
+                for _ in range(excess):
+                    self.buffer.popleft()
+                self.dropped += excess
+                self.logger.warning(f"Line protocol target {self.target} is not keeping up; dropped {excess} lines")
+                return
+        self.buffer.extend(lines)
+        if len(self.buffer) >= self.batch_lines:
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self.buffer:
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_lines, len(self.buffer)))]
+                try:
+                    await self.send(("\n".join(batch) + "\n").encode())
+                except OSError as e:
+                    self.buffer.extendleft(reversed(batch))   # keep them for the next try
+                    self.logger.warning(f"Could not write line protocol to {self.target}: {e}")
+                    self._writer = None
+                    return
+                self.written += len(batch)
+            self._room.set()
+
+    async def send(self, data):
+        if self.target.startswith(("tcp://", "unix:")):
+            if self._writer is None:
+                if self.target.startswith("tcp://"):
+                    host, port = self.target[len("tcp://"):].rsplit(":", 1)
+                    _, self._writer = await asyncio.open_connection(host, int(port))
+                else:
+                    _, self._writer = await asyncio.open_unix_connection(self.target[len("unix:"):])
+            self._writer.write(data)
+            await self._writer.drain()   # waits while the reader is slow
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.append_file, data)
+
+    def append_file(self, data):
+        with open(self.target, "ab") as f:
+            f.write(data)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+def make_sinks():
+    """The sinks configured in the environment."""
+    sinks = []
+    target = os.getenv("LINE_PROTOCOL_TARGET", "")
+    if target:
+        sinks.append(LineProtocolSink(
+            target,
+            batch_lines=int(os.getenv("LINE_PROTOCOL_BATCH_LINES", "500")),
+            flush_seconds=float(os.getenv("LINE_PROTOCOL_FLUSH_SECONDS", "10")),
+            max_buffered=int(os.getenv("LINE_PROTOCOL_MAX_BUFFERED", "10000")),
+            block_seconds=float(os.getenv("LINE_PROTOCOL_BLOCK_SECONDS", "30")),
+            samples=os.getenv("LINE_PROTOCOL_SAMPLES", "true").lower() == "true",
+        ))
+    return sinks
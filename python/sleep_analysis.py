@@ -0,0 +1,112 @@
+"""
+Sleep analysis over the per-segment sleep stage tables (COLMI_SLEEP_STAGE_SAMPLE, MOYOUNG_SLEEP_STAGE_SAMPLE).
+Each row is one segment: TIMESTAMP (ms) when it started, DURATION in minutes and STAGE
+(0 awake, 1 REM, 2 light, 3 deep). A night is the noon-to-noon window, in local time, ending on a date.
+
+A night's segments are loaded once as a NumPy array and stage totals, sleep onset and offset,
+awakenings and efficiency are computed on whole columns rather than row by row. Nights that are over
+are kept in SleepEngine.cache, so each publish only reads the newest night from the database.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+STAGES = ("awake", "rem", "light", "deep")   # index is the STAGE value
+AVERAGED = ("total", "deep", "light", "rem", "awake", "efficiency", "awakenings")
+
+
+def local_noon(day: date, tz):
+    noon = datetime(day.year, day.month, day.day, 12)
+    return tz.localize(noon) if hasattr(tz, "localize") else noon.replace(tzinfo=tz)  # pytz zones need localize
+
+
+def night_window(night: date, tz):
+    """(start, end) in epoch seconds of the noon-to-noon window ending at noon on `night`.
+    Across a DST change the window is 23 or 25 hours long."""
+    return int(local_noon(night - timedelta(days=1), tz).timestamp()), int(local_noon(night, tz).timestamp())
+
+
+def load_segments(cursor, table, start, end, scale, device_id=None):
+    """Segments with start in [start, end) as an (n, 3) int64 array of [start_s, minutes, stage]."""
+    query = f"SELECT TIMESTAMP, DURATION, STAGE FROM {table} WHERE TIMESTAMP >= ? AND TIMESTAMP < ?"
+    params = [start * scale, end * scale]
+    if device_id is not None:
+        query += " AND DEVICE_ID = ?"
+        params.append(device_id)
+    cursor.execute(query + " ORDER BY TIMESTAMP", params)
+    segments = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    segments[:, 0] //= scale
+    return segments
+
+
+def split_nights(segments, edges):
+    """Split segments sorted by start at the window edges: len(edges) - 1 arrays."""
+    index = np.searchsorted(segments[:, 0], edges)
+    return [segments[index[i]:index[i + 1]] for i in range(len(edges) - 1)]
+
+
+def analyse_night(segments):
+    """Summary of one night. Durations are in hours, onset/offset in epoch seconds."""
+    start, minutes, stage = segments[:, 0], segments[:, 1], np.clip(segments[:, 2], 0, 3)
+    totals = np.bincount(stage, weights=minutes, minlength=4) / 60
+    summary = {name: round(float(totals[i]), 2) for i, name in enumerate(STAGES)}
+    summary["total"] = round(float(totals[1:].sum()), 2)
+    summary.update(onset=None, offset=None, awakenings=None, efficiency=None)
+
+    asleep = stage > 0
+    if not asleep.any():
+        return summary
+    end = start + minutes * 60
+    sleep_index = np.flatnonzero(asleep)
+    first, last = sleep_index[0], sleep_index[-1]
+    # An awakening is a sleep segment followed by an awake one, before the final sleep segment
+    wakes = np.flatnonzero(asleep[:-1] & ~asleep[1:])
+    in_bed = (end.max() - start.min()) / 3600
+    summary.update(
+        onset=int(start[first]),
+        offset=int(end[last]),
+        awakenings=int(np.count_nonzero(wakes < last)),
+        efficiency=round(100 * summary["total"] / float(in_bed), 1) if in_bed > 0 else None,
+    )
+    return summary
+
+
+def rolling_average(nights, keys=AVERAGED):
+    """Mean of each key over the nights that have a value for it."""
+    if not nights:
+        return {}
+    values = np.array([[np.nan if n[k] is None else n[k] for k in keys] for n in nights], dtype=float)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    sums = np.nansum(values, axis=0)
+    return {k: (round(float(s / c), 2) if c else None) for k, s, c in zip(keys, sums, counts)}
+
+
+class SleepEngine:
+    def __init__(self, table, tz, nights=7):
+        self.table = table
+        self.tz = tz
+        self.nights = nights          # nights in the rolling average, including the newest
+        self.cache = {}               # night date (iso) -> summary, for nights that are over
+
+    def summary(self, cursor, scale, data_until, today=None, device_id=None):
+        """Analyse the newest night and return it with the rolling average over the last nights.
+        data_until (epoch seconds) is how far the watch has synced; a night is only cached once the
+        data reaches past its end, so a late sync still gets counted."""
+        today = today or datetime.now(self.tz).date()
+        dates = [today - timedelta(days=n) for n in range(self.nights - 1, -1, -1)]
+        missing = [d for d in dates if d.isoformat() not in self.cache]   # always includes today
+        windows = [night_window(d, self.tz) for d in missing]
+        segments = load_segments(cursor, self.table, windows[0][0], windows[-1][1], scale, device_id)
+        # Missing nights may have cached ones between them; split on every window edge
+        edges = sorted({edge for window in windows for edge in window})
+        by_start = dict(zip(edges[:-1], split_nights(segments, edges)))
+        fresh = {}
+        for night, (start, end) in zip(missing, windows):
+            fresh[night] = analyse_night(by_start[start])
+            if night != today and end <= data_until:
+                self.cache[night.isoformat()] = fresh[night]
+        for key in [k for k in self.cache if k < dates[0].isoformat()]:
+            del self.cache[key]
+        history = [fresh.get(d) or self.cache.get(d.isoformat()) for d in dates]
+        return {"night": fresh[today], "average": rolling_average([n for n in history if n["onset"]])}
@@ -0,0 +1,49 @@
+"""
+Small persistent state file for cursors and watermarks that must survive a restart.
+The whole file is rewritten atomically (temporary file, fsync, rename), so a crash mid-write leaves
+the previous version in place.
+"""
+
+import json
+import logging
+import os
+import tempfile
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.data = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable state file {self.path}: {e}")
+            return {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def clear(self):
+        self.data = {}
+
+    def save(self):
+        directory = os.path.dirname(self.path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".state-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.error(f"Could not write state file {self.path}: {e}")
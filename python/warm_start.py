@@ -0,0 +1,48 @@
+"""
+What the publisher needs to carry on after a restart without starting cold.
+Next to the watermarks the stages already keep in the state file, a checkpoint after every cycle
+stores the database header and mtime of the snapshot it read, a hash of every payload published
+(sensor states and discovery configs), and the cached days and nights of the trend and sleep engines.
+
+On start the checkpoint is only used if the database header still matches: a different page size,
+user_version (Gadgetbridge's schema version) or application id means another database, and all saved
+state is dropped. If the database has not changed at all since the checkpoint, the checkpoint is from
+the same local day and no MQTT 5 state is due for a refresh before it expires, the first cycle is
+skipped; otherwise only the payloads that differ from the ones already on the broker are published.
+"""
+
+import hashlib
+import struct
+
+HEADER_FIELDS = ("page_size", "change_counter", "user_version", "application_id")
+IDENTITY_FIELDS = ("page_size", "user_version", "application_id")
+
+
+def db_header(path):
+    """The fields of the SQLite file header we compare, or None if the file is missing or not SQLite."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(100)
+    except OSError:
+        return None
+    if len(header) < 100 or not header.startswith(b"SQLite format 3\0"):
+        return None
+    page_size = struct.unpack(">H", header[16:18])[0]
+    return {
+        "page_size": 65536 if page_size == 1 else page_size,
+        "change_counter": struct.unpack(">I", header[24:28])[0],
+        "user_version": struct.unpack(">I", header[60:64])[0],
+        "application_id": struct.unpack(">I", header[68:72])[0],
+    }
+
+
+def same_database(saved, current):
+    return all(saved.get(field) == current.get(field) for field in IDENTITY_FIELDS)
+
+
+def unchanged(saved, current):
+    return all(saved.get(field) == current.get(field) for field in HEADER_FIELDS)
+
+
+def payload_hash(payload):
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
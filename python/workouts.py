@@ -0,0 +1,90 @@
+"""
+Workouts from Gadgetbridge's BASE_ACTIVITY_SUMMARY table.
+New workouts are found by _id: every cycle only rows past the last _id seen are read, so the table is
+never scanned as a whole. SUMMARY_DATA (a JSON text that can be large) is only parsed for those rows,
+and the raw summary blob is never read.
+
+SUMMARY_DATA maps names to {"value": ..., "unit": ...}; which names are present depends on the device.
+"""
+
+import json
+from datetime import datetime
+
+# Gadgetbridge ActivityKind codes for the kinds a workout summary usually has
+ACTIVITY_KINDS = {
+    0: "unknown", 1: "activity", 16: "running", 32: "walking", 64: "swimming", 128: "cycling",
+    256: "treadmill", 512: "exercise", 1024: "open_water_swimming", 2048: "indoor_cycling",
+    4096: "elliptical_trainer", 8192: "jump_rope", 16384: "yoga", 32768: "soccer", 65536: "rowing_machine",
+    131072: "cricket", 262144: "basketball", 524288: "table_tennis", 1048576: "badminton",
+    2097152: "strength_training",
+}
+
+# Event field -> SUMMARY_DATA names different devices use for it
+SUMMARY_FIELDS = {
+    "active_seconds": ("activeSeconds",),
+    "distance": ("distanceMeters", "distance"),
+    "calories": ("caloriesBurnt", "calories", "activeCalories"),
+    "steps": ("steps",),
+    "average_heart_rate": ("averageHR", "averageHeartRate", "heartRateAvg"),
+    "max_heart_rate": ("maxHR", "maxHeartRate", "heartRateMax"),
+    "min_heart_rate": ("minHR", "minHeartRate", "heartRateMin"),
+}
+
+
+def parse_summary(text):
+    """The SUMMARY_DATA fields we publish, as plain numbers. Unknown or broken summaries give {}."""
+    if not text:
+        return {}
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    fields = {}
+    for field, names in SUMMARY_FIELDS.items():
+        for name in names:
+            value = data.get(name)
+            if isinstance(value, dict):
+                value = value.get("value")
+            if isinstance(value, (int, float)):
+                fields[field] = value
+                break
+    return fields
+
+
+class WorkoutTracker:
+    def __init__(self, tz=None):
+        self.tz = tz
+
+    def scan(self, cursor, state, device_id=None):
+        """Workouts with _id past state["last_id"], oldest first, and the new state
+        {"last_id": ..., "last": newest workout}. The first scan only picks up the newest workout."""
+        device_filter = " AND DEVICE_ID = ?" if device_id is not None else ""
+        params = [device_id] if device_id is not None else []
+        last_id = state.get("last_id")
+        if last_id is None:
+            cursor.execute(f"SELECT MAX(_id) FROM BASE_ACTIVITY_SUMMARY WHERE 1 = 1{device_filter}", params)
+            newest = cursor.fetchone()[0]
+            last_id = newest - 1 if newest is not None else 0
+        cursor.execute(
+            "SELECT _id, NAME, START_TIME, END_TIME, ACTIVITY_KIND, SUMMARY_DATA FROM BASE_ACTIVITY_SUMMARY "
+            f"WHERE _id > ?{device_filter} ORDER BY _id",
+            [last_id] + params,
+        )
+        workouts = [self.workout(row) for row in cursor.fetchall()]
+        if not workouts:
+            return [], {**state, "last_id": last_id}
+        return workouts, {"last_id": workouts[-1]["id"], "last": workouts[-1]}
+
+    def workout(self, row):
+        workout_id, name, start, end, kind, summary = row
+        return {
+            "id": workout_id,
+            "name": name,
+            "type": ACTIVITY_KINDS.get(kind, f"kind_{kind}"),
+            "start": datetime.fromtimestamp(start / 1000, self.tz).isoformat(),
+            "end": datetime.fromtimestamp(end / 1000, self.tz).isoformat(),
+            "duration_minutes": round((end - start) / 60000, 1),
+            **parse_summary(summary),
+        }